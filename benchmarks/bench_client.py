@@ -0,0 +1,117 @@
+"""
+Microbenchmarks of the DnsMeApi high level operations against the in process mock api.
+
+For every zone size each operation is timed on its own and reported with the number of http
+calls and the request / response bytes it needed.  By default every operation uses a fresh
+client, like a dnsscaling command does, --warm reuses one client per zone size.
+
+    PYTHONPATH=. python benchmarks/bench_client.py --sizes 10,1000,50000 --latency 0.03
+"""
+
+import argparse
+import json
+import sys
+import time
+
+from dnsscaling.dnsapi import DnsMeApi
+from dnsscaling.mock_dnsme import MockDnsMe
+
+SITE = 'bench.io'
+NAME = 'bench'
+IP = '192.0.2.10'
+
+
+def _add_a_record(api):
+    api.add_a_record(SITE, NAME, IP)
+
+
+def _add_txt_record(api):
+    api.add_txt_record(SITE, '_acme-challenge', 'token')
+
+
+def _reset(api):
+    api.delete_a_ip(SITE, IP)
+    api.delete_txt_record(SITE, '_acme-challenge')
+
+
+# (name, untimed setup, timed operation)
+OPERATIONS = [
+    ('add_a_record', None, _add_a_record),
+    ('delete_a_record', _add_a_record, lambda api: api.delete_a_record(SITE, NAME, ipaddress=IP)),
+    ('delete_a_ip', _add_a_record, lambda api: api.delete_a_ip(SITE, IP)),
+    ('add_txt_record', None, _add_txt_record),
+    ('delete_txt_record', _add_txt_record, lambda api: api.delete_txt_record(SITE, '_acme-challenge')),
+]
+
+
+def run(sizes, latency=0.0, warm=False, repeat=3):
+
+    results = []
+    for size in sizes:
+        mock = MockDnsMe(latency=latency)
+        mock.add_zone(SITE, records=size)
+
+        def client():
+            api = DnsMeApi(test_mode=True, credentials=mock.credentials)
+            mock.install(api)
+            return api
+
+        shared = client() if warm else None
+        for name, setup, operation in OPERATIONS:
+            best = None
+            for _ in range(repeat):
+                api = shared or client()
+                if setup is not None:
+                    setup(api)
+                    # a cold run starts from a fresh client after the setup
+                    api = shared or client()
+
+                mock.reset_stats()
+                start = time.perf_counter()
+                operation(api)
+                wall = time.perf_counter() - start
+                stats = dict(mock.stats)
+                _reset(shared or client())
+
+                row = {'operation': name, 'records': size, 'wall_ms': wall * 1000,
+                       'calls': stats['requests'], 'request_bytes': stats['request_bytes'],
+                       'response_bytes': stats['response_bytes']}
+                if best is None or row['wall_ms'] < best['wall_ms']:
+                    best = row
+            results.append(best)
+
+    return results
+
+
+def format_results(results):
+
+    lines = ['{0:<18} {1:>8} {2:>10} {3:>6} {4:>10} {5:>12}'.format(
+        'operation', 'records', 'wall ms', 'calls', 'req bytes', 'resp bytes')]
+    for x in results:
+        lines.append('{operation:<18} {records:>8} {wall_ms:>10.2f} {calls:>6} {request_bytes:>10} '
+                     '{response_bytes:>12}'.format(**x))
+    return '\n'.join(lines)
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Benchmark DnsMeApi operations against the mock api")
+    parser.add_argument('--sizes', type=str, default='10,100,1000,10000,50000',
+                        help="Comma separated zone sizes in records")
+    parser.add_argument('--latency', type=float, default=0.0, help="Simulated seconds of latency per request")
+    parser.add_argument('--repeat', type=int, default=3, help="Runs per operation, the fastest is reported")
+    parser.add_argument('--warm', action='store_true', default=False, help="[flag] Reuse one client per size")
+    parser.add_argument('--json', action='store_true', default=False, help="[flag] Print json instead of a table")
+    args = parser.parse_args()
+
+    results = run([int(x) for x in args.sizes.split(',')], latency=args.latency, warm=args.warm,
+                  repeat=args.repeat)
+    if args.json:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+    else:
+        print(format_results(results))
+
+
+if __name__ == '__main__':
+    main()
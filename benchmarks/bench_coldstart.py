@@ -0,0 +1,115 @@
+"""
+Cold start benchmark of the dnsscaling boot command.
+
+Every run starts a new python process doing what user-data does at launch, dnsscaling -a <name>,
+against the mock api served over local http, and measures the time from starting the process
+until the A record is visible in the zone, and until the process has exited.
+
+    PYTHONPATH=. python benchmarks/bench_coldstart.py --repeat 10 --latency 0.03
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from dnsscaling.mock_dnsme import API_PATH, MockDnsMe, serve
+
+SITE = 'bench.io'
+NAME = 'www'
+IP = '192.0.2.1'
+
+COMMAND = 'from dnsscaling.dnsapi import run_dnsscaling; run_dnsscaling()'
+
+
+def _visible(mock, site_id):
+    return any(x['type'] == 'A' and x['name'] == NAME and x['value'] == IP for x in mock.records(site_id))
+
+
+def run(repeat=5, latency=0.0, records=100):
+
+    mock = MockDnsMe(latency=latency)
+    site_id = mock.add_zone(SITE, records=records)
+    server = serve(mock)
+    url = 'http://127.0.0.1:%d%s' % (server.server_address[1], API_PATH)
+
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([os.getcwd()] + [x for x in [env.get('PYTHONPATH')] if x])
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        credentials = os.path.join(tmp, 'dme_credentials.json')
+        with open(credentials, 'w') as f:
+            f.write(json.dumps(mock.credentials))
+
+        try:
+            for _ in range(repeat):
+                for record in mock.records(site_id):
+                    if record['name'] == NAME:
+                        mock._remove(site_id, record['id'])
+                mock.reset_stats()
+
+                start = time.perf_counter()
+                process = subprocess.Popen([sys.executable, '-c', COMMAND, '-a', NAME + '.' + SITE, '--api_url', url,
+                                            '--ipaddress', IP, '--credentials', credentials], env=env)
+                visible = None
+                while visible is None:
+                    running = process.poll() is None
+                    if _visible(mock, site_id):
+                        visible = time.perf_counter() - start
+                    elif not running:
+                        break
+                    else:
+                        time.sleep(0.001)
+                process.wait()
+                exited = time.perf_counter() - start
+
+                if process.returncode != 0 or visible is None:
+                    raise RuntimeError('dnsscaling -a failed with exit status %s' % process.returncode)
+                results.append({'visible_ms': visible * 1000, 'exit_ms': exited * 1000,
+                                'calls': mock.stats['requests']})
+        finally:
+            server.shutdown()
+
+    return results
+
+
+def summarize(results):
+
+    visible = [x['visible_ms'] for x in results]
+    exited = [x['exit_ms'] for x in results]
+    return {
+        'runs': len(results),
+        'visible_ms_min': min(visible),
+        'visible_ms_median': statistics.median(visible),
+        'exit_ms_min': min(exited),
+        'exit_ms_median': statistics.median(exited),
+        'calls': results[0]['calls'],
+    }
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Benchmark process start to record visible of dnsscaling -a")
+    parser.add_argument('--repeat', type=int, default=5, help="Number of processes started")
+    parser.add_argument('--latency', type=float, default=0.0, help="Simulated seconds of latency per request")
+    parser.add_argument('--records', type=int, default=100, help="Records in the zone")
+    parser.add_argument('--json', action='store_true', default=False, help="[flag] Print json instead of text")
+    args = parser.parse_args()
+
+    summary = summarize(run(repeat=args.repeat, latency=args.latency, records=args.records))
+    if args.json:
+        json.dump(summary, sys.stdout, indent=2)
+        print()
+    else:
+        for key in sorted(summary):
+            value = summary[key]
+            print('{0:<18} {1}'.format(key, '%.1f' % value if isinstance(value, float) else value))
+
+
+if __name__ == '__main__':
+    main()
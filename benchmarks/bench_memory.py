@@ -0,0 +1,93 @@
+"""
+Memory used by a zone held as the api's list of record dicts, as Record objects and as a Zone.
+
+Each form is built from a fresh json decode of a zone listing from the mock api and measured
+with tracemalloc, together with the time to build it (traced, so slower than normal) and to look
+up one name.
+
+    PYTHONPATH=. python benchmarks/bench_memory.py --records 100000
+"""
+
+import argparse
+import gc
+import json
+import sys
+import time
+import tracemalloc
+
+from dnsscaling.mock_dnsme import MockDnsMe
+from dnsscaling.records import Record, Zone
+
+
+def _measure(build, content):
+
+    gc.collect()
+    tracemalloc.start()
+    records = json.loads(content)
+    start = time.perf_counter()
+    value = build(records)
+    seconds = time.perf_counter() - start
+    del records
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return value, size, seconds
+
+
+def run(records=100000):
+
+    mock = MockDnsMe()
+    site_id = mock.add_zone('bench.io', records=records)
+    content = json.dumps(mock.records(site_id))
+    name = 'host%d' % (records // 2)
+
+    forms = [
+        ('dicts', lambda x: x, lambda zone: [r for r in zone if r['type'] == 'A' and r['name'] == name]),
+        ('records', lambda x: [Record.from_json(r) for r in x],
+         lambda zone: [r for r in zone if r.type == 'A' and r.name == name]),
+        ('zone', Zone.from_json, lambda zone: zone.find(type='A', name=name)),
+    ]
+
+    results = []
+    for form, build, find in forms:
+        zone, size, seconds = _measure(build, content)
+        start = time.perf_counter()
+        found = find(zone)
+        lookup = time.perf_counter() - start
+        assert len(found) == 1
+        results.append({'form': form, 'records': records, 'bytes': size, 'bytes_per_record': size / records,
+                        'build_ms': seconds * 1000, 'lookup_ms': lookup * 1000})
+        del zone, found
+
+    for x in results:
+        x['ratio'] = results[0]['bytes'] / x['bytes']
+    return results
+
+
+def format_results(results):
+
+    lines = ['{0:<8} {1:>8} {2:>12} {3:>10} {4:>10} {5:>10} {6:>7}'.format(
+        'form', 'records', 'bytes', 'per record', 'build ms', 'lookup ms', 'ratio')]
+    for x in results:
+        lines.append('{form:<8} {records:>8} {bytes:>12} {bytes_per_record:>10.1f} {build_ms:>10.1f} '
+                     '{lookup_ms:>10.3f} {ratio:>7.1f}'.format(**x))
+    return '\n'.join(lines)
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Compare the memory used by the record representations")
+    parser.add_argument('--records', type=int, default=100000, help="Records in the zone")
+    parser.add_argument('--json', action='store_true', default=False, help="[flag] Print json instead of a table")
+    args = parser.parse_args()
+
+    results = run(records=args.records)
+    if args.json:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+    else:
+        print(format_results(results))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+"""
+Simulation of a fleet scaling out: many instances registering their A record at the same time.
+
+Every simulated instance is a thread doing what dnsscaling -a does at boot, with its own client
+and request scheduler like a separate process, against one mock api account with the DNS made
+easy request quota, latency and optional errors.  With --delete every instance then deregisters
+like dnsscaling -r.  Times are simulated seconds: --time_scale shrinks the quota window, latency
+and boot spread so a five minute quota window runs in seconds.
+
+    PYTHONPATH=. python benchmarks/bench_scaleout.py --instances 500 --spread 60 --time_scale 0.01
+"""
+
+import argparse
+from concurrent import futures
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+from dnsscaling.dnsapi import DnsMeApi
+from dnsscaling.mock_dnsme import MockDnsMe
+from dnsscaling.ratelimit import RequestScheduler
+from dnsscaling.retry import RetryPolicy
+
+SITE = 'bench.io'
+NAME = 'www'
+
+
+def _ip(i):
+    return '10.%d.%d.%d' % (i >> 16 & 255, i >> 8 & 255, i & 255)
+
+
+def _percentile(values, fraction):
+
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def run(instances=100, spread=60.0, quota=150, window=300.0, latency=0.05, jitter=0.05, error_rate=0.0,
+        time_scale=0.01, delete=False, site_cache=False, records=0, seed=1):
+
+    mock = MockDnsMe(latency=latency * time_scale, jitter=jitter * time_scale, quota=quota,
+                     window=window * time_scale, error_rate=error_rate, seed=seed)
+    site_id = mock.add_zone(SITE, records=records)
+    starts = random.Random(seed).sample(range(instances * 10), instances)
+    starts = [x * spread * time_scale / (instances * 10) for x in starts]
+    cache_dir = tempfile.mkdtemp() if site_cache else ''
+
+    def instance(i, phase):
+
+        time.sleep(starts[i])
+        start = time.perf_counter()
+        api = DnsMeApi(test_mode=True, credentials=mock.credentials, ipaddress=_ip(i),
+                       scheduler=RequestScheduler(limit=quota, window=window * time_scale),
+                       retry_policy=RetryPolicy(base_delay=0.25 * time_scale, max_delay=8 * time_scale),
+                       site_cache_path=os.path.join(cache_dir, 'site_ids.json') if cache_dir else '')
+        mock.install(api)
+        error = ''
+        try:
+            with api:
+                if phase == 'add':
+                    api.add_a_record(SITE, NAME, api.ipaddress)
+                else:
+                    api.delete_a_ip(SITE, api.ipaddress)
+        except Exception as e:
+            error = '{0}: {1}'.format(type(e).__name__, e)
+        return {'seconds': (time.perf_counter() - start) / time_scale, 'error': error}
+
+    phases = ['add', 'delete'] if delete else ['add']
+    results = {}
+    for phase in phases:
+        mock.reset_stats()
+        with futures.ThreadPoolExecutor(max_workers=instances) as executor:
+            outcomes = list(executor.map(instance, range(instances), [phase] * instances))
+
+        seconds = [x['seconds'] for x in outcomes if not x['error']]
+        errors = {}
+        for x in outcomes:
+            if x['error']:
+                errors[x['error']] = errors.get(x['error'], 0) + 1
+        results[phase] = {
+            'instances': instances,
+            'succeeded': len(seconds),
+            'success_rate': float(len(seconds)) / instances,
+            'p50_seconds': _percentile(seconds, 0.5),
+            'p99_seconds': _percentile(seconds, 0.99),
+            'max_seconds': max(seconds) if seconds else None,
+            'calls_per_instance': float(mock.stats['requests']) / instances,
+            'rate_limited': mock.stats['rate_limited'],
+            'errors': errors,
+        }
+
+        # zone consistency after the phase
+        counts = {}
+        for record in mock.records(site_id):
+            if record['type'] == 'A' and record['name'] == NAME:
+                counts[record['value']] = counts.get(record['value'], 0) + 1
+        ok = [_ip(i) for i, x in enumerate(outcomes) if not x['error']]
+        if phase == 'add':
+            results[phase]['missing'] = len([ip for ip in ok if ip not in counts])
+            results[phase]['duplicates'] = sum(n - 1 for n in counts.values() if n > 1)
+            results[phase]['records'] = sum(counts.values())
+        else:
+            results[phase]['left_behind'] = len([ip for ip in ok if ip in counts])
+            results[phase]['records'] = sum(counts.values())
+
+    return results
+
+
+def format_results(results):
+
+    lines = []
+    for phase, x in results.items():
+        lines.append('{0}: {1}/{2} succeeded ({3:.1%})'.format(phase, x['succeeded'], x['instances'],
+                                                                x['success_rate']))
+        if x['succeeded']:
+            lines.append('  seconds        p50 {0:.2f}  p99 {1:.2f}  max {2:.2f}'.format(
+                x['p50_seconds'], x['p99_seconds'], x['max_seconds']))
+        lines.append('  calls/instance {0:.2f}  rate limited responses {1}'.format(x['calls_per_instance'],
+                                                                                  x['rate_limited']))
+        if phase == 'add':
+            lines.append('  zone           {0} records, {1} missing, {2} duplicates'.format(
+                x['records'], x['missing'], x['duplicates']))
+        else:
+            lines.append('  zone           {0} records, {1} left behind'.format(x['records'], x['left_behind']))
+        for error, count in sorted(x['errors'].items()):
+            lines.append('  {0} x {1}'.format(count, error))
+    return '\n'.join(lines)
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Simulate many instances registering at the same time")
+    parser.add_argument('--instances', type=int, default=100, help="Number of instances booting")
+    parser.add_argument('--spread', type=float, default=60.0, help="Simulated seconds the boots are spread over")
+    parser.add_argument('--quota', type=int, default=150, help="Requests allowed per quota window")
+    parser.add_argument('--window', type=float, default=300.0, help="Simulated seconds of the quota window")
+    parser.add_argument('--latency', type=float, default=0.05, help="Simulated seconds of latency per request")
+    parser.add_argument('--jitter', type=float, default=0.05, help="Simulated seconds of random extra latency")
+    parser.add_argument('--error_rate', type=float, default=0.0, help="Fraction of requests answered with a 500")
+    parser.add_argument('--time_scale', type=float, default=0.01, help="Real seconds per simulated second")
+    parser.add_argument('--records', type=int, default=0, help="Other records in the zone")
+    parser.add_argument('--delete', action='store_true', default=False, help="[flag] Deregister afterwards")
+    parser.add_argument('--site_cache', action='store_true', default=False,
+                        help="[flag] Share a site id cache file between the instances, like one on EFS")
+    parser.add_argument('--json', action='store_true', default=False, help="[flag] Print json instead of text")
+    args = parser.parse_args()
+
+    results = run(instances=args.instances, spread=args.spread, quota=args.quota, window=args.window,
+                  latency=args.latency, jitter=args.jitter, error_rate=args.error_rate, time_scale=args.time_scale,
+                  delete=args.delete, site_cache=args.site_cache, records=args.records)
+    if args.json:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+    else:
+        print(format_results(results))
+
+
+if __name__ == '__main__':
+    main()
@@ -27,7 +27,7 @@ _init_script_old = Template(
 
 start(){
     touch /var/lock/subsys/dnsscalingdelete
-    sudo /usr/bin/dnsscaling -a $url
+    sudo /usr/bin/dnsscaling -a $url$agent
     sleep 3
 }
 
@@ -60,16 +60,41 @@ exit 0
 ''')
 
 
-def write_init_script(url, path):
+def write_init_script(url, path, agent=False, agent_socket=''):
+    """
+    Write the systemd and SysV units deleting the A record of this server on shutdown.
+
+    :param url: full domain the SysV start script adds the A record of this server to
+    :param path:
+    :param agent: start the agent with the record, the shutdown script then asks it to delete the
+        record and only runs dnsscaling -r if it does not answer
+    :param agent_socket: socket of the agent, defaults to dnsapi.DEFAULT_AGENT_SOCKET
+    """
+
+    if not agent_socket:
+        from dnsscaling.dnsapi import DEFAULT_AGENT_SOCKET
+
+        agent_socket = DEFAULT_AGENT_SOCKET
+    agent_args = ' --agent --agent_socket ' + agent_socket if agent else ''
 
     with open('/etc/systemd/system/ip_removal.service', 'w') as f:
         f.write(_init_script_normal)
 
     with open('/etc/init.d/dnsscalingdelete', 'w') as f:
-        f.write(_init_script_old.substitute({'url': url}).strip())
+        f.write(_init_script_old.substitute({'url': url, 'agent': agent_args}).strip())
 
     with open('/tmp/ip_removal.sh', 'w') as f:
         s = '#!/bin/bash'
-        s = s + '\nsudo touch /home/ec2-user/efs/dns_ip_addresses/remove/$(curl http://169.254.169.254/latest/meta-data/public-ipv4)'
-        s = s + '\nsudo /usr/bin/dnsscaling -r'
+        s = s + '\nIP=$(curl http://169.254.169.254/latest/meta-data/public-ipv4)'
+        # the alive file lists the ids of the records of this instance, the worker deletes only those
+        s = s + '\nALIVE=/home/ec2-user/efs/dns_ip_addresses/alive'
+        s = s + '\nREMOVE=/home/ec2-user/efs/dns_ip_addresses/remove'
+        s = s + '\nsudo cp $ALIVE/$IP $REMOVE/$IP 2>/dev/null || sudo touch $REMOVE/$IP'
+        if agent:
+            # hand the delete to the agent started at boot, if there is none run it here
+            s = s + '\nif ! echo remove | timeout 5 nc -U ' + agent_socket + ' | grep -q "^ok"; then'
+            s = s + '\n    sudo /usr/bin/dnsscaling -r --deadline 5'
+            s = s + '\nfi'
+        else:
+            s = s + '\nsudo /usr/bin/dnsscaling -r --deadline 5'
         f.write(s)
@@ -0,0 +1,112 @@
+"""
+Persistent ACME account and directory store, so certificate runs reuse one registration
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import time
+from urllib.parse import urlparse
+
+# on the EFS mount next to the dns made easy credentials, so every host shares the account
+DEFAULT_ACCOUNT_PATH = '/home/ec2-user/efs/credentials/acme/'
+# seconds a fetched directory is reused, its endpoints change rarely
+DEFAULT_DIRECTORY_TTL = 86400
+
+
+class AcmeAccountStore(object):
+    """
+    Keeps the account key (as a JWK json), the registration and the directory of an ACME server in
+    json files in path, one set per directory url.
+
+    The library types are not used here: callers store key.to_json() and regr.to_json() and build
+    them back with from_json, so the store itself needs neither acme nor josepy.  Files are written
+    atomically and only readable by their owner, the account key is a secret.
+    """
+
+    def __init__(self, path=DEFAULT_ACCOUNT_PATH, directory_ttl=DEFAULT_DIRECTORY_TTL):
+
+        self.path = path
+        self.directory_ttl = directory_ttl
+
+    def _file(self, directory_url, kind):
+
+        url = urlparse(directory_url)
+        digest = hashlib.sha1(directory_url.encode('utf-8')).hexdigest()[:8]
+        return os.path.join(self.path, '{0}-{1}.{2}.json'.format(url.hostname or 'acme', digest, kind))
+
+    def _read(self, filename):
+
+        try:
+            with open(filename, 'r') as f:
+                return json.loads(f.read())
+        except (OSError, ValueError):
+            return None
+
+    def _write(self, filename, content):
+
+        dirname = os.path.dirname(filename)
+        os.makedirs(dirname, mode=0o700, exist_ok=True)
+        # mkstemp creates the file readable by its owner only
+        fd, tmp = tempfile.mkstemp(dir=dirname, prefix='.acme')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(json.dumps(content))
+            os.replace(tmp, filename)
+        except BaseException:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            raise
+
+    def load_account(self, directory_url):
+        """
+        Return the stored account of directory_url as a dict with key (JWK json) and regr
+        (registration json, None if the key was never registered), or None if there is none.
+        """
+
+        content = self._read(self._file(directory_url, 'account'))
+        if not content or not content.get('key'):
+            return None
+        return {'key': content['key'], 'regr': content.get('regr')}
+
+    def save_account(self, directory_url, key, regr=None):
+
+        self._write(self._file(directory_url, 'account'), {'directory_url': directory_url, 'key': key,
+                                                             'regr': regr})
+
+    def remove_account(self, directory_url):
+        """Forget the account, for example after the server reports it deactivated."""
+
+        try:
+            os.remove(self._file(directory_url, 'account'))
+        except FileNotFoundError:
+            pass
+
+    def load_directory(self, directory_url):
+        """Return the stored directory json of directory_url, or None if missing or expired."""
+
+        content = self._read(self._file(directory_url, 'directory'))
+        if not content or content.get('expires', 0) < time.time():
+            return None
+        return content.get('directory')
+
+    def save_directory(self, directory_url, directory):
+
+        if self.directory_ttl <= 0:
+            return
+        try:
+            self._write(self._file(directory_url, 'directory'),
+                        {'directory': directory, 'expires': time.time() + self.directory_ttl})
+        except OSError:
+            # the directory cache is an optimization only, an unwritable location is not an error
+            pass
+
+    def invalidate_directory(self, directory_url):
+
+        try:
+            os.remove(self._file(directory_url, 'directory'))
+        except FileNotFoundError:
+            pass
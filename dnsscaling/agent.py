@@ -0,0 +1,208 @@
+"""
+Per instance agent that holds the registration of the instance and deletes it on request
+"""
+
+import json
+import os
+import socket
+import time
+import traceback
+
+from dnsscaling.dnsapi import DEFAULT_AGENT_SOCKET as DEFAULT_SOCKET
+from dnsscaling.retry import DnsMeError
+from dnsscaling.sweeper import DEFAULT_HEARTBEAT, remove_alive, touch_alive
+
+# seconds a client may take to send its command
+CLIENT_TIMEOUT = 2.0
+
+
+class Agent(object):
+    """
+    Keeps the client, its cached site ids and the records registered for this instance in a long
+    running process, and answers one line commands on a unix socket:
+
+        ping     ok
+        status   ok <json list of the registered records>
+        remove   ok <count>, after deleting the registered records, then the agent exits
+        stop     ok, the agent exits without deleting anything
+
+    Failures are answered with 'error <message>'.  At shutdown removing the registration is then a
+    message to the socket and one DELETE per record, with no interpreter start, credential read or
+    lookups.
+
+    With alive_dir the agent touches the sweeper's alive file of every registered ip each
+    heartbeat seconds while it serves, and removes the files with the records.
+    """
+
+    def __init__(self, api, socket_path=DEFAULT_SOCKET, alive_dir=None, heartbeat=DEFAULT_HEARTBEAT):
+
+        self.api = api
+        self.socket_path = socket_path
+        self.alive_dir = alive_dir
+        self.heartbeat = heartbeat
+        # (site id, record) of every record registered for this instance
+        self.records = []
+        self._socket = None
+
+    def register(self, site_id, record):
+        self.records.append((str(site_id), record))
+
+    def handle(self, command):
+        """Run one command, returning (reply, stop serving)."""
+
+        command = command.strip()
+        if command == 'ping':
+            return 'ok', False
+        if command == 'status':
+            return 'ok ' + json.dumps([dict(record, site_id=site_id) for site_id, record in self.records]), False
+        if command == 'stop':
+            return 'ok', True
+        if command == 'remove':
+            try:
+                deleted = self.remove()
+            except Exception as e:
+                return 'error ' + str(e).replace('\n', ' '), False
+            return 'ok %d' % deleted, True
+        return 'error unknown command ' + command, False
+
+    def remove(self):
+        """Delete the registered records, a record that is already gone counts as deleted."""
+
+        deleted = 0
+        while self.records:
+            site_id, record = self.records[0]
+            try:
+                self.api.delete_a_id(site_id, record['id'])
+            except DnsMeError as e:
+                if e.status_code != 404:
+                    raise
+            self.records.pop(0)
+            if self.alive_dir:
+                remove_alive(record['value'], self.alive_dir)
+            deleted += 1
+        return deleted
+
+    def touch(self):
+        """Touch the alive files of the registered ips."""
+
+        if self.alive_dir:
+            for value in sorted({record['value'] for _, record in self.records}):
+                touch_alive(value, self.alive_dir)
+
+    def bind(self):
+        """Listen on the socket, readable by the owner (root) only."""
+
+        dirname = os.path.dirname(self.socket_path)
+        if dirname:
+            os.makedirs(dirname, mode=0o700, exist_ok=True)
+        try:
+            os.remove(self.socket_path)
+        except FileNotFoundError:
+            pass
+
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        old_umask = os.umask(0o177)
+        try:
+            sock.bind(self.socket_path)
+        finally:
+            os.umask(old_umask)
+        sock.listen(8)
+        self._socket = sock
+
+    def serve(self):
+        """Answer commands until one stops the agent."""
+
+        if self._socket is None:
+            self.bind()
+        if self.alive_dir:
+            self._socket.settimeout(self.heartbeat)
+        try:
+            touched = None
+            while True:
+                if self.alive_dir and (touched is None or time.monotonic() - touched >= self.heartbeat):
+                    self.touch()
+                    touched = time.monotonic()
+                try:
+                    conn, _ = self._socket.accept()
+                except socket.timeout:
+                    continue
+                with conn:
+                    conn.settimeout(CLIENT_TIMEOUT)
+                    try:
+                        command = conn.makefile('r').readline()
+                    except (OSError, UnicodeDecodeError):
+                        continue
+                    reply, stop = self.handle(command)
+                    try:
+                        conn.sendall((reply + '\n').encode('utf-8'))
+                    except OSError:
+                        pass
+                if stop:
+                    return
+        finally:
+            self.close()
+
+    def close(self):
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+            try:
+                os.remove(self.socket_path)
+            except FileNotFoundError:
+                pass
+
+
+def send(command, socket_path=DEFAULT_SOCKET, timeout=10.0):
+    """Send one command to a running agent and return its reply line."""
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(socket_path)
+        sock.sendall((command + '\n').encode('utf-8'))
+        return sock.makefile('r').readline().strip()
+
+
+def _daemonize():
+    """Detach into a background process; returns True in the daemon and False in the caller."""
+
+    pid = os.fork()
+    if pid > 0:
+        # reap the intermediate child, the daemon is reparented to init
+        os.waitpid(pid, 0)
+        return False
+    os.setsid()
+    if os.fork() > 0:
+        os._exit(0)
+
+    os.chdir('/')
+    with open(os.devnull, 'r+') as devnull:
+        for fd in (0, 1, 2):
+            os.dup2(devnull.fileno(), fd)
+    return True
+
+
+def start(api, site_id, record, socket_path=DEFAULT_SOCKET, alive_dir=None):
+    """
+    Start an agent holding record in a background process and return in the caller.
+
+    The socket is bound before detaching so it accepts commands as soon as this returns.  The agent
+    keeps the api client, the caller must no longer use or close it.
+    """
+
+    agent = Agent(api, socket_path=socket_path, alive_dir=alive_dir)
+    agent.register(site_id, record)
+    agent.bind()
+
+    if not _daemonize():
+        # the daemon owns the listening socket and the pooled connections now
+        agent._socket.close()
+        agent._socket = None
+        api._owns_session = False
+        return
+
+    try:
+        agent.serve()
+    except BaseException:
+        traceback.print_exc()
+    finally:
+        os._exit(0)
@@ -0,0 +1,105 @@
+"""
+Asyncio interface to the DNS made easy api for running many zone and record operations at once
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import functools
+
+from dnsscaling.dnsapi import DnsMeApi
+
+# most api calls in flight at the same time
+DEFAULT_CONCURRENCY = 10
+
+
+class AsyncDnsMeApi(object):
+    """
+    Asyncio version of DnsMeApi with the same methods as coroutines.
+
+    Every call runs the DnsMeApi method on a pool of concurrency worker threads that share one
+    DnsMeApi, so requests are signed by the same _create_headers, reuse one keep-alive connection
+    pool sized to the concurrency, and share the site id and record caches.  At most concurrency
+    operations run at once, the rest wait their turn.  A deadline (DnsMeApi.deadline) or span open
+    on the calling thread when a call is made applies to the call in its worker thread.
+
+        async with AsyncDnsMeApi(test_mode=True) as api:
+            await asyncio.gather(*[api.delete_a_ip(site, ip) for site in sites])
+    """
+
+    def __init__(self, test_mode=False, credentials_json='', concurrency=DEFAULT_CONCURRENCY, api=None,
+                 **kwargs):
+
+        self.concurrency = concurrency
+        self._owns_api = api is None
+        if api is None:
+            kwargs.setdefault('pool_size', concurrency)
+            api = DnsMeApi(test_mode=test_mode, credentials_json=credentials_json, **kwargs)
+        self.api = api
+        self._executor = ThreadPoolExecutor(max_workers=concurrency)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, tb):
+        # waiting for the calls in flight must not block the event loop
+        await asyncio.get_running_loop().run_in_executor(None, self.close)
+
+    def close(self):
+        """Stop the worker threads, after the calls in flight, and close the DnsMeApi if it was created here."""
+        self._executor.shutdown(wait=True)
+        if self._owns_api:
+            self.api.close()
+
+    @property
+    def ipaddress(self):
+        return self.api.ipaddress
+
+    def _run(self, deadline, stack, fn, *args, **kwargs):
+        """Run fn in a worker thread with the deadline and span stack of the thread that made the call."""
+
+        local, spans = self.api._local, self.api.instrumentation._local
+        previous = getattr(local, 'deadline', None), getattr(spans, 'stack', None)
+        local.deadline, spans.stack = deadline, stack
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            local.deadline, spans.stack = previous
+
+    async def _call(self, fn, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        deadline = getattr(self.api._local, 'deadline', None)
+        stack = list(getattr(self.api.instrumentation._local, 'stack', None) or [])
+        return await loop.run_in_executor(self._executor, functools.partial(self._run, deadline, stack, fn, *args,
+                                                                            **kwargs))
+
+    async def get_site_id(self, site, refresh=False):
+        return await self._call(self.api.get_site_id, site, refresh=refresh)
+
+    async def get_records(self, site_id, type='', name='', value='', refresh=False):
+        return await self._call(self.api.get_records, site_id, type=type, name=name, value=value,
+                                refresh=refresh)
+
+    async def add_records(self, site, records, **kwargs):
+        return await self._call(self.api.add_records, site, records, **kwargs)
+
+    async def delete_records(self, site, record_ids, **kwargs):
+        return await self._call(self.api.delete_records, site, record_ids, **kwargs)
+
+    async def upsert_record(self, site, name, type, value, ttl=30, replace=False, robust=False):
+        return await self._call(self.api.upsert_record, site, name, type, value, ttl=ttl, replace=replace,
+                                robust=robust)
+
+    async def add_a_record(self, site, name, ipaddress, ttl=30, robust=True):
+        return await self._call(self.api.add_a_record, site, name, ipaddress, ttl=ttl, robust=robust)
+
+    async def delete_a_record(self, site, name, ipaddress=''):
+        return await self._call(self.api.delete_a_record, site, name, ipaddress=ipaddress)
+
+    async def delete_a_ip(self, site, ipaddress=''):
+        return await self._call(self.api.delete_a_ip, site, ipaddress=ipaddress)
+
+    async def add_txt_record(self, site, name, value, ttl=30, robust=True):
+        return await self._call(self.api.add_txt_record, site, name, value, ttl=ttl, robust=robust)
+
+    async def delete_txt_record(self, site, name):
+        return await self._call(self.api.delete_txt_record, site, name)
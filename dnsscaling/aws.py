@@ -0,0 +1,118 @@
+"""
+Lookups against the EC2 instance metadata service (IMDSv2 with an IMDSv1 fallback)
+"""
+
+import json
+import os
+import tempfile
+import time
+
+from dnsscaling.cache import private_dir, private_file
+
+IMDS_URL = 'http://169.254.169.254/latest'
+# seconds an IMDSv2 session token is requested for, the maximum allowed is six hours
+TOKEN_TTL = 21600
+# tokens are cached on local disk so later runs on the instance skip the token request, on the
+# tmpfs /run as a token is only valid for the boot it was requested in
+DEFAULT_TOKEN_CACHE = '/run/dnsscaling/imds_token.json'
+# metadata answers in about a millisecond on EC2, anything slower means this is not an instance
+DEFAULT_TIMEOUT = 0.5
+
+
+class Imds(object):
+    """
+    Instance metadata client that caches its IMDSv2 token in memory and on local disk.
+
+    If the token request fails (IMDSv1 only instances) metadata is read without a token.
+    """
+
+    def __init__(self, session=None, token_cache=DEFAULT_TOKEN_CACHE, timeout=DEFAULT_TIMEOUT):
+
+        if session is None:
+            import requests
+            session = requests
+        self.session = session
+        self.token_cache = token_cache
+        self.timeout = timeout
+        self._token = None
+        self._token_expires = 0
+
+    def _load_token(self):
+
+        if not self.token_cache or not private_file(self.token_cache):
+            return
+        try:
+            with open(self.token_cache, 'r') as f:
+                content = json.loads(f.read())
+        except (OSError, ValueError):
+            return
+        # keep a minute of margin so a token never expires in flight
+        if content.get('expires', 0) - 60 > time.time():
+            self._token = content['token']
+            self._token_expires = content['expires']
+
+    def _save_token(self):
+
+        if not self.token_cache:
+            return
+        dirname = os.path.dirname(os.path.abspath(self.token_cache))
+        if not private_dir(dirname):
+            return
+        try:
+            fd, tmp = tempfile.mkstemp(dir=dirname, prefix='.imds_token')
+            with os.fdopen(fd, 'w') as f:
+                f.write(json.dumps({'token': self._token, 'expires': self._token_expires}))
+            os.replace(tmp, self.token_cache)
+        except OSError:
+            pass
+
+    def token(self):
+        """Return a valid IMDSv2 token, or None if the token endpoint is not available."""
+
+        if self._token is None or self._token_expires - 60 < time.time():
+            self._token = None
+            self._load_token()
+        if self._token is not None:
+            return self._token
+
+        try:
+            r = self.session.put(url=IMDS_URL + '/api/token', timeout=self.timeout,
+                                 headers={'X-aws-ec2-metadata-token-ttl-seconds': str(TOKEN_TTL)})
+        except Exception:
+            return None
+        if r.status_code != 200:
+            return None
+
+        self._token = r.text
+        self._token_expires = time.time() + TOKEN_TTL
+        self._save_token()
+        return self._token
+
+    def get(self, path, _retry=True):
+        """Return the text of a metadata path such as 'meta-data/public-ipv4', None if unavailable."""
+
+        token = self.token()
+        headers = {'X-aws-ec2-metadata-token': token} if token else {}
+        try:
+            r = self.session.get(url=IMDS_URL + '/' + path, headers=headers, timeout=self.timeout)
+        except Exception:
+            return None
+
+        if r.status_code == 401 and token and _retry:
+            # the cached token was revoked or belongs to an earlier boot, get a new one
+            self._token = None
+            self._token_expires = 0
+            if self.token_cache:
+                try:
+                    os.remove(self.token_cache)
+                except OSError:
+                    pass
+            return self.get(path, _retry=False)
+        if r.status_code != 200:
+            return None
+        return r.text
+
+
+def get_public_ip(session=None, token_cache=DEFAULT_TOKEN_CACHE):
+    """Public ipv4 address of this EC2 instance, None if not on EC2 or it has none."""
+    return Imds(session=session, token_cache=token_cache).get('meta-data/public-ipv4')
@@ -0,0 +1,201 @@
+"""
+Caches for dns made easy values that rarely change
+"""
+
+import json
+import os
+import stat
+import tempfile
+import threading
+import time
+
+# local copies of secrets and per host state, in a directory only its owner (root) can enter;
+# not /var/tmp, where any user can create the directory first
+DEFAULT_CACHE_DIR = '/var/cache/dnsscaling/'
+
+
+def private_dir(path):
+    """
+    Create the directory path accessible by the current user only, or check an existing one.
+
+    :return: True if path is a directory, not a symlink, owned by the current user and without
+        group or other access, the only kind of directory private files are read from or written to
+    """
+
+    try:
+        os.makedirs(path, mode=0o700, exist_ok=True)
+        st = os.lstat(path)
+    except OSError:
+        return False
+    return stat.S_ISDIR(st.st_mode) and st.st_uid == os.geteuid() and not st.st_mode & 0o077
+
+
+def private_file(path):
+    """True if path is a regular file owned by the current user in a private_dir, and only readable by them."""
+
+    if not private_dir(os.path.dirname(os.path.abspath(path))):
+        return False
+    try:
+        st = os.lstat(path)
+    except OSError:
+        return False
+    return stat.S_ISREG(st.st_mode) and st.st_uid == os.geteuid() and not st.st_mode & 0o077
+
+
+class SiteIdCache(object):
+    """
+    Map of managed domain name to site (zone) id with a time to live.
+
+    If a path is given the cache is also persisted to that file (a local file or one on the shared
+    EFS mount) so that freshly started processes can skip the account list download.  The file is
+    rewritten atomically, and read again whenever the in memory copy misses, so several instances
+    can share one file.
+    """
+
+    def __init__(self, ttl=3600, path=''):
+
+        self.ttl = ttl
+        self.path = path
+        # name -> (site id, expiry epoch)
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._file_stamp = None
+
+    def get(self, name):
+        """Return the cached site id for name or '' if missing or expired."""
+
+        with self._lock:
+            site_id = self._lookup(name)
+            if not site_id and self.path and self._load():
+                site_id = self._lookup(name)
+        return site_id
+
+    def update(self, ids):
+        """Store a dict of name -> site id, typically the full account list."""
+
+        if self.ttl <= 0:
+            return
+
+        expires = time.time() + self.ttl
+        with self._lock:
+            if self.path:
+                self._load()
+            for name, site_id in ids.items():
+                self._entries[name] = (str(site_id), expires)
+            self._save()
+
+    def invalidate(self, name=None):
+        """Drop one name, or every entry when name is None, from memory and the cache file."""
+
+        with self._lock:
+            if self.path:
+                self._load()
+            if name is None:
+                self._entries = {}
+            else:
+                self._entries.pop(name, None)
+            self._save()
+
+    def _lookup(self, name):
+
+        entry = self._entries.get(name)
+        if entry is None:
+            return ''
+        if entry[1] < time.time():
+            del self._entries[name]
+            return ''
+        return entry[0]
+
+    def _stamp(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return st.st_mtime, st.st_size
+
+    def _load(self):
+        """Merge the cache file into memory if it changed since the last read; True if it did."""
+
+        stamp = self._stamp()
+        if stamp is None or stamp == self._file_stamp:
+            return False
+
+        try:
+            with open(self.path, 'r') as f:
+                content = json.loads(f.read())
+        except (OSError, ValueError):
+            return False
+
+        self._file_stamp = stamp
+        now = time.time()
+        for name, entry in content.get('sites', {}).items():
+            site_id, expires = str(entry[0]), float(entry[1])
+            if expires > now and expires > self._entries.get(name, ('', 0))[1]:
+                self._entries[name] = (site_id, expires)
+        return True
+
+    def _save(self):
+
+        if not self.path:
+            return
+
+        content = {'sites': {k: [v[0], v[1]] for k, v in self._entries.items()}}
+        try:
+            dirname = os.path.dirname(os.path.abspath(self.path))
+            fd, tmp = tempfile.mkstemp(dir=dirname, prefix='.site_ids')
+            with os.fdopen(fd, 'w') as f:
+                f.write(json.dumps(content))
+            os.replace(tmp, self.path)
+            self._file_stamp = self._stamp()
+        except OSError:
+            # the cache is an optimization only, an unwritable location is not an error
+            pass
+
+
+def load_credentials(path, cache_path=''):
+    """
+    Read the json credentials file at path, through a local copy at cache_path if given.
+
+    The copy is refreshed only when the modification time or size of path changes, so on a shared
+    (EFS) path a run costs one stat instead of reading the file.  If path cannot be reached the
+    local copy is used.  The copy is only readable by its owner, and it is only read or written
+    in a directory that passes private_dir and as a file that passes private_file, so another
+    local user can neither read nor plant it.
+    """
+
+    if not cache_path:
+        with open(path, 'r') as f:
+            return json.loads(f.read().strip())
+
+    try:
+        st = os.stat(path)
+        stamp = [st.st_mtime, st.st_size]
+    except OSError:
+        stamp = None
+
+    try:
+        if not private_file(cache_path):
+            raise OSError('No private credentials copy at ' + cache_path)
+        with open(cache_path, 'r') as f:
+            cached = json.loads(f.read())
+        if stamp is None or cached.get('stamp') == stamp:
+            return cached['credentials']
+    except (OSError, ValueError, KeyError):
+        if stamp is None:
+            raise
+
+    with open(path, 'r') as f:
+        credentials = json.loads(f.read().strip())
+
+    dirname = os.path.dirname(os.path.abspath(cache_path))
+    if not private_dir(dirname):
+        return credentials
+    try:
+        fd, tmp = tempfile.mkstemp(dir=dirname, prefix='.credentials')
+        with os.fdopen(fd, 'w') as f:
+            f.write(json.dumps({'stamp': stamp, 'credentials': credentials}))
+        os.replace(tmp, cache_path)
+    except OSError:
+        pass
+
+    return credentials
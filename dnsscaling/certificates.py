@@ -0,0 +1,244 @@
+"""
+Inventory of the certificates on EFS and in letsencrypt, and when each is due for renewal
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import socket
+import tempfile
+import time
+
+from dnsscaling.cache import private_dir, private_file
+
+# directories searched for pem files, each with one level of subdirectories (one per domain)
+DEFAULT_CERT_PATHS = ['/home/ec2-user/efs/letsencrypt/', '/etc/letsencrypt/live/']
+# parsed metadata of every pem file, refreshed only when a file changes
+DEFAULT_INVENTORY_CACHE = '/var/cache/dnsscaling/certificates.json'
+# renew this long before a certificate expires, a third of the lifetime for shorter certificates
+DEFAULT_RENEW_BEFORE = 30 * 86400
+# the renewals of the fleet are spread over this many seconds before that
+DEFAULT_JITTER = 5 * 86400
+
+# key type of the EC curves, as in dnsscaling.keys.KEY_TYPES
+_CURVES = {'secp256r1': 'ec256', 'secp384r1': 'ec384', 'secp521r1': 'ec521'}
+
+
+class CertificateError(ValueError):
+    pass
+
+
+def _serial_hex(serial):
+    # the bytes of the DER integer, with its sign byte, so the renewal jitter of a certificate stays the same
+    return serial.to_bytes(serial.bit_length() // 8 + 1, 'big').hex()
+
+
+def parse_certificate(data):
+    """
+    Metadata of the first certificate of a pem (str or bytes) or of der bytes.
+
+    :return: dict with domains (subject alternative names, the common name if there are none),
+        not_before and not_after (epoch seconds), key_type (as in dnsscaling.keys.KEY_TYPES) and
+        serial (hex)
+    :raises CertificateError: if data holds no readable certificate
+    """
+
+    from cryptography import x509
+    from cryptography.hazmat.primitives.asymmetric import ec, rsa
+    from cryptography.x509.oid import NameOID
+
+    if isinstance(data, str):
+        data = data.encode('ascii', 'replace')
+    try:
+        if b'-----BEGIN' in data:
+            certificate = x509.load_pem_x509_certificate(data)
+        else:
+            certificate = x509.load_der_x509_certificate(data)
+
+        try:
+            san = certificate.extensions.get_extension_for_class(x509.SubjectAlternativeName)
+            domains = san.value.get_values_for_type(x509.DNSName)
+        except x509.ExtensionNotFound:
+            domains = []
+        if not domains:
+            domains = [x.value for x in certificate.subject.get_attributes_for_oid(NameOID.COMMON_NAME)]
+
+        key = certificate.public_key()
+        if isinstance(key, rsa.RSAPublicKey):
+            key_type = 'rsa{0}'.format(key.key_size)
+        elif isinstance(key, ec.EllipticCurvePublicKey):
+            key_type = _CURVES.get(key.curve.name, 'ec')
+        else:
+            key_type = type(key).__name__
+
+        return {'domains': domains, 'not_before': certificate.not_valid_before_utc.timestamp(),
+                'not_after': certificate.not_valid_after_utc.timestamp(), 'key_type': key_type,
+                'serial': _serial_hex(certificate.serial_number)}
+    except ValueError as e:
+        raise CertificateError('Unreadable certificate: {0}'.format(e))
+
+
+def _matches(name, pattern):
+
+    if name == pattern:
+        return True
+    # a wildcard covers exactly one more label, and not another wildcard
+    return pattern.startswith('*.') and not name.startswith('*.') and name.split('.', 1)[-1] == pattern[2:]
+
+
+def covers(meta, domains):
+    """True if the certificate of meta is valid for every one of domains."""
+    return all(any(_matches(x.lower(), y.lower()) for y in meta['domains']) for x in domains)
+
+
+def renewal_time(meta, renew_before=DEFAULT_RENEW_BEFORE, jitter=DEFAULT_JITTER, key=None):
+    """
+    Epoch seconds from which the certificate of meta should be renewed.
+
+    That is renew_before seconds (at most a third of the lifetime) before it expires, and up to
+    jitter seconds earlier by an offset fixed per key (the host name by default) and
+    certificate, so the hosts of a fleet sharing a certificate do not all renew at once.
+    """
+
+    lifetime = meta['not_after'] - meta['not_before']
+    before = min(renew_before, lifetime / 3.0)
+    if key is None:
+        key = socket.gethostname()
+    digest = hashlib.sha256('{0}:{1}'.format(key, meta['serial']).encode('utf-8')).digest()
+    fraction = int.from_bytes(digest[:8], 'big') / 2.0 ** 64
+    return meta['not_after'] - before - min(jitter, lifetime / 3.0) * fraction
+
+
+def due(meta, now=None, renew_before=DEFAULT_RENEW_BEFORE, jitter=DEFAULT_JITTER, key=None):
+    """True if the certificate of meta should be renewed now."""
+
+    now = time.time() if now is None else now
+    return now >= renewal_time(meta, renew_before=renew_before, jitter=jitter, key=key)
+
+
+class CertificateInventory(object):
+    """
+    Metadata of the certificates in the pem files of paths, each directory and its direct
+    subdirectories.
+
+    Parsed metadata is kept per file with its modification time and size, in memory and in the
+    json file cache_path if given, so a boot only stats the files that did not change.  Files
+    without a readable certificate (private keys, broken files) are kept as None.
+    """
+
+    def __init__(self, paths=None, cache_path=DEFAULT_INVENTORY_CACHE):
+
+        self.paths = list(DEFAULT_CERT_PATHS if paths is None else paths)
+        self.cache_path = cache_path
+        # path -> (stamp, metadata or None)
+        self._files = {}
+        self._changed = False
+        if cache_path and private_file(cache_path):
+            try:
+                with open(cache_path, 'r') as f:
+                    content = json.loads(f.read())
+                self._files = {k: (tuple(v['stamp']), v['meta']) for k, v in content.get('files', {}).items()}
+            except (OSError, ValueError, KeyError, TypeError):
+                self._files = {}
+
+    def certificate(self, path):
+        """Metadata (with its path) of the certificate in the pem file path, None if it has none."""
+
+        path = os.path.abspath(path)
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        stamp = (st.st_mtime, st.st_size)
+
+        entry = self._files.get(path)
+        if entry is None or entry[0] != stamp:
+            try:
+                with open(path, 'rb') as f:
+                    meta = parse_certificate(f.read())
+                meta['path'] = path
+            except (OSError, CertificateError):
+                meta = None
+            entry = (stamp, meta)
+            self._files[path] = entry
+            self._changed = True
+        return entry[1]
+
+    def _pem_files(self):
+
+        for path in self.paths:
+            try:
+                names = sorted(os.listdir(path))
+            except OSError:
+                continue
+            for name in names:
+                full = os.path.join(path, name)
+                if name.endswith('.pem'):
+                    yield full
+                elif os.path.isdir(full):
+                    try:
+                        yield from (os.path.join(full, x) for x in sorted(os.listdir(full)) if x.endswith('.pem'))
+                    except OSError:
+                        continue
+
+    def scan(self):
+        """List of the metadata of every certificate found, and save the cache if it changed."""
+
+        found = [x for x in (self.certificate(path) for path in self._pem_files()) if x is not None]
+        self.save()
+        return found
+
+    def find(self, domains):
+        """Metadata of the certificate covering every one of domains that expires last, or None."""
+
+        matching = [x for x in self.scan() if covers(x, domains)]
+        return max(matching, key=lambda x: x['not_after']) if matching else None
+
+    def save(self):
+
+        if not self.cache_path or not self._changed:
+            return
+        content = {'files': {k: {'stamp': list(v[0]), 'meta': v[1]} for k, v in self._files.items()}}
+        dirname = os.path.dirname(os.path.abspath(self.cache_path))
+        if not private_dir(dirname):
+            return
+        try:
+            fd, tmp = tempfile.mkstemp(dir=dirname, prefix='.certificates')
+            with os.fdopen(fd, 'w') as f:
+                f.write(json.dumps(content))
+            os.replace(tmp, self.cache_path)
+            self._changed = False
+        except OSError:
+            # the cache is an optimization only, an unwritable location is not an error
+            pass
+
+
+def format_inventory(certificates, now=None, renew_before=DEFAULT_RENEW_BEFORE, jitter=DEFAULT_JITTER):
+
+    now = time.time() if now is None else now
+    lines = []
+    for x in sorted(certificates, key=lambda x: (x['not_after'], x['path'])):
+        renew = renewal_time(x, renew_before=renew_before, jitter=jitter)
+        lines.append('{0}  {1:>6.1f} days left  {2:<8} {3}  renew {4}  {5}'.format(
+            time.strftime('%Y-%m-%d', time.gmtime(x['not_after'])), (x['not_after'] - now) / 86400.0,
+            x['key_type'], 'DUE' if now >= renew else 'ok ', time.strftime('%Y-%m-%d', time.gmtime(renew)),
+            ','.join(x['domains']) + ' ' + x['path']))
+    return '\n'.join(lines)
+
+
+def run_inventory():
+
+    parser = argparse.ArgumentParser(description="List certificates, their expiry and renewal date")
+    parser.add_argument('paths', type=str, nargs='*', default=DEFAULT_CERT_PATHS,
+                        help="Directories of pem files, searched one level deep")
+    parser.add_argument('--cache', type=str, default=DEFAULT_INVENTORY_CACHE, help="Json metadata cache file")
+    parser.add_argument('--renew_before', type=float, default=DEFAULT_RENEW_BEFORE / 86400.0,
+                        help="Days before expiry to renew")
+    parser.add_argument('--jitter', type=float, default=DEFAULT_JITTER / 86400.0,
+                        help="Days the renewals of the fleet are spread over")
+    args = parser.parse_args()
+
+    inventory = CertificateInventory(args.paths, cache_path=args.cache)
+    print(format_inventory(inventory.scan(), renew_before=args.renew_before * 86400,
+                           jitter=args.jitter * 86400))
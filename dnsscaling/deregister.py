@@ -0,0 +1,242 @@
+"""
+Worker deleting the A records of terminated instances from the markers in the EFS removal directory
+"""
+
+import argparse
+import ctypes
+import ctypes.util
+import os
+import select
+import sys
+import time
+import traceback
+
+from dnsscaling.records import pack_ipv4
+from dnsscaling.sweeper import ALIVE_DIR, read_alive, remove_alive
+
+# instances copy their alive file (the ids of their A records) here when they shut down, or
+# touch an empty file named after their public ip
+REMOVE_DIR = '/home/ec2-user/efs/dns_ip_addresses/remove/'
+# seconds between directory scans, EFS changes made by other hosts raise no inotify events
+DEFAULT_POLL_INTERVAL = 10.0
+# seconds to wait after a new marker for more to arrive, so they are deleted in one batch
+DEFAULT_BATCH_DELAY = 1.0
+
+# inotify event masks from <sys/inotify.h>
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+
+
+class DirectoryWatcher(object):
+    """
+    Wait for files to appear in a directory, with inotify when the platform has it.
+
+    wait() returns early on an inotify event and otherwise after its timeout, so callers scan the
+    directory after every wait and also pick up changes inotify cannot see, such as files written
+    to a network file system by another host.
+    """
+
+    def __init__(self, path, inotify=True):
+
+        self.path = path
+        self._fd = None
+        if inotify:
+            try:
+                self._fd = self._inotify(path)
+            except (OSError, AttributeError):
+                # no inotify (not linux, or no watches left), fall back to polling
+                self._fd = None
+
+    @property
+    def inotify(self):
+        return self._fd is not None
+
+    @staticmethod
+    def _inotify(path):
+
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        mask = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_ATTRIB
+        if libc.inotify_add_watch(fd, os.fsencode(path), mask) < 0:
+            errno = ctypes.get_errno()
+            os.close(fd)
+            raise OSError(errno, 'inotify_add_watch failed for ' + path)
+        return fd
+
+    def wait(self, timeout):
+        """Block up to timeout seconds, returning True if an inotify event arrived."""
+
+        if self._fd is None:
+            time.sleep(timeout)
+            return False
+
+        ready, _, _ = select.select([self._fd], [], [], timeout)
+        if not ready:
+            return False
+        try:
+            while os.read(self._fd, 65536):
+                pass
+        except BlockingIOError:
+            pass
+        return True
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+def pending(directory):
+    """Ip addresses with a removal marker in directory, other files are ignored."""
+
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return []
+    return sorted(x for x in names if pack_ipv4(x) is not None)
+
+
+def _registered_ids(directory, ip, alive_dir):
+    """
+    Ids of the A records the marker of ip is for, None for all records of ip.
+
+    A marker copied from an alive file lists the records of the instance that wrote it.  An empty
+    marker is for all records of ip, unless the alive file of ip was written or touched after the
+    marker, by a new instance given the same ip, which must keep its records.
+    """
+
+    path = os.path.join(directory, ip)
+    marker = read_alive(path)
+    if marker is not None:
+        return set(marker.get('ids', []))
+    try:
+        if os.stat(os.path.join(alive_dir, ip)).st_mtime > os.stat(path).st_mtime:
+            return set()
+    except OSError:
+        pass
+    return None
+
+
+def _own_alive(directory, ip, alive_dir):
+    """True if the alive file of ip is the one of the instance that left the marker, not of a later one."""
+
+    path, alive_path = os.path.join(directory, ip), os.path.join(alive_dir, ip)
+    marker, alive = read_alive(path), read_alive(alive_path)
+    if marker is not None and alive is not None:
+        return set(alive.get('ids', [])) <= set(marker.get('ids', []))
+    try:
+        return os.stat(alive_path).st_mtime <= os.stat(path).st_mtime
+    except OSError:
+        return False
+
+
+def drain(api, site, directory=REMOVE_DIR, alive_dir=ALIVE_DIR):
+    """
+    Delete the A records of every ip with a marker in directory, in bulk, and remove their markers.
+
+    The A records of the zone are downloaded once into a compact Zone and the ids of every
+    pending ip are deleted together.  Only the records listed in a marker are deleted, so those
+    of a new instance that was given the ip of a terminated one are kept (see _registered_ids for
+    empty markers).  A marker is only removed once all its records are deleted (or none were
+    left), so after a failure or a crash the ip is picked up again.  The alive file of the
+    instance is removed with its marker, unless it is one of a new instance (see _own_alive).
+
+    :param api: DnsMeApi
+    :param site:
+    :param directory:
+    :param alive_dir: directory of the alive files of the sweeper
+    :return: dict of ip -> dict with deleted (count) and error ('' if its marker was removed)
+    """
+
+    ips = pending(directory)
+    if not ips:
+        return {}
+
+    site_id = api.get_site_id(site)
+    if not site_id:
+        raise Exception("No site id found for", site)
+
+    zone = api.get_zone(site_id, type='A')
+    ids = {}
+    for ip in ips:
+        registered = _registered_ids(directory, ip, alive_dir)
+        ids[ip] = [str(x.id) for x in zone.find(type='A', value=ip) if registered is None or str(x.id) in registered]
+    results = {str(x['id']): x for x in api.delete_records(site, [x for ip in ips for x in ids[ip]])}
+
+    summary = {}
+    for ip in ips:
+        errors = [results[x]['error'] for x in ids[ip] if not results[x]['success']]
+        if not errors:
+            if _own_alive(directory, ip, alive_dir):
+                remove_alive(ip, alive_dir)
+            try:
+                os.remove(os.path.join(directory, ip))
+            except FileNotFoundError:
+                pass
+        summary[ip] = {'deleted': len(ids[ip]) - len(errors), 'error': '; '.join(errors)}
+    return summary
+
+
+def run(api, site, directory=REMOVE_DIR, poll_interval=DEFAULT_POLL_INTERVAL, batch_delay=DEFAULT_BATCH_DELAY,
+        once=False, inotify=True, log=sys.stdout, alive_dir=ALIVE_DIR):
+    """
+    Drain the removal directory whenever markers appear, until interrupted, or once if once is set.
+    """
+
+    watcher = DirectoryWatcher(directory, inotify=inotify)
+    try:
+        while True:
+            if pending(directory):
+                try:
+                    summary = drain(api, site, directory, alive_dir=alive_dir)
+                except Exception:
+                    # the markers are kept, the next pass tries again
+                    log.write(traceback.format_exc())
+                else:
+                    for ip, result in sorted(summary.items()):
+                        log.write('{0}: {1} deleted{2}\n'.format(
+                            ip, result['deleted'], ' FAILED: ' + result['error'] if result['error'] else ''))
+                log.flush()
+            if once:
+                return
+            if watcher.wait(poll_interval):
+                # let the rest of a scale in event arrive before deleting
+                time.sleep(batch_delay)
+    finally:
+        watcher.close()
+
+
+def run_deregister():
+
+    from dnsscaling.dnsapi import DEFAULT_API_URL, DnsMeApi
+
+    parser = argparse.ArgumentParser(description="Delete the A records of instances with a marker in the removal "
+                                                 "directory")
+    parser.add_argument('--site', type=str, default='simpa.io', help="Domain the A records are in")
+    parser.add_argument('--directory', type=str, default=REMOVE_DIR, help="Directory of ip address markers")
+    parser.add_argument('--alive_dir', type=str, default=ALIVE_DIR, help="Directory of the alive files of the "
+                                                                         "registered instances")
+    parser.add_argument('--poll', type=float, default=DEFAULT_POLL_INTERVAL, help="Seconds between directory "
+                                                                                  "scans")
+    parser.add_argument('--batch_delay', type=float, default=DEFAULT_BATCH_DELAY,
+                        help="Seconds to collect more markers after one arrives")
+    parser.add_argument('--once', action='store_true', default=False, help="[flag] Drain the directory once "
+                                                                           "and exit")
+    parser.add_argument('--site_cache', type=str, default='', help="File (local or on EFS) used to share cached "
+                                                                   "site ids between runs")
+    parser.add_argument('--credentials', type=str, default='', help="Json credentials file, defaults to the one "
+                                                                     "on EFS")
+    parser.add_argument('--api_url', type=str, default=DEFAULT_API_URL, help="Base url of the managed dns api")
+    args = parser.parse_args()
+
+    with DnsMeApi(test_mode=True, site_cache_path=args.site_cache, credentials_json=args.credentials,
+                  url=args.api_url) as api:
+        try:
+            run(api, args.site, directory=args.directory, poll_interval=args.poll, batch_delay=args.batch_delay,
+                once=args.once, alive_dir=args.alive_dir)
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,170 @@
+"""
+DNS-01 challenge records of many domains, written, checked and deleted in bulk
+"""
+
+from concurrent import futures
+
+from dnsscaling.dnsapi import get_domain
+from dnsscaling.propagation import DEFAULT_TIMEOUT, PropagationChecker
+
+CHALLENGE_LABEL = '_acme-challenge'
+# most propagation checks run at the same time
+DEFAULT_WORKERS = 16
+
+
+def challenge_record(identifier):
+    """
+    (zone, record name in the zone) of the challenge TXT record of identifier.
+
+    A wildcard *.simpa.io is validated on the record of simpa.io, like the ACME server does.
+    """
+
+    if identifier.startswith('*.'):
+        identifier = identifier[2:]
+    subdomain, zone = get_domain(identifier)
+    return zone, CHALLENGE_LABEL + ('.' + subdomain if subdomain else '')
+
+
+class ChallengeRecords(object):
+    """
+    The challenge TXT records of a batch of identifiers.
+
+    publish() writes every record with one record listing and one createMulti per zone,
+    wait() checks the authoritative nameservers of all records at the same time and cleanup()
+    deletes them all with one id list delete per zone.  Used as a context manager cleanup()
+    runs on exit, also after a failure.  A zone that fails to publish does not stop the others,
+    it is kept in failed, and wait_zones() answers per zone, so a batch can go on with the zones
+    that work.
+
+    A domain and its wildcard share one record name with two values, so the records are added
+    side by side and never upserted.
+    """
+
+    def __init__(self, api, ttl=30, nameservers=None, timeout=DEFAULT_TIMEOUT, workers=DEFAULT_WORKERS):
+
+        self.api = api
+        self.ttl = ttl
+        # fixed nameserver addresses for every zone, found per zone if None
+        self.nameservers = nameservers
+        self.timeout = timeout
+        self.workers = workers
+        # zone -> list of (record name, value)
+        self.records = {}
+        # zone -> ids of the records created
+        self.created = {}
+        # zone -> error of the zones whose records could not all be published
+        self.failed = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.cleanup()
+
+    def publish(self, validations):
+        """
+        Write the challenge records, after deleting the leftovers of earlier runs on the same names.
+
+        :param validations: list of (identifier, validation value)
+        :return: list of error strings of the records that could not be created, empty on success
+        """
+
+        for identifier, value in validations:
+            zone, name = challenge_record(identifier)
+            self.records.setdefault(zone, [])
+            if (name, value) not in self.records[zone]:
+                self.records[zone].append((name, value))
+
+        errors = []
+        for zone, records in sorted(self.records.items()):
+            try:
+                zone_errors = self._publish_zone(zone, records)
+            except Exception as e:
+                zone_errors = ['{0}: {1}'.format(zone, e)]
+            if zone_errors:
+                self.failed[zone] = 'challenge records not created: ' + '; '.join(zone_errors)
+            errors.extend(zone_errors)
+        return errors
+
+    def _publish_zone(self, zone, records):
+
+        site_id = self.api.get_site_id(zone)
+        if not site_id:
+            raise Exception("No site id found for " + zone)
+
+        names = {name for name, _ in records}
+        stale = [x.id for x in self.api.get_zone(site_id, type='TXT') if x.name in names]
+        if stale:
+            self.api.delete_records(zone, stale)
+
+        results = self.api.add_records(zone, [{'name': name, 'type': 'TXT', 'value': value, 'ttl': self.ttl}
+                                              for name, value in records])
+        self.created[zone] = [x['record']['id'] for x in results if x['success']]
+        return ['{0} {1}: {2}'.format(x['record']['name'], zone, x['error']) for x in results if not x['success']]
+
+    def wait(self):
+        """
+        Block until the authoritative nameservers serve every published record.
+
+        :return: seconds waited for the slowest record
+        :raises PropagationTimeout: for the first record not served within timeout
+        """
+
+        waited = self.wait_zones()
+        for zone in sorted(waited):
+            if isinstance(waited[zone], Exception):
+                raise waited[zone]
+        return max(waited.values(), default=0.0)
+
+    def wait_zones(self, zones=None):
+        """
+        Block until the authoritative nameservers serve every published record of zones or its
+        check failed, the records of all zones checked at the same time.
+
+        :param zones: zones to check, by default every zone that did not fail to publish
+        :return: dict of zone -> seconds waited for its slowest record, or the exception its check
+            failed with (PropagationTimeout, a failed nameserver lookup)
+        """
+
+        if zones is None:
+            zones = [x for x in self.records if x not in self.failed]
+        waited = {}
+        checks = []
+        for zone in sorted(zones):
+            try:
+                nameservers = self.nameservers or PropagationChecker().authoritative(zone)
+            except Exception as e:
+                waited[zone] = e
+                continue
+            checker = PropagationChecker(nameservers=nameservers, timeout=self.timeout)
+            checks.extend((checker, '{0}.{1}'.format(name, zone), value, zone) for name, value in self.records[zone])
+            waited[zone] = 0.0
+        if not checks:
+            return waited
+
+        with futures.ThreadPoolExecutor(max_workers=min(self.workers, len(checks))) as executor:
+            waits = [(zone, executor.submit(checker.wait, name, value, zone)) for checker, name, value, zone in checks]
+            for zone, future in waits:
+                if isinstance(waited[zone], Exception):
+                    continue
+                try:
+                    waited[zone] = max(waited[zone], future.result())
+                except Exception as e:
+                    waited[zone] = e
+        return waited
+
+    def cleanup(self):
+        """
+        Delete the records created by publish, one bulk delete per zone.
+
+        :return: list of error strings of the records that could not be deleted
+        """
+
+        errors = []
+        for zone, ids in sorted(self.created.items()):
+            if not ids:
+                continue
+            results = self.api.delete_records(zone, ids)
+            errors.extend('{0} {1}: {2}'.format(x['id'], zone, x['error']) for x in results if not x['success'])
+        self.created = {}
+        return errors
@@ -3,38 +3,189 @@ Script to perform DNS made easy api calls
 """
 
 import argparse
+import contextlib
 from datetime import datetime
 import hashlib
 import hmac
 import json
 import os
-import requests
 import sys
+import threading
 import time
-import traceback
 
+# requests, concurrent.futures and the reconcile module are imported where they are first needed,
+# so commands that do not use them start faster
 from dnsscaling import write_init_script
+from dnsscaling.aws import get_public_ip
+from dnsscaling.cache import SiteIdCache, load_credentials
+from dnsscaling.ratelimit import QuotaExhausted, RequestScheduler
+from dnsscaling.records import RecordIndex, Zone, type_fields
+from dnsscaling.retry import RETRYABLE_STATUS, DeadlineExceeded, DnsMeError, RetryPolicy, retry_after
+from dnsscaling.stats import Instrumentation, StatsCollector, endpoint_class, traced
+
+# number of keep-alive connections held open to the api host
+DEFAULT_POOL_SIZE = 10
+# seconds a site (zone) id lookup is cached for
+DEFAULT_SITE_CACHE_TTL = 3600
+# seconds a downloaded zone record index is trusted before it is fetched again
+DEFAULT_RECORD_TTL = 60
+# most records sent in one createMulti or updateMulti body or one id list delete
+MAX_BULK_RECORDS = 100
+# records requested per page of a zone listing
+DEFAULT_PAGE_SIZE = 1000
+# (connect, read) seconds for a single http request
+DEFAULT_TIMEOUT = (3.05, 10)
+
+DEFAULT_API_URL = 'https://api.dnsmadeeasy.com/V2.0/dns/managed'
+# hardcoded path where credentials must be stored
+DEFAULT_CREDENTIALS = '/home/ec2-user/efs/credentials/dnsmadeeasy/dme_credentials.json'
+# local copy of the default credentials, refreshed when the EFS file changes
+DEFAULT_CREDENTIALS_CACHE = '/var/cache/dnsscaling/dme_credentials.json'
+# unix socket of the agent started by -a --agent, kept here so the agent module loads lazily
+DEFAULT_AGENT_SOCKET = '/run/dnsscaling/agent.sock'
+
+
+def new_session(pool_size=DEFAULT_POOL_SIZE):
+    """Create a keep-alive session with a connection pool of pool_size for the api host."""
+    import requests
+
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
 
 
 class DnsMeApi(object):
+    """
+    Client for the DNS made easy managed dns api.
+
+    All calls go through one pooled keep-alive session so a sequence of calls pays for a single
+    TCP/TLS handshake.  Use as a context manager, or call close(), to release the connections.
+
+    The public ip address of the instance is only looked up, from the instance metadata, the first
+    time ipaddress is used.
+    """
+
+    def __init__(self, test_mode=False, credentials_json='', pool_size=DEFAULT_POOL_SIZE, session=None,
+                 site_cache_ttl=DEFAULT_SITE_CACHE_TTL, site_cache_path='', record_ttl=DEFAULT_RECORD_TTL,
+                 scheduler=None, retry_policy=None, timeout=DEFAULT_TIMEOUT, hedge_after=None, credentials=None,
+                 instrumentation=None, ipaddress=None, credentials_cache=None, url=DEFAULT_API_URL):
+
+        self.url = url
+
+        # emits an event per http request and a span per high level operation to its hooks
+        self.instrumentation = instrumentation if instrumentation is not None else Instrumentation()
+
+        self.timeout = timeout
+        # seconds after which an unanswered GET is sent a second time, None disables hedging
+        self.hedge_after = hedge_after
+        self._hedge_executor = None
+        # per thread deadline set by deadline()
+        self._local = threading.local()
+
+        # paces requests to the account request quota, may be shared between clients
+        if scheduler is None:
+            scheduler = RequestScheduler()
+        self.scheduler = scheduler
+        self.retry_policy = retry_policy if retry_policy is not None else RetryPolicy()
+        self.site_cache = SiteIdCache(ttl=site_cache_ttl, path=site_cache_path)
+        self._site_lock = threading.Lock()
+
+        # site id -> RecordIndex of the zone's records, kept current as this client changes them
+        self.record_ttl = record_ttl
+        self._record_indexes = {}
+        self._record_lock = threading.Lock()
+        # one lock per zone so concurrent callers share a single zone download
+        self._record_load_locks = {}
+
+        # a session passed in is owned (and closed) by the caller
+        self._owns_session = session is None
+        if session is None:
+            session = new_session(pool_size)
+        self.session = session
+
+        # in test mode there is no instance address to look up
+        self._ipaddress = ipaddress
+        self._lookup_ip = not test_mode and ipaddress is None
+
+        # credentials may be given directly as a dict with apikey and apisecret
+        if credentials is None:
+            if not credentials_json:
+                credentials_json = DEFAULT_CREDENTIALS
+                if credentials_cache is None:
+                    credentials_cache = DEFAULT_CREDENTIALS_CACHE
+            credentials = load_credentials(credentials_json, cache_path=credentials_cache or '')
+        self.apisecret = credentials['apisecret']
+        self.apikey = credentials['apikey']
+
+    @property
+    def ipaddress(self):
+        """Public ip address of this instance, looked up on first use."""
+
+        if self._ipaddress is None and self._lookup_ip:
+            with self.instrumentation.span('get_aws_ip'):
+                ipaddress = get_aws_ip(session=self.session)
+            if not ipaddress:
+                raise Exception('Could not find ip address')
+            self._ipaddress = ipaddress
+        return self._ipaddress
 
-    def __init__(self, test_mode=False, credentials_json=''):
+    @ipaddress.setter
+    def ipaddress(self, value):
+        self._ipaddress = value
 
-        self.url = 'https://api.dnsmadeeasy.com/V2.0/dns/managed'
+    def __enter__(self):
+        return self
 
-        self.ipaddress = None
-        if not test_mode:
-            self.ipaddress = str(get_aws_ip())
-            if not self.ipaddress:
-                raise Exception('Could not find ip address')
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
 
-        if not credentials_json:
-            # hardcoded path where credentials must be stored
-            credentials_json = '/home/ec2-user/efs/credentials/dnsmadeeasy/dme_credentials.json'
+    def close(self):
+        """Close the pooled connections if the session is owned by this client."""
+        if self._hedge_executor is not None:
+            self._hedge_executor.shutdown(wait=False)
+            self._hedge_executor = None
+        if self._owns_session:
+            self.session.close()
+
+    @contextlib.contextmanager
+    def deadline(self, seconds):
+        """
+        Bound every request made in the block, including retries and quota waits, to finish
+        within seconds, raising DeadlineExceeded otherwise.  Nested deadlines keep the earliest.
 
-        creds = json.loads(open(credentials_json, 'r').read().strip())
-        self.apisecret = creds['apisecret']
-        self.apikey = creds['apikey']
+            with api.deadline(5):
+                api.delete_a_ip(site, ip)
+        """
+
+        previous = getattr(self._local, 'deadline', None)
+        end = time.monotonic() + seconds
+        if previous is not None:
+            end = min(end, previous)
+        self._local.deadline = end
+        try:
+            yield
+        finally:
+            self._local.deadline = previous
+
+    def _remaining(self):
+        """Seconds left before the current deadline, None without a deadline."""
+
+        end = getattr(self._local, 'deadline', None)
+        if end is None:
+            return None
+        remaining = end - time.monotonic()
+        if remaining <= 0:
+            raise DeadlineExceeded('Deadline exceeded')
+        return remaining
+
+    def _request_timeout(self, remaining):
+
+        if remaining is None:
+            return self.timeout
+        connect, read = self.timeout
+        return min(connect, remaining), min(read, remaining)
 
     @staticmethod
     def _get_str_time():
@@ -57,14 +208,149 @@ class DnsMeApi(object):
 
         return headers
 
-    def _get(self, url, sub=''):
+    @property
+    def budget(self):
+        """Request quota as currently known, see RequestScheduler.budget."""
+        return self.scheduler.budget()
 
-        headers = self._create_headers()
+    @staticmethod
+    def _is_rate_limited(r):
+        return r.status_code == 429 or (r.status_code == 400 and 'rate limit' in r.text.lower())
 
-        r = requests.get(url=url, headers=headers)
-        if r.status_code != 200 and r.status_code != 201:
-            s = 'Code ' + str(r.status_code) + ':' + str(r.text)
-            raise Exception(s)
+    @staticmethod
+    def _is_duplicate(error):
+        """True for the api's answer to creating a record that is already in the zone."""
+        return isinstance(error, DnsMeError) and error.status_code == 400 and 'already exists' in str(error)
+
+    def _request(self, method, url, data=None, params=None):
+        """
+        Send a signed request, retrying according to retry_policy.
+
+        Requests rejected for the quota are queued on the scheduler, without an attempt limit but
+        each taking a retry from the retry policy's budget.  Failures that cannot succeed on a retry
+        raise DnsMeError immediately, and waiting for the quota past the deadline DeadlineExceeded.
+        """
+        from requests.exceptions import RequestException
+
+        self.retry_policy.record_request()
+        attempt = 0
+        tries = 0
+        while True:
+            # blocks until the quota allows another request
+            remaining = self._remaining()
+            try:
+                self.scheduler.acquire(timeout=remaining)
+            except QuotaExhausted as e:
+                if remaining is None or (self.scheduler.max_wait is not None and self.scheduler.max_wait < remaining):
+                    raise
+                raise DeadlineExceeded('Deadline exceeded waiting for the request quota: ' + str(e))
+
+            r = None
+            start = time.perf_counter()
+            try:
+                r = self._send(method, url, data, params, self._request_timeout(self._remaining()))
+            except RequestException as e:
+                self._emit_request(method, url, data, None, time.perf_counter() - start, tries, e)
+                error = DnsMeError(str(e), retryable=self.retry_policy.retryable_exception(method, e))
+            else:
+                self._emit_request(method, url, data, r, time.perf_counter() - start, tries, None)
+                self.scheduler.update(r.headers)
+                if self._is_rate_limited(r):
+                    # nothing was changed, queue the request again behind the quota after a
+                    # backoff growing with the rejections in a row
+                    self.scheduler.exhausted()
+                    if not self.retry_policy.spend():
+                        raise DnsMeError('Request quota exceeded, retry budget spent: ' + str(r.text),
+                                         status_code=r.status_code, response=r, retryable=True)
+                    # raises DeadlineExceeded if the server asks to wait past the deadline
+                    self._sleep(retry_after(r))
+                    tries += 1
+                    continue
+                self.scheduler.accepted()
+
+                if r.status_code == 200 or r.status_code == 201:
+                    return r
+
+                s = 'Code ' + str(r.status_code) + ':' + str(r.text)
+                error = DnsMeError(s, status_code=r.status_code, response=r,
+                                   retryable=self.retry_policy.retryable_status(method, r.status_code))
+
+            if not error.retryable or not self.retry_policy.allow_retry(attempt):
+                raise error
+
+            delay = self.retry_policy.delay(attempt, r)
+            remaining = self._remaining()
+            if remaining is not None and delay >= remaining:
+                # no time left to retry, fail with the real error
+                raise error
+            time.sleep(delay)
+            attempt += 1
+            tries += 1
+
+    def _emit_request(self, method, url, data, r, latency, retries, exc):
+
+        instrumentation = self.instrumentation
+        if not instrumentation.hooks:
+            return
+
+        size = len(data or b'')
+        error = ''
+        if r is not None:
+            size += len(r.content)
+            if r.status_code != 200 and r.status_code != 201:
+                error = 'Code ' + str(r.status_code)
+        else:
+            error = type(exc).__name__
+
+        instrumentation.emit({
+            'event': 'request', 'method': method, 'endpoint': endpoint_class(method, url),
+            'status': r.status_code if r is not None else None, 'bytes': size, 'latency': latency,
+            'retries': retries, 'span': instrumentation.current_span(), 'error': error,
+        })
+
+    def _sleep(self, seconds):
+
+        remaining = self._remaining()
+        if remaining is not None and seconds >= remaining:
+            raise DeadlineExceeded('Deadline exceeded waiting {0:.1f}s to retry'.format(seconds))
+        time.sleep(seconds)
+
+    def _send(self, method, url, data, params, timeout):
+        """One signed http exchange, hedged with a duplicate request for slow GETs."""
+
+        if method != 'GET' or self.hedge_after is None:
+            return self.session.request(method, url=url, headers=self._create_headers(), data=data,
+                                        params=params, timeout=timeout)
+
+        from concurrent import futures
+        from requests.exceptions import RequestException
+
+        if self._hedge_executor is None:
+            self._hedge_executor = futures.ThreadPoolExecutor(max_workers=4)
+
+        def attempt():
+            return self.session.request(method, url=url, headers=self._create_headers(), params=params,
+                                        timeout=timeout)
+
+        pending = {self._hedge_executor.submit(attempt)}
+        done, pending = futures.wait(pending, timeout=self.hedge_after)
+        # only hedge when the quota has a spare request
+        if not done and self.scheduler.try_acquire():
+            pending.add(self._hedge_executor.submit(attempt))
+
+        error = None
+        while pending or done:
+            for f in done:
+                try:
+                    return f.result()
+                except RequestException as e:
+                    error = e
+            done, pending = futures.wait(pending, return_when=futures.FIRST_COMPLETED)
+        raise error
+
+    def _get(self, url, sub='', params=None):
+
+        r = self._request('GET', url, params=params)
 
         content = json.loads(r.content.decode('utf-8'))
         if sub:
@@ -73,62 +359,469 @@ class DnsMeApi(object):
 
     def _post(self, url, data, sub=''):
 
-        headers = self._create_headers()
-
-        r = requests.post(url=url, headers=headers, data=json.dumps(data).encode('utf-8'))
-        if r.status_code != 200 and r.status_code != 201:
-            s = 'Code ' + str(r.status_code) + ':' + str(r.text)
-            raise Exception(s)
+        r = self._request('POST', url, data=json.dumps(data).encode('utf-8'))
 
         content = json.loads(r.content.decode('utf-8'))
         if sub:
-            return content['sub']
+            return content[sub]
         return content
 
-    def _delete(self, url):
+    def _put(self, url, data):
 
-        headers = self._create_headers()
+        return self._request('PUT', url, data=json.dumps(data).encode('utf-8'))
 
-        r = requests.delete(url=url, headers=headers)
-        if r.status_code != 200 and r.status_code != 201:
-            s = 'Code ' + str(r.status_code) + ':' + str(r.text)
-            raise Exception(s)
+    def _delete(self, url, params=None):
 
-        return r
+        return self._request('DELETE', url, params=params)
 
     def _get_account_data(self):
         return self._get(self.url, sub='data')
 
-    def get_site_id(self, site):
+    @traced
+    def get_site_id(self, site, refresh=False):
+        """
+        Return the site id for the managed domain site, or '' if it is not in the account.
+
+        :param site:
+        :param refresh: bypass the cache and download the account list
+        :return:
+        """
+
+        if not refresh:
+            site_id = self.site_cache.get(site)
+            if site_id:
+                return site_id
+
+        with self._site_lock:
+            if not refresh:
+                # another thread may have filled the cache while this one waited
+                site_id = self.site_cache.get(site)
+                if site_id:
+                    return site_id
+
+            ids = {d['name']: str(d['id']) for d in self._get_account_data()}
+            self.site_cache.update(ids)
+
+        return ids.get(site, '')
+
+    def invalidate_site_id(self, site=None):
+        """Forget the cached site id for site, or all cached site ids if site is None."""
+        self.site_cache.invalidate(site)
+
+    def _record_index(self, site_id, refresh=False):
+        """Return the RecordIndex for site_id, downloading the zone if missing, stale or refresh is set."""
+
+        site_id = str(site_id)
+        with self._record_lock:
+            index = self._record_indexes.get(site_id)
+            load_lock = self._record_load_locks.setdefault(site_id, threading.Lock())
+        if index is not None and not refresh and not index.stale:
+            return index
+
+        with load_lock:
+            with self._record_lock:
+                current = self._record_indexes.get(site_id)
+            if current is not None and current is not index and not current.stale:
+                # loaded by another thread while this one waited
+                return current
+
+            index = RecordIndex(self.iter_records(site_id), ttl=self.record_ttl)
+            with self._record_lock:
+                self._record_indexes[site_id] = index
+        return index
+
+    def _record_created(self, site_id, record):
+        """Add a record returned by the api to the zone index, or drop the index if it is not usable."""
+
+        with self._record_lock:
+            index = self._record_indexes.get(str(site_id))
+            if index is None:
+                return
+            if isinstance(record, dict) and 'id' in record:
+                index.add(record)
+            else:
+                del self._record_indexes[str(site_id)]
+
+    def _record_deleted(self, site_id, record_id):
 
-        data = self._get_account_data()
+        with self._record_lock:
+            index = self._record_indexes.get(str(site_id))
+            if index is not None:
+                index.remove(record_id)
 
-        for d in data:
-            if d['name'] == site:
-                return str(d['id'])
+    def invalidate_records(self, site_id=None):
+        """Drop the record index of site_id, or of every zone if site_id is None."""
 
-        return ''
+        with self._record_lock:
+            if site_id is None:
+                self._record_indexes = {}
+            else:
+                self._record_indexes.pop(str(site_id), None)
 
-    def get_records(self, site_id, type='', name='', value=''):
+    def iter_records(self, site_id, type='', name='', value='', page_size=DEFAULT_PAGE_SIZE):
+        """
+        Yield the records of the zone matching type, name and value, one page at a time as it arrives.
+
+        type and name are sent as query filters so the api only returns the matching records, value
+        has no server side filter and is matched here.  Records changed while the pages are read
+        may be skipped or yielded twice.
+
+        :param site_id:
+        :param type:
+        :param name:
+        :param value:
+        :param page_size: records per request
+        :return: generator of record dicts
+        """
 
         targurl = self.url + '/' + str(site_id) + '/records'
+        params = {'rows': page_size}
+        if type:
+            params['type'] = type
+        if name:
+            params['recordName'] = name
+
+        page = 0
+        while True:
+            params['page'] = page
+            content = self._get(targurl, params=params)
+            for x in content.get('data', []):
+                if type and not type == x['type']:
+                    continue
+                if name and not name == x['name']:
+                    continue
+                if value and not value == x['value']:
+                    continue
+                yield x
+
+            page += 1
+            if page >= content.get('totalPages', 1):
+                break
+
+    @traced
+    def get_zone(self, site_id, type='', name='', value='', page_size=DEFAULT_PAGE_SIZE):
+        """
+        Download the matching records of the zone into a compact column store Zone.
 
-        content = self._get(targurl, sub='data')
+        Pages are added to the Zone as they arrive, for holding large zones in memory at once.
+        """
+        return Zone(self.iter_records(site_id, type=type, name=name, value=value, page_size=page_size))
+
+    @traced
+    def get_records(self, site_id, type='', name='', value='', refresh=False):
+        """
+        Return the records of the zone matching type, name and value (all records if none are given).
+
+        A listing of all records is downloaded and indexed; later calls are answered from the index
+        until it is older than record_ttl seconds.  Without a fresh index a filtered lookup only
+        requests the matching records.
+
+        :param site_id:
+        :param type:
+        :param name:
+        :param value:
+        :param refresh: download the records even if the index is still fresh
+        :return:
+        """
 
         if not type and not name and not value:
-            return content
+            index = self._record_index(site_id, refresh=refresh)
+            with self._record_lock:
+                return index.records()
+
+        with self._record_lock:
+            index = self._record_indexes.get(str(site_id))
+            if index is not None and not refresh and not index.stale:
+                return index.find(type=type, name=name, value=value)
+
+        return list(self.iter_records(site_id, type=type, name=name, value=value))
+
+    def _post_record(self, site_id, targurl, data):
+
+        try:
+            record = self._post(targurl, data)
+        except:
+            # the record may or may not have been created, the index can no longer be trusted
+            self.invalidate_records(site_id)
+            raise
+        self._record_created(site_id, record)
+        return record
+
+    def _put_record(self, site_id, record, data):
+        """Update record in place with the fields of data, returning the updated record."""
+
+        data = dict(data, id=record['id'])
+        targurl = self.url + '/' + str(site_id) + '/records/' + str(record['id'])
+        try:
+            self._put(targurl, data)
+        except:
+            self.invalidate_records(site_id)
+            raise
+        record = dict(record, **data)
+        self._record_created(site_id, record)
+        return record
 
-        ret_list = []
-        for x in content:
-            if type and not type == x['type']:
+    def _create_record(self, site_id, data, robust=False):
+        """
+        Post a new record, if the api answers that it already exists return the existing one.
+
+        The request layer does not retry a POST that may have taken effect (a 500, a lost
+        connection).  With robust this one is, after the retry policy's backoff: if the earlier
+        attempt did create the record the repeat is answered "already exists", which counts as
+        success.
+        """
+
+        targurl = self.url + '/' + str(site_id) + '/records/'
+        attempt = 0
+        while True:
+            try:
+                return self._post_record(site_id, targurl, data)
+            except DnsMeError as e:
+                if self._is_duplicate(e):
+                    error = e
+                    break
+                if not robust or isinstance(e, DeadlineExceeded) or \
+                        not (e.status_code is None or e.status_code in RETRYABLE_STATUS) or \
+                        not self.retry_policy.allow_retry(attempt):
+                    raise
+                delay = self.retry_policy.delay(attempt, e.response)
+                remaining = self._remaining()
+                if remaining is not None and delay >= remaining:
+                    raise
+                time.sleep(delay)
+                attempt += 1
+
+        # created by an earlier attempt whose answer was lost, or by another client
+        for record in self.get_records(site_id, type=data['type'], name=data['name'], value=data['value'],
+                                       refresh=True):
+            return record
+        raise error
+
+    def _delete_record(self, site_id, record_id):
+
+        targurl = self.url + '/' + str(site_id) + '/records/' + str(record_id)
+        r = self._delete(targurl)
+        self._record_deleted(site_id, record_id)
+        return r
+
+    @staticmethod
+    def _record_data(name, type, value, ttl=30, gtdLocation='DEFAULT', fields=None):
+        data = {'name': name, 'type': type, 'value': value, 'gtdLocation': gtdLocation, 'ttl': ttl}
+        if fields:
+            data.update(fields)
+        return data
+
+    @traced
+    def add_records(self, site, records, chunk_size=MAX_BULK_RECORDS):
+        """
+        Create many records with the multi record endpoint, chunk_size records per request.
+
+        If a chunk is rejected its records are posted one at a time so every record gets its own
+        result.
+
+        :param site:
+        :param records: list of dicts with name, type, value and optionally ttl, gtdLocation and the
+            type specific fields of records.TYPE_FIELDS (mxLevel of MX records, ...)
+        :param chunk_size:
+        :return: list in the order of records of dicts with keys record, success and error, record
+            being the created record on success
+        """
+
+        site_id = self.get_site_id(site)
+        if not site_id:
+            raise Exception("No site id found for", site)
+
+        data = [self._record_data(x['name'], x['type'], x['value'], x.get('ttl', 30), x.get('gtdLocation', 'DEFAULT'),
+                                  type_fields(x)) for x in records]
+        targurl = self.url + '/' + str(site_id) + '/records/createMulti'
+
+        results = []
+        for i in range(0, len(data), chunk_size):
+            chunk = data[i:i + chunk_size]
+            try:
+                created = self._post(targurl, chunk)
+            except Exception:
+                self.invalidate_records(site_id)
+                results.extend(self._add_records_single(site_id, chunk))
                 continue
-            if name and not name == x['name']:
+
+            for record in created:
+                self._record_created(site_id, record)
+                results.append({'record': record, 'success': True, 'error': ''})
+
+        return results
+
+    def _add_records_single(self, site_id, data):
+
+        targurl = self.url + '/' + str(site_id) + '/records/'
+        results = []
+        for x in data:
+            try:
+                results.append({'record': self._post_record(site_id, targurl, x), 'success': True, 'error': ''})
+            except Exception as e:
+                results.append({'record': x, 'success': False, 'error': str(e)})
+        return results
+
+    @traced
+    def update_records(self, site, updates, chunk_size=MAX_BULK_RECORDS):
+        """
+        Update many records in place with the multi record endpoint, chunk_size records per request.
+
+        If a chunk is rejected its records are updated one at a time so every record gets its own
+        result.
+
+        :param site:
+        :param updates: list of (record, data), record being the existing record dict with its id
+            and data a dict with the fields to set, as for add_records
+        :param chunk_size:
+        :return: list in the order of updates of dicts with keys record, success and error, record
+            being the updated record on success
+        """
+
+        site_id = self.get_site_id(site)
+        if not site_id:
+            raise Exception("No site id found for", site)
+
+        updates = [(record, self._record_data(x['name'], x['type'], x['value'], x.get('ttl', 30),
+                                              x.get('gtdLocation', 'DEFAULT'), type_fields(x)))
+                   for record, x in updates]
+        targurl = self.url + '/' + str(site_id) + '/records/updateMulti'
+
+        results = []
+        for i in range(0, len(updates), chunk_size):
+            chunk = updates[i:i + chunk_size]
+            try:
+                self._put(targurl, [dict(data, id=record['id']) for record, data in chunk])
+            except Exception:
+                self.invalidate_records(site_id)
+                results.extend(self._update_records_single(site_id, chunk))
                 continue
-            if value and not value == x['value']:
+
+            for record, data in chunk:
+                record = dict(record, **data)
+                self._record_created(site_id, record)
+                results.append({'record': record, 'success': True, 'error': ''})
+
+        return results
+
+    def _update_records_single(self, site_id, updates):
+
+        results = []
+        for record, data in updates:
+            try:
+                results.append({'record': self._put_record(site_id, record, data), 'success': True, 'error': ''})
+            except Exception as e:
+                results.append({'record': record, 'success': False, 'error': str(e)})
+        return results
+
+    @traced
+    def delete_records(self, site, record_ids, chunk_size=MAX_BULK_RECORDS):
+        """
+        Delete many records by id with the id list delete endpoint, chunk_size ids per request.
+
+        If a chunk is rejected its ids are deleted one at a time so every id gets its own result.
+
+        :param site:
+        :param record_ids:
+        :param chunk_size:
+        :return: list in the order of record_ids of dicts with keys id, success and error
+        """
+
+        site_id = self.get_site_id(site)
+        if not site_id:
+            raise Exception("No site id found for", site)
+
+        return self._delete_records(site_id, record_ids, chunk_size=chunk_size)
+
+    def _delete_records(self, site_id, record_ids, chunk_size=MAX_BULK_RECORDS):
+
+        record_ids = [str(x) for x in record_ids]
+        targurl = self.url + '/' + str(site_id) + '/records'
+
+        results = []
+        for i in range(0, len(record_ids), chunk_size):
+            chunk = record_ids[i:i + chunk_size]
+            try:
+                self._delete(targurl, params={'ids': chunk})
+            except Exception:
+                results.extend(self._delete_records_single(site_id, chunk))
                 continue
-            ret_list.append(x)
-        return ret_list
 
+            for record_id in chunk:
+                self._record_deleted(site_id, record_id)
+                results.append({'id': record_id, 'success': True, 'error': ''})
+
+        return results
+
+    def _delete_records_single(self, site_id, record_ids):
+
+        results = []
+        for record_id in record_ids:
+            try:
+                self._delete_record(site_id, record_id)
+                results.append({'id': record_id, 'success': True, 'error': ''})
+            except Exception as e:
+                results.append({'id': record_id, 'success': False, 'error': str(e)})
+        return results
+
+    @traced
+    def upsert_record(self, site, name, type, value, ttl=30, replace=False, robust=False):
+        """
+        Make the zone hold a record of type and name with value and ttl.
+
+        A name may hold several values (round robin A records, several TXT tokens), so by default
+        a record of the same type, name and value is reused and updated in place if its ttl
+        differs.  With replace the name holds a single value and an existing record of the type
+        and name is updated to value.
+
+        Records are looked up in a fresh zone index if there is one.  Without one the record is
+        posted directly, and an "already exists" answer counts as success, so the common case is a
+        single request.
+
+        :param site:
+        :param name:
+        :param type:
+        :param value:
+        :param ttl:
+        :param replace: update the value of an existing record of type and name
+        :param robust: also retry a create that failed in a way that may have taken effect (a 500,
+            a lost connection), the requests that are safe to repeat are always retried
+        :return: the record as held by the zone
+        """
+
+        site_id = self.get_site_id(site)
+        if not site_id:
+            raise Exception("No site id found for", site)
+        data = self._record_data(name, type, value, ttl)
+
+        with self._record_lock:
+            index = self._record_indexes.get(str(site_id))
+            existing = None
+            if index is not None and not index.stale:
+                existing = index.find(type=type, name=name)
+        if existing is None and replace:
+            existing = self.get_records(site_id, type=type, name=name)
+
+        if not existing:
+            record = self._create_record(site_id, data, robust=robust)
+            existing = [record]
+        matches = [x for x in existing if x['value'] == value]
+        if matches:
+            record = matches[0]
+        elif replace:
+            record = existing[0]
+        else:
+            return self._create_record(site_id, data, robust=robust)
+
+        if replace:
+            extra = [x['id'] for x in existing if x['id'] != record['id']]
+            if extra:
+                self._delete_records(site_id, extra)
+        if record['value'] != value or record.get('ttl') != ttl:
+            record = self._put_record(site_id, record, data)
+        return record
+
+    @traced
     def add_txt_record(self, site, name, value, ttl=30, robust=True):
         """
         Add an A record to the site with name and ipaddress.
@@ -137,61 +830,37 @@ class DnsMeApi(object):
         :param name:
         :param value:
         :param ttl:
-        :param robust: will check that the cert exists after an add
+        :param robust: retry a failed create and check that the record exists after a failed add
         :return:
         """
 
-        data = {'name': name, 'type': 'TXT', 'value': value, 'gtdLocation': 'DEFAULT', 'ttl': ttl}
-        site_id = self.get_site_id(site)
-        targurl = self.url + '/' + str(site_id) + '/records/'
         try:
-            self._post(targurl, data)
-        except:
-            if robust:
-                time.sleep(2)
-                try:
-                    self._post(targurl, data)
-                except:
-                    return False
-            else:
+            self.upsert_record(site, name, 'TXT', value, ttl=ttl, robust=robust)
+        except Exception:
+            if not robust:
                 return False
+            # retries are done by the request layer, but the record may have been created anyway
+            site_id = self.get_site_id(site)
+            return bool(self.get_records(site_id, type='TXT', name=name, value=value, refresh=True))
         return True
 
+    @traced
     def add_a_record(self, site, name, ipaddress, ttl=30, robust=True):
         """
-        Add an A record to the site with name and ipaddress.
+        Add an A record to the site with name and ipaddress, unless it is already there.
 
         :param site:
         :param name:
         :param ipaddress:
         :param ttl:
-        :param robust: will check that the cert exists after an add
-        :return:
+        :param robust: also retry a create that failed in a way that may have taken effect (a 500, a
+            lost connection), a record that already exists counts as added
+        :return: the record
         """
 
-        data = {'name': name, 'type': 'A', 'value': ipaddress, 'gtdLocation': 'DEFAULT', 'ttl': ttl}
-        site_id = self.get_site_id(site)
-        targurl = self.url + '/' + str(site_id) + '/records/'
-        try:
-            self._post(targurl, data)
-        except:
-            print(traceback.format_exc())
-            if robust:
-                time.sleep(2)
-                try:
-                    self._post(targurl, data)
-                except:
-                    pass
-            else:
-                pass
-
-        if robust:
-            # verify
-            name_id = self._get_a_record_name(site_id, name, ipaddress)
-            if not name_id:
-                time.sleep(2)
-                self._post(targurl, data)
+        return self.upsert_record(site, name, 'A', ipaddress, ttl=ttl, robust=robust)
 
+    @traced
     def delete_a_record(self, site, name, ipaddress=''):
         """
         Delete an A record from site.
@@ -206,18 +875,16 @@ class DnsMeApi(object):
             raise Exception("No site id found for", site)
 
         name_id = self._get_a_record_name(site_id, name, ipaddress)
+        if not name_id:
+            # the index may predate the record, look again in a fresh download
+            name_id = self._get_a_record_name(site_id, name, ipaddress, refresh=True)
 
-        targurl = self.url + '/' + str(site_id) + '/records/' + str(name_id)
-        try:
-            self._delete(targurl)
-        except:
-            time.sleep(1)
-            self._delete(targurl)
+        self._delete_record(site_id, name_id)
 
-    def _get_a_record_name(self, site_id, name, ipaddress):
+    def _get_a_record_name(self, site_id, name, ipaddress, refresh=False):
 
         try:
-            r = self.get_records(site_id, type='A', name=name)
+            r = self.get_records(site_id, type='A', name=name, refresh=refresh)
 
             name_id = None
             if len(r) > 1 and not ipaddress:
@@ -238,29 +905,26 @@ class DnsMeApi(object):
 
         return name_id
 
+    @traced
     def delete_a_id(self, site_id, ip_id):
 
-        targurl = self.url + '/' + str(site_id) + '/records/' + str(ip_id)
-        self._delete(targurl)
+        self._delete_record(site_id, ip_id)
 
+    @traced
     def delete_a_ip(self, site, ipaddress=''):
 
         site_id = self.get_site_id(site)
         r = self.get_records(site_id, type='A', value=ipaddress)
         id_list = [x['id'] for x in r]
 
-        for ip_id in id_list:
-            targurl = self.url + '/' + str(site_id) + '/records/' + str(ip_id)
-            try:
-                self._delete(targurl)
-            except:
-                time.sleep(0.5)
-                self._delete(targurl)
+        failed = [x for x in self._delete_records(site_id, id_list) if not x['success']]
+        if failed:
+            raise Exception('Could not delete records ' + ', '.join(x['id'] + ': ' + x['error'] for x in failed))
 
 
-    def _get_a_record_ip(self, site_id, name, ipaddress):
+    def _get_a_record_ip(self, site_id, name, ipaddress, refresh=False):
 
-        r = self.get_records(site_id, type='A', name=name)
+        r = self.get_records(site_id, type='A', name=name, refresh=refresh)
 
         name_id = None
         if len(r) > 1 and not ipaddress:
@@ -279,6 +943,7 @@ class DnsMeApi(object):
 
         return name_id
 
+    @traced
     def delete_txt_record(self, site, name):
         """
         Delete all text records from site.
@@ -293,22 +958,14 @@ class DnsMeApi(object):
             raise Exception("No site id found for", site)
 
         records = self.get_records(site_id, type='TXT', name=name)
-        for del_id in [x['id'] for x in records]:
-            try:
-                targurl = self.url + '/' + str(site_id) + '/records/' + str(del_id)
-                self._delete(targurl)
-            except:
+        for result in self._delete_records(site_id, [x['id'] for x in records]):
+            if not result['success']:
                 print("ERROR deleting")
 
 
-def get_aws_ip():
-    try:
-        # check for aws ec2 instance
-        r = requests.get(url='http://169.254.169.254/latest/meta-data/public-ipv4', timeout=0.5)
-        aws_ip = r.text
-    except:
-        aws_ip = None
-    return aws_ip
+def get_aws_ip(session=None):
+    # check for aws ec2 instance, through IMDSv2 with a cached token
+    return get_public_ip(session=session)
 
 
 def get_domain(fulldomain):
@@ -318,6 +975,12 @@ def get_domain(fulldomain):
     return subdomain, domain
 
 
+def _deadline(api, seconds):
+    if seconds > 0:
+        return api.deadline(seconds)
+    return contextlib.nullcontext()
+
+
 def run_dnsscaling():
 
     parser = argparse.ArgumentParser(description="Dnsmadeeasy automatic A record assignment")
@@ -325,11 +988,41 @@ def run_dnsscaling():
     parser.add_argument('-a', '--add_record', type=str, default='', help="Add an A record associated with the domain")
     parser.add_argument('-d', '--delete_record', type=str, default='', help="Delete an A record "
                                                                             "associated with the domain")
-    parser.add_argument('-r', '--remove_record', type=bool, default=False, help="Delete an A record "
-                                                                            "associated with the ipaddress")
+    parser.add_argument('-r', '--remove_record', action='store_true', default=False,
+                        help="[flag] Delete the A records associated with the ipaddress")
     parser.add_argument('-i', '--init_script', type=str, default='', help="Create and store the init script for the"
                                                                           "domain")
-
+    parser.add_argument('--site_cache', type=str, default='', help="File (local or on EFS) used to share cached "
+                                                                   "site ids between runs")
+    parser.add_argument('--deadline', type=float, default=0, help="Seconds the delete/remove operation must "
+                                                                  "finish in, including retries")
+    parser.add_argument('-c', '--reconcile', type=str, default='', help="Make the A records of the domain match "
+                                                                        "the records given with --desired")
+    parser.add_argument('--desired', type=str, default='-', help="File of desired 'name ip' lines or json, "
+                                                                 "'-' for stdin")
+    parser.add_argument('--agent', action='store_true', default=False,
+                        help="[flag] With -a keep running as an agent that deletes the record when sent 'remove' "
+                             "on its socket, with -i start and use one in the init scripts")
+    parser.add_argument('--agent_socket', type=str, default=DEFAULT_AGENT_SOCKET, help="Unix socket of the agent")
+    parser.add_argument('--export', type=str, default='', help="Write a snapshot of the domain's records to the "
+                                                                "--snapshot file")
+    parser.add_argument('--snapshot', type=str, default='', help="Snapshot file written by --export")
+    parser.add_argument('--diff_snapshot', type=str, nargs='+', default=[],
+                        help="Print the differences between two snapshot files, or one and the live zone")
+    parser.add_argument('--restore_snapshot', type=str, default='', help="Recreate the records of a snapshot file "
+                                                                          "in its zone")
+    parser.add_argument('--dry_run', action='store_true', default=False,
+                        help="[flag] Only print the reconcile or restore changes")
+    parser.add_argument('--prune', action='store_true', default=False,
+                        help="[flag] Reconcile also deletes A records of names not in the desired set, restore "
+                             "deletes records not in the snapshot")
+    parser.add_argument('--stats', type=str, nargs='?', const='-', default='',
+                        help="Write a json timing breakdown of the run to the file, or stdout without a file")
+    parser.add_argument('--ipaddress', type=str, default='', help="Public ip address of this server, skips the "
+                                                                   "instance metadata lookup")
+    parser.add_argument('--credentials', type=str, default='', help="Json credentials file, defaults to the one "
+                                                                     "on EFS")
+    parser.add_argument('--api_url', type=str, default=DEFAULT_API_URL, help="Base url of the managed dns api")
 
     if not len(sys.argv) > 1:
         parser.print_help()
@@ -338,24 +1031,103 @@ def run_dnsscaling():
     args = parser.parse_args()
     if args.init_script:
         # write new script
-        write_init_script(args.init_script, '/etc/systemd/system/')
+        write_init_script(args.init_script, '/etc/systemd/system/', agent=args.agent, agent_socket=args.agent_socket)
         sys.exit()
 
-    elif (not args.add_record and not args.delete_record) or (args.add_record and args.delete_record):
+    elif len([x for x in (args.add_record, args.delete_record, args.remove_record, args.reconcile, args.export,
+                          args.diff_snapshot, args.restore_snapshot) if x]) != 1 or \
+            (args.export and not args.snapshot) or len(args.diff_snapshot) > 2:
         parser.print_help()
         sys.exit()
 
-    D = DnsMeApi()
+    elif len(args.diff_snapshot) == 2:
+        # two files are compared without the api
+        from dnsscaling import snapshot
+
+        old, new = [snapshot.load_snapshot(x) for x in args.diff_snapshot]
+        print(snapshot.format_diff(snapshot.diff(old, new)))
+        sys.exit()
+
+    instrumentation = Instrumentation()
+    collector = None
+    if args.stats:
+        collector = StatsCollector()
+        instrumentation.add_hook(collector)
+
+    try:
+        with instrumentation.span('init'):
+            # reconciling and snapshots work on given record sets, not on the address of this server
+            zone_command = bool(args.reconcile or args.export or args.diff_snapshot or args.restore_snapshot)
+            D = DnsMeApi(test_mode=zone_command, site_cache_path=args.site_cache,
+                         instrumentation=instrumentation, ipaddress=args.ipaddress or None,
+                         credentials_json=args.credentials, url=args.api_url)
+        with D:
+            _run_command(D, args)
+    finally:
+        if collector is not None:
+            collector.write(args.stats)
+
+
+def _run_command(D, args):
+
+    if args.reconcile:
+        from dnsscaling import reconcile
+
+        if args.desired == '-':
+            desired = reconcile.read_desired(sys.stdin, site=args.reconcile)
+        else:
+            with open(args.desired, 'r') as f:
+                desired = reconcile.read_desired(f, site=args.reconcile)
+
+        changes, results = reconcile.reconcile(D, args.reconcile, desired, dry_run=args.dry_run,
+                                               prune=args.prune)
+        print(reconcile.format_plan(changes, results))
+
+    elif args.export:
+        from dnsscaling import snapshot
+
+        count = snapshot.export_zone(D, args.export, args.snapshot)
+        print('{0}: {1} records written to {2}'.format(args.export, count, args.snapshot))
+
+    elif args.diff_snapshot:
+        from dnsscaling import snapshot
+
+        old = snapshot.load_snapshot(args.diff_snapshot[0])
+        print(snapshot.format_diff(snapshot.diff(old, snapshot.live_snapshot(D, old.site))))
 
-    if args.add_record:
+    elif args.restore_snapshot:
+        from dnsscaling import snapshot
+
+        saved = snapshot.load_snapshot(args.restore_snapshot)
+        changes, results = snapshot.restore(D, saved, prune=args.prune, dry_run=args.dry_run)
+        print(snapshot.format_diff(changes, prune=args.prune))
+        if results is not None:
+            for result in results['create'] + results['update'] + results['delete']:
+                if not result['success']:
+                    print('FAILED: ' + result['error'])
+
+    elif args.add_record:
         subdomain, domain = get_domain(args.add_record)
-        D.add_a_record(domain, subdomain, D.ipaddress)
+        record = D.add_a_record(domain, subdomain, D.ipaddress)
+        # marks the record as one of an instance for the sweeper's file checker, and lists it for
+        # the removal marker of the shutdown script
+        from dnsscaling.sweeper import ALIVE_DIR, write_alive
+
+        write_alive(D.ipaddress, [record['id']], agent=args.agent)
+        if args.agent:
+            from dnsscaling import agent
+
+            agent.start(D, D.get_site_id(domain), record, socket_path=args.agent_socket, alive_dir=ALIVE_DIR)
 
     elif args.remove_record:
-        D.delete_a_ip('simpa.io', D.ipaddress)
+        with _deadline(D, args.deadline):
+            D.delete_a_ip('simpa.io', D.ipaddress)
+        from dnsscaling.sweeper import remove_alive
+
+        remove_alive(D.ipaddress)
 
     elif args.delete_record:
 
         subdomain, domain = get_domain(args.delete_record)
-        D.delete_a_record(domain, subdomain, ipaddress=D.ipaddress)
-
+        with _deadline(D, args.deadline):
+            D.delete_a_record(domain, subdomain, ipaddress=D.ipaddress)
@@ -0,0 +1,246 @@
+"""
+Certificate private keys of selectable type and a pool of keys generated ahead of time
+"""
+
+import argparse
+from concurrent import futures
+import os
+import tempfile
+import threading
+import uuid
+
+from dnsscaling.cache import private_dir
+
+# key type -> (algorithm, rsa bits or curve name)
+KEY_TYPES = {
+    'rsa2048': ('rsa', 2048),
+    'rsa3072': ('rsa', 3072),
+    'rsa4096': ('rsa', 4096),
+    'ec256': ('ec', 'secp256r1'),
+    'ec384': ('ec', 'secp384r1'),
+}
+DEFAULT_KEY_TYPE = 'rsa2048'
+
+# local disk, the keys are secrets and must not be shared between hosts
+DEFAULT_POOL_PATH = '/var/lib/dnsscaling/keys/'
+# keys kept ready per key type
+DEFAULT_POOL_SIZE = 4
+
+
+def _check_key_type(key_type):
+    if key_type not in KEY_TYPES:
+        raise ValueError('Unknown key type {0}, use one of {1}'.format(key_type, ', '.join(sorted(KEY_TYPES))))
+
+
+def generate_key(key_type=DEFAULT_KEY_TYPE):
+    """Generate a private key of key_type and return it as unencrypted PKCS#8 PEM bytes."""
+
+    _check_key_type(key_type)
+    from cryptography.hazmat.backends import default_backend
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import ec, rsa
+
+    algorithm, parameter = KEY_TYPES[key_type]
+    if algorithm == 'rsa':
+        key = rsa.generate_private_key(public_exponent=65537, key_size=parameter, backend=default_backend())
+    else:
+        curve = {'secp256r1': ec.SECP256R1, 'secp384r1': ec.SECP384R1}[parameter]
+        key = ec.generate_private_key(curve(), backend=default_backend())
+    return key.private_bytes(encoding=serialization.Encoding.PEM, format=serialization.PrivateFormat.PKCS8,
+                             encryption_algorithm=serialization.NoEncryption())
+
+
+def certbot_key_args(key_type):
+    """certbot command line options requesting a certificate key of key_type, '' for certbot's default."""
+
+    if not key_type:
+        return ''
+    _check_key_type(key_type)
+    algorithm, parameter = KEY_TYPES[key_type]
+    if algorithm == 'rsa':
+        return '--key-type rsa --rsa-key-size {0}'.format(parameter)
+    return '--key-type ecdsa --elliptic-curve {0}'.format(parameter)
+
+
+def provisioned_pool(key_type=DEFAULT_KEY_TYPE, path=DEFAULT_POOL_PATH, **kwargs):
+    """
+    KeyPool of path if its directory for key_type was created (by dnskeypool) and is private to
+    the current user, None otherwise.  kwargs are passed to KeyPool.
+    """
+
+    _check_key_type(key_type)
+    key_dir = os.path.join(path, key_type)
+    if not os.path.isdir(key_dir) or not private_dir(path) or not private_dir(key_dir):
+        return None
+    return KeyPool(path, **kwargs)
+
+
+def _store_key(path, pem):
+    """Store pem in the directory path under a new name, atomically and readable by the owner only."""
+
+    # mkstemp creates the file readable by its owner only, the dot hides it from take until renamed
+    fd, tmp = tempfile.mkstemp(dir=path, prefix='.', suffix='.pem')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(pem)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, os.path.join(path, uuid.uuid4().hex + '.pem'))
+
+
+def _generate_into(generate, key_type, path):
+    """Worker process task: generate one key and store it in the pool directory path."""
+    _store_key(path, generate(key_type))
+
+
+class KeyPool(object):
+    """
+    Directory of ready private keys, one subdirectory per key type, filled by a process pool.
+
+    take() hands out a stored key, so issuing a certificate does not wait for a key to be
+    generated (seconds for large RSA keys), and starts a background refill.  Keys are claimed with
+    a rename, so several processes can share one pool without handing out a key twice.  A key
+    claimed by a process that died before removing it is deleted by the next take, it may have
+    been used.  The directories are only accessible and the key files only readable by their owner.
+
+    generate is called in the worker processes and must be a module level function.
+    """
+
+    def __init__(self, path=DEFAULT_POOL_PATH, size=DEFAULT_POOL_SIZE, workers=None, generate=generate_key):
+
+        self.path = path
+        self.size = size
+        self.workers = workers
+        self.generate = generate
+        self._executor = None
+        self._pending = []
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _dir(self, key_type):
+
+        _check_key_type(key_type)
+        path = os.path.join(self.path, key_type)
+        os.makedirs(path, mode=0o700, exist_ok=True)
+        # makedirs does not change an existing directory and applies the umask
+        os.chmod(self.path, 0o700)
+        os.chmod(path, 0o700)
+        return path
+
+    def _keys(self, key_type):
+        return sorted(x for x in os.listdir(self._dir(key_type)) if x.endswith('.pem') and not x.startswith('.'))
+
+    @staticmethod
+    def _sweep(path):
+        """Delete the keys claimed in path by processes that no longer run."""
+
+        for name in os.listdir(path):
+            if not name.startswith('.taken-'):
+                continue
+            try:
+                os.kill(int(name.split('-')[1]), 0)
+            except ValueError:
+                continue
+            except ProcessLookupError:
+                try:
+                    os.remove(os.path.join(path, name))
+                except FileNotFoundError:
+                    pass
+            except PermissionError:
+                # running under another user
+                pass
+
+    def count(self, key_type=DEFAULT_KEY_TYPE):
+        """Number of ready keys of key_type."""
+        return len(self._keys(key_type))
+
+    def take(self, key_type=DEFAULT_KEY_TYPE, refill=True):
+        """
+        Return the PEM bytes of a ready key of key_type, removed from the pool, generating one here
+        if the pool is empty.  With refill a background fill back to size is started.
+        """
+
+        path = self._dir(key_type)
+        self._sweep(path)
+        pem = None
+        for name in self._keys(key_type):
+            claimed = os.path.join(path, '.taken-{0}-{1}'.format(os.getpid(), name))
+            try:
+                os.rename(os.path.join(path, name), claimed)
+            except FileNotFoundError:
+                # taken by another process
+                continue
+            try:
+                with open(claimed, 'rb') as f:
+                    pem = f.read()
+            finally:
+                os.remove(claimed)
+            break
+
+        if refill:
+            self.fill(key_type, wait=False)
+        if pem is None:
+            pem = self.generate(key_type)
+        return pem
+
+    def fill(self, key_type=DEFAULT_KEY_TYPE, wait=True):
+        """
+        Generate keys of key_type in the process pool until the pool holds size keys.
+
+        :param wait: block until the keys are stored, otherwise they are stored in the background
+            and close() waits for them
+        :return: number of keys requested
+        """
+
+        # several threads may take keys from one pool
+        with self._lock:
+            missing = self.size - self.count(key_type) - len([x for x in self._pending
+                                                              if x[0] == key_type and not x[1].done()])
+            if missing <= 0:
+                return 0
+
+            path = self._dir(key_type)
+            if self._executor is None:
+                self._executor = futures.ProcessPoolExecutor(max_workers=self.workers)
+            # the workers store the keys themselves, so a finished future means a stored key
+            requested = [(key_type, self._executor.submit(_generate_into, self.generate, key_type, path))
+                         for _ in range(missing)]
+            self._pending = [x for x in self._pending if not x[1].done()] + requested
+
+        if wait:
+            futures.wait([x[1] for x in requested])
+            for _, future in requested:
+                # raise the error of a failed generation
+                future.result()
+        return missing
+
+    def close(self, wait=True):
+        """Stop the process pool, by default after the background fills are stored."""
+
+        with self._lock:
+            executor, self._executor = self._executor, None
+            self._pending = []
+        if executor is not None:
+            executor.shutdown(wait=wait)
+
+
+def run_keypool():
+
+    parser = argparse.ArgumentParser(description="Generate certificate private keys ahead of time")
+    parser.add_argument('--key_type', type=str, nargs='+', default=[DEFAULT_KEY_TYPE], choices=sorted(KEY_TYPES),
+                        help="Key types to fill the pool with")
+    parser.add_argument('--size', type=int, default=DEFAULT_POOL_SIZE, help="Keys to keep ready per key type")
+    parser.add_argument('--path', type=str, default=DEFAULT_POOL_PATH, help="Directory of the pool")
+    parser.add_argument('--workers', type=int, default=None, help="Generating processes, defaults to the cpu count")
+    args = parser.parse_args()
+
+    with KeyPool(args.path, size=args.size, workers=args.workers) as pool:
+        for key_type in args.key_type:
+            pool.fill(key_type, wait=False)
+        pool.close()
+        for key_type in args.key_type:
+            print('{0}: {1} keys ready'.format(key_type, pool.count(key_type)))
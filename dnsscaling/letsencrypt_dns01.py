@@ -1,17 +1,23 @@
 
+from concurrent import futures
 from cryptography.hazmat.backends import default_backend
 from cryptography.hazmat.primitives.asymmetric import rsa
 import josepy as jose
-import OpenSSL
 import re
 import time
 
 from acme import challenges
 from acme import client
 from acme import crypto_util
+from acme import errors
 from acme import messages
 
+from dnsscaling.acme_account import AcmeAccountStore
+from dnsscaling.certificates import CertificateInventory, covers, due
+from dnsscaling.dns01 import ChallengeRecords, challenge_record
 from dnsscaling.dnsapi import DnsMeApi
+from dnsscaling.keys import generate_key, provisioned_pool
+from dnsscaling.propagation import DEFAULT_TIMEOUT as PROPAGATION_TIMEOUT
 
 # Constants:
 
@@ -25,21 +31,26 @@ EMAIL = 'soren@simpa.io'
 
 # Account key size
 ACC_KEY_BITS = 2048
-# Certificate private key size
-CERT_PKEY_BITS = 2048
+# Certificate private key type, one of dnsscaling.keys.KEY_TYPES
+CERT_KEY_TYPE = 'rsa2048'
 
 # Domain name for the certificate.
 DOMAIN = 'simpa.io'
 
+# most orders placed and finalized at the same time by issue_certificates
+ORDER_WORKERS = 8
 
-def new_csr_comp(domain_name, pkey_pem=None):
-    """Create certificate signing request."""
+
+def new_csr_comp(domain_name, pkey_pem=None, key_type=CERT_KEY_TYPE, key_pool=None):
+    """Create certificate signing request, for a list of names as subject alternative names."""
     if pkey_pem is None:
-        # Create private key.
-        pkey = OpenSSL.crypto.PKey()
-        pkey.generate_key(OpenSSL.crypto.TYPE_RSA, CERT_PKEY_BITS)
-        pkey_pem = OpenSSL.crypto.dump_privatekey(OpenSSL.crypto.FILETYPE_PEM, pkey)
-    csr_pem = crypto_util.make_csr(pkey_pem, [domain_name])
+        # Take a pre-generated private key from the pool, or create one.
+        if key_pool is not None:
+            pkey_pem = key_pool.take(key_type)
+        else:
+            pkey_pem = generate_key(key_type)
+    domains = [domain_name] if isinstance(domain_name, str) else list(domain_name)
+    csr_pem = crypto_util.make_csr(pkey_pem, domains)
     return pkey_pem, csr_pem
 
 
@@ -60,11 +71,233 @@ def select_dns01_chall(orderr):
     raise Exception('HTTP-01 challenge was not offered by the CA server.')
 
 
-def create_dns01(production=False, wildcard=True, dnsme_credentials_file='dme_credentials.json'):
+def select_dns01_challs(orderr):
+    """
+    DNS01 challenge of every authorization of the order that is not valid yet, as a list of
+    (identifier, challenge body).  Authorizations validated by an earlier order are reused by the
+    server and need no challenge.
+    """
+
+    selected = []
+    for authz in orderr.authorizations:
+        if authz.body.status == messages.STATUS_VALID:
+            continue
+        for i in authz.body.challenges:
+            if isinstance(i.chall, challenges.DNS01):
+                selected.append((authz.body.identifier.value, i))
+                break
+        else:
+            raise Exception('DNS-01 challenge was not offered for {0}.'.format(authz.body.identifier.value))
+    return selected
+
+
+def haproxy_pem(fullchain_pem, pkey_pem):
+    """Full chain and private key in one file, as haproxy reads them."""
+    return re.sub('\n+', '\n', fullchain_pem + pkey_pem.decode())
+
+
+def get_client(directory_url, store, email=EMAIL):
+    """
+    ACME client for directory_url with the account in store, creating and registering one only
+    the first time.
+
+    The directory is taken from the store while it is fresh, so with a stored account no request
+    is made here and the first round trip of a run is the new order.
+    """
+
+    account = store.load_account(directory_url)
+    if account is None:
+        acc_key = jose.JWKRSA(
+            key=rsa.generate_private_key(public_exponent=65537,
+                                         key_size=ACC_KEY_BITS,
+                                         backend=default_backend()))
+        # keep the key before registering, a failed registration is then retried with the same key
+        store.save_account(directory_url, acc_key.to_json())
+        regr = None
+    else:
+        acc_key = jose.JWKRSA.from_json(account['key'])
+        regr = messages.RegistrationResource.from_json(account['regr']) if account['regr'] else None
+
+    net = client.ClientNetwork(acc_key, account=regr, user_agent=USER_AGENT)
+
+    directory_json = store.load_directory(directory_url)
+    if directory_json is None:
+        directory_json = net.get(directory_url).json()
+        store.save_directory(directory_url, directory_json)
+    client_acme = client.ClientV2(messages.Directory.from_json(directory_json), net=net)
+
+    if regr is None:
+        # Terms of Service URL is in client_acme.directory.meta.terms_of_service
+        # Registration Resource: regr
+        # Creates account with contact information.
+        msg = messages.NewRegistration.from_data(email=email, terms_of_service_agreed=True)
+        try:
+            regr = client_acme.new_account(msg)
+        except errors.ConflictError as e:
+            # the key is registered already, the server answers with the account url
+            regr = messages.RegistrationResource(uri=e.location, body=messages.Registration())
+            client_acme.net.account = regr
+        store.save_account(directory_url, acc_key.to_json(), regr.to_json())
+
+    return client_acme
+
+
+def new_order(client_acme, csr_pem, directory_url, store, email=EMAIL):
+    """
+    Place an order, registering a new account once if the stored one is no longer valid.
+
+    :return: (client, order) with the client the order was placed with
+    """
+
+    try:
+        return client_acme, client_acme.new_order(csr_pem)
+    except messages.Error as e:
+        if e.code not in ('accountDoesNotExist', 'unauthorized'):
+            raise
+    store.remove_account(directory_url)
+    store.invalidate_directory(directory_url)
+    client_acme = get_client(directory_url, store, email=email)
+    return client_acme, client_acme.new_order(csr_pem)
+
+
+def _place_order(domains, directory_url, store, key_type, key_pool, client_acme=None):
+
+    pkey_pem, csr_pem = new_csr_comp(domains, key_type=key_type, key_pool=key_pool)
+    if client_acme is None:
+        # a client per thread, with the stored account and directory this makes no request, and no
+        # re-registration from several threads at once
+        client_acme = get_client(directory_url, store)
+        orderr = client_acme.new_order(csr_pem)
+    else:
+        client_acme, orderr = new_order(client_acme, csr_pem, directory_url, store)
+    return {'client': client_acme, 'key_pem': pkey_pem, 'order': orderr}
+
+
+def _finalize(client_acme, orderr, answers):
+
+    for challb, response in answers:
+        client_acme.answer_challenge(challb, response)
+    return client_acme.poll_and_finalize(orderr).fullchain_pem
+
+
+def issue_certificates(domain_groups, production=False, dnsme_credentials_file='dme_credentials.json',
+                       nameservers=None, propagation_timeout=PROPAGATION_TIMEOUT, account_store=None,
+                       key_type=CERT_KEY_TYPE, key_pool=None, workers=ORDER_WORKERS, dnsme=None, inventory=None,
+                       force=False):
+    """
+    Issue a batch of certificates with DNS-01 challenges.
+
+    Every entry of domain_groups is one order, a list of domains makes one certificate with all
+    of them as subject alternative names and a single domain its own certificate.  The orders
+    are placed concurrently, the challenge records of all of them are written with one bulk
+    create per zone, their propagation is checked at the same time, every authorization is
+    answered and the orders finalized concurrently, and the records are deleted with one bulk
+    delete per zone at the end.  A zone whose records cannot be published or do not propagate
+    only fails the orders with an identifier in it.  Publishing and propagation are timed in the
+    challenge_publish and challenge_propagation spans of the instrumentation of dnsme.
+
+    With an inventory, a group already covered by a certificate that is not due for renewal is
+    skipped, unless force is set.
+
+    :param domain_groups: list of domains or lists of domains
+    :param dnsme: DnsMeApi, created from dnsme_credentials_file if not given
+    :param inventory: CertificateInventory of the current certificates
+    :return: list in the order of domain_groups of dicts with domains, key_pem, fullchain_pem,
+        error ('' if the certificate was issued or skipped) and skipped (the metadata of the
+        valid certificate, None if one was ordered)
+    """
+
+    directory_url = PROD_DIRECTORY_URL if production else DIRECTORY_URL
+    if account_store is None:
+        account_store = AcmeAccountStore()
+    groups = [[x] if isinstance(x, str) else list(x) for x in domain_groups]
+    results = [{'domains': x, 'key_pem': b'', 'fullchain_pem': '', 'error': '', 'skipped': None} for x in groups]
+
+    todo = []
+    for i, group in enumerate(groups):
+        current = inventory.find(group) if inventory is not None and not force else None
+        if current is not None and not due(current):
+            results[i]['skipped'] = current
+        else:
+            todo.append(i)
+    if not todo:
+        return results
+
+    # the first order registers the account or replaces a stale one, the others then reuse it
+    orders = [None] * len(groups)
+    try:
+        orders[todo[0]] = _place_order(groups[todo[0]], directory_url, account_store, key_type, key_pool,
+                                       client_acme=get_client(directory_url, account_store))
+    except Exception as e:
+        results[todo[0]]['error'] = 'order: ' + str(e)
+
+    with futures.ThreadPoolExecutor(max_workers=max(1, min(workers, len(todo) - 1))) as executor:
+        placing = {executor.submit(_place_order, groups[i], directory_url, account_store, key_type, key_pool): i
+                   for i in todo[1:]}
+        for future in futures.as_completed(placing):
+            i = placing[future]
+            try:
+                orders[i] = future.result()
+            except Exception as e:
+                results[i]['error'] = 'order: ' + str(e)
+
+    validations = []
+    for i, order in enumerate(orders):
+        if order is None:
+            continue
+        try:
+            selected = select_dns01_challs(order['order'])
+        except Exception as e:
+            results[i]['error'] = 'order: ' + str(e)
+            orders[i] = None
+            continue
+        order['answers'] = []
+        order['zones'] = set()
+        for identifier, challb in selected:
+            response, validation = challb.response_and_validation(order['client'].net.key)
+            order['answers'].append((challb, response))
+            order['zones'].add(challenge_record(identifier)[0])
+            validations.append((identifier, validation))
+
+    if dnsme is None:
+        dnsme = DnsMeApi(test_mode=True, credentials_json=dnsme_credentials_file)
+    with ChallengeRecords(dnsme, nameservers=nameservers, timeout=propagation_timeout) as records:
+        with dnsme.instrumentation.span('challenge_publish'):
+            records.publish(validations)
+        failed = dict(records.failed)
+        # answer as soon as every authoritative nameserver serves the values, an answer before
+        # that fails the order
+        with dnsme.instrumentation.span('challenge_propagation'):
+            waited = records.wait_zones()
+        failed.update((zone, str(x)) for zone, x in waited.items() if isinstance(x, Exception))
+
+        for i, order in enumerate(orders):
+            broken = sorted(order['zones'] & set(failed)) if order is not None else []
+            if broken:
+                results[i]['error'] = 'challenge: ' + '; '.join(failed[x] for x in broken)
+                orders[i] = None
+
+        with futures.ThreadPoolExecutor(max_workers=max(1, min(workers, len(todo)))) as executor:
+            finalizing = {executor.submit(_finalize, order['client'], order['order'], order['answers']): i
+                          for i, order in enumerate(orders) if order is not None}
+            for future in futures.as_completed(finalizing):
+                i = finalizing[future]
+                try:
+                    results[i]['fullchain_pem'] = future.result()
+                    results[i]['key_pem'] = orders[i]['key_pem']
+                except Exception as e:
+                    results[i]['error'] = 'finalize: ' + str(e)
+
+    return results
+
+
+def create_dns01(production=False, wildcard=True, dnsme_credentials_file='dme_credentials.json', nameservers=None,
+                 propagation_timeout=PROPAGATION_TIMEOUT, account_store=None, key_type=CERT_KEY_TYPE, key_pool=None,
+                 force=False):
     """This example executes the whole process of fulfilling a HTTP-01
     challenge for one specific domain.
     The workflow consists of:
-    (Account creation)
+    (Account creation, only if account_store has no account for the directory)
     - Create account key
     - Register account and accept TOS
     (Certificate actions)
@@ -76,65 +309,37 @@ def create_dns01(production=False, wildcard=True, dnsme_credentials_file='dme_cr
     - Change contact information
     - Deactivate Account
     """
-    # Create account key
-
-    acc_key = jose.JWKRSA(
-        key=rsa.generate_private_key(public_exponent=65537,
-                                     key_size=ACC_KEY_BITS,
-                                     backend=default_backend()))
-
-    # Register account and accept TOS
-    if production:
-        directory_url = PROD_DIRECTORY_URL
-    else:
-        directory_url = DIRECTORY_URL
-
-    net = client.ClientNetwork(acc_key, user_agent=USER_AGENT)
-    directory = messages.Directory.from_json(net.get(directory_url).json())
-    client_acme = client.ClientV2(directory, net=net)
-
-    # Terms of Service URL is in client_acme.directory.meta.terms_of_service
-    # Registration Resource: regr
-    # Creates account with contact information.
-    email = (EMAIL)
-    msg = messages.NewRegistration.from_data(
-            email=email, terms_of_service_agreed=True)
-    regr = client_acme.new_account(msg)
-
     # Create domain private key and CSR
     domain = DOMAIN
     if wildcard:
         domain = f'*.{DOMAIN}'
     print("GETTING CERT FOR", domain)
-    pkey_pem, csr_pem = new_csr_comp(domain)
-
-    # Issue certificate
-    orderr = client_acme.new_order(csr_pem)
 
-    # Select DNS01 within offered challenges by the CA server
-    challb = select_dns01_chall(orderr)
-    response, validation = challb.response_and_validation(client_acme.net.key)
+    # Skip the whole issuance while the current certificate is valid and not due for renewal
+    current = CertificateInventory(paths=[], cache_path='').certificate('haproxy.pem')
+    if not force and current is not None and covers(current, [domain]) and not due(current):
+        print("Certificate valid until", time.strftime('%Y-%m-%d', time.gmtime(current['not_after'])))
+        return
 
-    # write challenge to DNS made easy
-    dnsme = DnsMeApi(test_mode=True, credentials_json=dnsme_credentials_file)
-    dnsme.delete_txt_record(DOMAIN, '_acme-challenge')
-    success = dnsme.add_txt_record(DOMAIN, '_acme-challenge', validation)
-    time.sleep(8)
-    print("Trying challenge...")
+    # Take the key from the pool filled by dnskeypool, if there is one
+    own_pool = None
+    if key_pool is None:
+        key_pool = own_pool = provisioned_pool(key_type)
 
+    # Issue certificate, writing the challenge to DNS made easy
     try:
-        # get full pem via challenge
-        x = client_acme.answer_challenge(challb, response)
-        finalized_orderr = client_acme.poll_and_finalize(orderr)
-        fullpem = finalized_orderr.fullchain_pem
-
-        s = fullpem + pkey_pem.decode()
-        s = re.sub(f'\n+', '\n', s)
-        with open('haproxy.pem', 'w') as proxypem:
-            proxypem.write(s)
+        result = issue_certificates([[domain]], production=production, dnsme_credentials_file=dnsme_credentials_file,
+                                    nameservers=nameservers, propagation_timeout=propagation_timeout,
+                                    account_store=account_store, key_type=key_type, key_pool=key_pool)[0]
     finally:
-        # delete
-        dnsme.delete_txt_record(DOMAIN, '_acme-challenge')
+        if own_pool is not None:
+            # store the refilled key for the next run
+            own_pool.close()
+    if result['error']:
+        raise Exception('Certificate for {0} not issued: {1}'.format(domain, result['error']))
+
+    with open('haproxy.pem', 'w') as proxypem:
+        proxypem.write(haproxy_pem(result['fullchain_pem'], result['key_pem']))
 
 
     '''
@@ -0,0 +1,435 @@
+"""
+In process mock of the DNS made easy V2.0 managed dns api for tests, benchmarks and simulations
+"""
+
+import collections
+import hashlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import hmac
+import json
+import random
+import threading
+import time
+from urllib.parse import parse_qs, urlsplit
+
+import requests
+from requests.adapters import BaseAdapter
+
+from dnsscaling.records import type_fields
+
+API_HOST = 'https://api.dnsmadeeasy.com'
+API_PATH = '/V2.0/dns/managed'
+
+
+class MockDnsMe(object):
+    """
+    State and request handling of a mock DNS made easy account.
+
+    Requests must carry valid x-dnsme-* hmac headers for the mock's credentials.  The mock can add
+    latency, enforce a rolling request quota like the real api (answering 400 "Rate limit exceeded"
+    with the x-dnsme-requestLimit / x-dnsme-requestsRemaining headers) and inject errors, and it
+    counts calls and bytes per endpoint.  Install it on a client with install(), which mounts a
+    transport adapter on the client's session, so no sockets are involved:
+
+        mock = MockDnsMe(latency=0.02)
+        mock.add_zone('simpa.io', records=1000)
+        api = DnsMeApi(test_mode=True, credentials=mock.credentials)
+        mock.install(api)
+    """
+
+    def __init__(self, apikey='mock-apikey', apisecret='mock-apisecret', latency=0.0, jitter=0.0,
+                 quota=None, window=300, error_rate=0.0, seed=None):
+
+        self.apikey = apikey
+        self.apisecret = apisecret
+        # seconds added to every request, plus a uniform random 0 to jitter
+        self.latency = latency
+        self.jitter = jitter
+        # requests allowed per rolling window seconds, None for no quota
+        self.quota = quota
+        self.window = window
+        # fraction of requests answered with a 500
+        self.error_rate = error_rate
+        # statuses returned, in order, for the next requests
+        self.errors = []
+        # latencies used, in order, instead of latency for the next requests
+        self.latencies = []
+        # reject multi record creates and updates and id list deletes with a 500
+        self.fail_bulk = False
+
+        self.calls = []
+        self.stats = {}
+        self.reset_stats()
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._sites = {}
+        self._zones = {}
+        self._keys = {}
+        self._requests = collections.deque()
+        self._next_site_id = 100
+        self._next_id = 1000
+
+    @property
+    def credentials(self):
+        return {'apikey': self.apikey, 'apisecret': self.apisecret}
+
+    def reset_stats(self):
+        self.calls = []
+        self.stats = {'requests': 0, 'request_bytes': 0, 'response_bytes': 0, 'rate_limited': 0, 'endpoints': {}}
+
+    def install(self, api):
+        """Route the requests of a DnsMeApi (or a requests session) to this mock."""
+
+        session = getattr(api, 'session', api)
+        session.mount(API_HOST, MockDnsMeAdapter(self))
+
+    def add_zone(self, name, records=0, site_id=None):
+        """
+        Add a managed domain holding records generated A records named host<n>.
+
+        :return: site id of the zone
+        """
+
+        with self._lock:
+            if site_id is None:
+                self._next_site_id += 1
+                site_id = self._next_site_id
+            site_id = str(site_id)
+            self._sites[site_id] = name
+            self._zones[site_id] = collections.OrderedDict()
+            self._keys[site_id] = {}
+            for i in range(records):
+                self._create(site_id, {'name': 'host%d' % i, 'type': 'A', 'ttl': 30, 'gtdLocation': 'DEFAULT',
+                                       'value': '10.%d.%d.%d' % (i >> 16 & 255, i >> 8 & 255, i & 255)})
+        return site_id
+
+    def add_record(self, site_id, name, type, value, ttl=1800, **fields):
+        """
+        Add a record to a zone directly, without the duplicate check of the api, returning it.
+
+        fields are the type specific fields like the mxLevel of MX records and gtdLocation.
+        """
+
+        with self._lock:
+            return dict(self._create(str(site_id), dict(fields, name=name, type=type, value=value, ttl=ttl)))
+
+    def records(self, site_id):
+        with self._lock:
+            return [dict(x) for x in self._zones[str(site_id)].values()]
+
+    def _create(self, site_id, data):
+
+        self._next_id += 1
+        record = {
+            'id': self._next_id, 'name': data['name'], 'type': data['type'], 'value': data['value'],
+            'ttl': data.get('ttl', 1800), 'gtdLocation': data.get('gtdLocation', 'DEFAULT'),
+            'source': 1, 'sourceId': int(site_id), 'dynamicDns': False, 'failover': False,
+            'monitor': False, 'hardLink': False,
+        }
+        record.update(type_fields(data) or {})
+        self._add(site_id, record)
+        return record
+
+    def _add(self, site_id, record):
+
+        zone = self._zones[site_id]
+        last = next(reversed(zone), None)
+        zone[record['id']] = record
+        if last is not None and last > record['id']:
+            # a record updated in place goes back to its position, the listing is in id order
+            for record_id in [x for x in zone if x > record['id']]:
+                zone.move_to_end(record_id)
+        self._keys[site_id].setdefault((record['type'], record['name'], record['value']), set()).add(record['id'])
+
+    def _remove(self, site_id, record_id):
+
+        record = self._zones[site_id].pop(record_id)
+        key = (record['type'], record['name'], record['value'])
+        self._keys[site_id][key].discard(record_id)
+        if not self._keys[site_id][key]:
+            del self._keys[site_id][key]
+
+    def _duplicate(self, site_id, data):
+        key = (data.get('type'), data.get('name'), data.get('value'))
+        if key in self._keys[site_id]:
+            return 'Record with this type ({0}), name ({1}), and value ({2}) already exists.'.format(*key)
+        return ''
+
+    def _update_error(self, site_id, data):
+        """Error of updating the existing record data['id'] with data, '' if it is allowed."""
+
+        record = self._zones[site_id][data['id']]
+        key = (data.get('type', record['type']), data.get('name', record['name']), data.get('value', record['value']))
+        if key != (record['type'], record['name'], record['value']):
+            return self._duplicate(site_id, dict(zip(('type', 'name', 'value'), key)))
+        return ''
+
+    def _update(self, site_id, data):
+
+        record = self._zones[site_id][data['id']]
+        self._remove(site_id, data['id'])
+        record.update({k: v for k, v in data.items() if k in ('name', 'type', 'value', 'ttl', 'gtdLocation')})
+        record.update(type_fields(dict(data, type=record['type'])) or {})
+        self._add(site_id, record)
+
+    @staticmethod
+    def _list_records(zone, query):
+        """One page of the records of a zone, filtered by the type and recordName parameters."""
+
+        type = query.get('type', [''])[0]
+        name = query.get('recordName', [''])[0]
+        data = [x for x in zone.values() if (not type or x['type'] == type) and (not name or x['name'] == name)]
+
+        total = len(data)
+        if 'rows' not in query:
+            return {'data': data, 'page': 0, 'totalPages': 1, 'totalRecords': total}
+        rows = max(1, int(query['rows'][0]))
+        page = int(query.get('page', ['0'])[0])
+        return {'data': data[page * rows:(page + 1) * rows], 'page': page, 'totalPages': max(1, -(-total // rows)),
+                'totalRecords': total}
+
+    def next_latency(self):
+        with self._lock:
+            if self.latencies:
+                return self.latencies.pop(0)
+            return self.latency + (self._random.uniform(0, self.jitter) if self.jitter else 0)
+
+    def handle(self, method, url, headers, body):
+        """
+        Answer one request.
+
+        :return: (status, response headers, response body bytes)
+        """
+
+        with self._lock:
+            status, out_headers, content = self._handle(method, url, headers, body)
+
+            content = json.dumps(content).encode('utf-8') if content is not None else b''
+            self.stats['requests'] += 1
+            self.stats['request_bytes'] += len(body or b'')
+            self.stats['response_bytes'] += len(content)
+            out_headers['Content-Type'] = 'application/json'
+            return status, out_headers, content
+
+    def _quota_headers(self):
+
+        if self.quota is None:
+            return {}, True
+
+        now = time.monotonic()
+        while self._requests and self._requests[0] <= now - self.window:
+            self._requests.popleft()
+
+        allowed = len(self._requests) < self.quota
+        if allowed:
+            self._requests.append(now)
+        remaining = self.quota - len(self._requests)
+        return {'x-dnsme-requestLimit': str(self.quota), 'x-dnsme-requestsRemaining': str(remaining)}, allowed
+
+    def _handle(self, method, url, headers, body):
+
+        url = urlsplit(url)
+        path = url.path[len(API_PATH):] if url.path.startswith(API_PATH) else None
+        parts = [p for p in (path or '').split('/') if p]
+        query = parse_qs(url.query)
+        endpoint = _endpoint(method, parts, query)
+
+        self.calls.append((method, url.path))
+        self.stats['endpoints'][endpoint] = self.stats['endpoints'].get(endpoint, 0) + 1
+
+        if path is None:
+            return 404, {}, {'error': ['Not found']}
+
+        date = headers.get('x-dnsme-requestDate', '')
+        expected = hmac.new(self.apisecret.encode('utf-8'), date.encode('utf-8'), hashlib.sha1).hexdigest()
+        if headers.get('x-dnsme-apiKey') != self.apikey or \
+                not hmac.compare_digest(headers.get('x-dnsme-hmac', ''), expected):
+            return 403, {}, {'error': ['API key not found or hmac invalid']}
+
+        out_headers, allowed = self._quota_headers()
+        if not allowed:
+            self.stats['rate_limited'] += 1
+            return 400, out_headers, {'error': ['Rate limit exceeded']}
+
+        if self.errors:
+            return self.errors.pop(0), out_headers, {'error': ['Injected error']}
+        if self.error_rate and self._random.random() < self.error_rate:
+            return 500, out_headers, {'error': ['Injected error']}
+        if self.fail_bulk and endpoint in ('records_create_multi', 'records_update_multi', 'records_delete_multi'):
+            return 500, out_headers, {'error': ['Injected bulk error']}
+
+        if endpoint == 'domains':
+            data = [{'id': int(k), 'name': v} for k, v in self._sites.items()]
+            return 200, out_headers, {'data': data, 'page': 0, 'totalPages': 1, 'totalRecords': len(data)}
+
+        site_id = parts[0]
+        if site_id not in self._zones:
+            return 404, out_headers, {'error': ['Domain not found']}
+        zone = self._zones[site_id]
+
+        if endpoint == 'records':
+            return 200, out_headers, self._list_records(zone, query)
+
+        if endpoint == 'record_create':
+            data = json.loads(body.decode('utf-8'))
+            error = self._duplicate(site_id, data)
+            if error:
+                return 400, out_headers, {'error': [error]}
+            return 201, out_headers, self._create(site_id, data)
+
+        if endpoint == 'records_create_multi':
+            data = json.loads(body.decode('utf-8'))
+            errors = [e for e in (self._duplicate(site_id, x) for x in data) if e]
+            if errors:
+                return 400, out_headers, {'error': errors}
+            return 201, out_headers, [self._create(site_id, x) for x in data]
+
+        if endpoint == 'records_delete_multi':
+            ids = [int(x) for x in query['ids']]
+            missing = [str(x) for x in ids if x not in zone]
+            if missing:
+                return 404, out_headers, {'error': ['Records not found: ' + ', '.join(missing)]}
+            for record_id in ids:
+                self._remove(site_id, record_id)
+            return 200, out_headers, None
+
+        if endpoint == 'record_update':
+            record_id = int(parts[2])
+            if record_id not in zone:
+                return 404, out_headers, {'error': ['Record not found']}
+            data = json.loads(body.decode('utf-8'))
+            error = self._update_error(site_id, dict(data, id=record_id))
+            if error:
+                return 400, out_headers, {'error': [error]}
+            self._update(site_id, dict(data, id=record_id))
+            return 200, out_headers, None
+
+        if endpoint == 'records_update_multi':
+            data = json.loads(body.decode('utf-8'))
+            missing = [str(x.get('id')) for x in data if x.get('id') not in zone]
+            if missing:
+                return 404, out_headers, {'error': ['Records not found: ' + ', '.join(missing)]}
+            errors = [e for e in (self._update_error(site_id, x) for x in data) if e]
+            if errors:
+                return 400, out_headers, {'error': errors}
+            for x in data:
+                self._update(site_id, x)
+            return 200, out_headers, None
+
+        if endpoint == 'record_delete':
+            record_id = int(parts[2])
+            if record_id not in zone:
+                return 404, out_headers, {'error': ['Record not found']}
+            self._remove(site_id, record_id)
+            return 200, out_headers, None
+
+        return 404, out_headers, {'error': ['Not found']}
+
+
+def _endpoint(method, parts, query):
+    """Name of the api endpoint a request goes to."""
+
+    if not parts:
+        return 'domains'
+    if parts[1:2] != ['records']:
+        return 'other'
+    if len(parts) == 2:
+        if method == 'GET':
+            return 'records'
+        if method == 'POST':
+            return 'record_create'
+        if method == 'DELETE' and 'ids' in query:
+            return 'records_delete_multi'
+    elif parts[2] == 'createMulti' and method == 'POST':
+        return 'records_create_multi'
+    elif parts[2] == 'updateMulti' and method == 'PUT':
+        return 'records_update_multi'
+    elif len(parts) == 3 and method == 'DELETE':
+        return 'record_delete'
+    elif len(parts) == 3 and method == 'PUT':
+        return 'record_update'
+    return 'other'
+
+
+def serve(mock, host='127.0.0.1', port=0):
+    """
+    Serve a MockDnsMe over plain http on a background thread, for clients in other processes.
+
+    The api base url is 'http://<host>:<port>' + API_PATH, call shutdown() on the returned server
+    to stop it.
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+
+        def _answer(self):
+            length = int(self.headers.get('Content-Length') or 0)
+            body = self.rfile.read(length) if length else None
+
+            latency = mock.next_latency()
+            if latency:
+                time.sleep(latency)
+            status, headers, content = mock.handle(self.command, self.path, self.headers, body)
+
+            self.send_response(status)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header('Content-Length', str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        do_GET = do_POST = do_PUT = do_DELETE = _answer
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class MockDnsMeAdapter(BaseAdapter):
+    """requests transport adapter answering from a MockDnsMe after its simulated latency."""
+
+    def __init__(self, mock):
+        super(MockDnsMeAdapter, self).__init__()
+        self.mock = mock
+        self.closed = False
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+
+        mock = self.mock
+        with mock._lock:
+            mock.in_flight += 1
+            mock.max_in_flight = max(mock.max_in_flight, mock.in_flight)
+        try:
+            latency = mock.next_latency()
+            read_timeout = timeout[1] if isinstance(timeout, tuple) else timeout
+            if read_timeout is not None and latency > read_timeout:
+                time.sleep(read_timeout)
+                raise requests.exceptions.ReadTimeout('Mock read timed out', request=request)
+            time.sleep(latency)
+
+            body = request.body
+            if isinstance(body, str):
+                body = body.encode('utf-8')
+            status, headers, content = mock.handle(request.method, request.url, request.headers, body)
+        finally:
+            with mock._lock:
+                mock.in_flight -= 1
+
+        r = requests.Response()
+        r.status_code = status
+        r.headers.update(headers)
+        r._content = content
+        r.encoding = 'utf-8'
+        r.url = request.url
+        r.request = request
+        r.reason = 'OK' if status < 400 else 'Error'
+        return r
+
+    def close(self):
+        self.closed = True
@@ -0,0 +1,268 @@
+"""
+Check that a TXT record is served by the authoritative nameservers of its zone, over raw DNS
+"""
+
+from concurrent import futures
+import random
+import socket
+import struct
+import time
+
+TYPE_A = 1
+TYPE_NS = 2
+TYPE_TXT = 16
+CLASS_IN = 1
+
+# seconds one udp query waits for its answer
+DEFAULT_QUERY_TIMEOUT = 1.0
+# seconds between polls of the nameservers that do not serve the value yet
+DEFAULT_INTERVAL = 0.5
+# seconds to wait for propagation before giving up
+DEFAULT_TIMEOUT = 120.0
+
+
+class DnsQueryError(Exception):
+    pass
+
+
+class PropagationTimeout(Exception):
+    """The record was not served by every nameserver before the deadline."""
+
+    def __init__(self, message, pending=()):
+        super(PropagationTimeout, self).__init__(message)
+        self.pending = list(pending)
+
+
+def _encode_name(name):
+
+    out = b''
+    for label in name.rstrip('.').split('.'):
+        if label:
+            label = label.encode('idna') if not label.isascii() else label.encode('ascii')
+            out += struct.pack('!B', len(label)) + label
+    return out + b'\0'
+
+
+def build_query(name, qtype, query_id, recursion=False):
+    """Wire format of a query for name and qtype."""
+
+    flags = 0x0100 if recursion else 0
+    return struct.pack('!HHHHHH', query_id, flags, 1, 0, 0, 0) + _encode_name(name) + struct.pack('!HH', qtype,
+                                                                                                  CLASS_IN)
+
+
+def _read_name(data, offset):
+    """Read a possibly compressed name at offset, returning (name, offset after it)."""
+
+    labels = []
+    end = None
+    jumps = 0
+    while True:
+        if offset >= len(data):
+            raise DnsQueryError('Truncated name')
+        length = data[offset]
+        if length & 0xc0 == 0xc0:
+            if end is None:
+                end = offset + 2
+            offset = struct.unpack('!H', data[offset:offset + 2])[0] & 0x3fff
+            jumps += 1
+            if jumps > 64:
+                raise DnsQueryError('Name compression loop')
+            continue
+        offset += 1
+        if length == 0:
+            break
+        labels.append(data[offset:offset + length].decode('ascii', 'replace'))
+        offset += length
+    return '.'.join(labels), end if end is not None else offset
+
+
+def parse_response(data, query_id=None):
+    """
+    Parse a response.
+
+    :return: dict with id, rcode, truncated, authoritative and answers / additional as lists of
+        (name, type, value) with value the text of a TXT record, the host of an NS record, the
+        dotted address of an A record and the raw bytes otherwise
+    """
+
+    if len(data) < 12:
+        raise DnsQueryError('Short response')
+    response_id, flags, qdcount, ancount, nscount, arcount = struct.unpack('!HHHHHH', data[:12])
+    if query_id is not None and response_id != query_id:
+        raise DnsQueryError('Response id does not match the query')
+
+    offset = 12
+    for _ in range(qdcount):
+        _, offset = _read_name(data, offset)
+        offset += 4
+
+    sections = []
+    for count in (ancount, nscount, arcount):
+        records = []
+        for _ in range(count):
+            name, offset = _read_name(data, offset)
+            rtype, rclass, ttl, length = struct.unpack('!HHIH', data[offset:offset + 10])
+            offset += 10
+            rdata = data[offset:offset + length]
+            if rtype == TYPE_TXT:
+                strings = []
+                i = 0
+                while i < len(rdata):
+                    strings.append(rdata[i + 1:i + 1 + rdata[i]])
+                    i += 1 + rdata[i]
+                value = b''.join(strings).decode('utf-8', 'replace')
+            elif rtype == TYPE_NS:
+                value = _read_name(data, offset)[0]
+            elif rtype == TYPE_A and length == 4:
+                value = socket.inet_ntoa(rdata)
+            else:
+                value = rdata
+            records.append((name, rtype, value))
+            offset += length
+        sections.append(records)
+
+    return {'id': response_id, 'rcode': flags & 0xf, 'truncated': bool(flags & 0x0200),
+            'authoritative': bool(flags & 0x0400), 'answers': sections[0], 'additional': sections[2]}
+
+
+def _address(server):
+    """(host, port) of a nameserver given as 'ip', 'ip:port' or a tuple."""
+
+    if isinstance(server, (tuple, list)):
+        return server[0], int(server[1])
+    host, sep, port = server.rpartition(':')
+    if sep and host and '.' in host:
+        return host, int(port)
+    return server, 53
+
+
+def query(server, name, qtype, timeout=DEFAULT_QUERY_TIMEOUT, recursion=False):
+    """Send one query to server over udp, and over tcp if the answer was truncated."""
+
+    host, port = _address(server)
+    query_id = random.SystemRandom().randrange(0, 65536)
+    message = build_query(name, qtype, query_id, recursion=recursion)
+
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect((host, port))
+        sock.send(message)
+        deadline = time.monotonic() + timeout
+        while True:
+            data = sock.recv(4096)
+            try:
+                response = parse_response(data, query_id)
+                break
+            except DnsQueryError:
+                # a stray or forged datagram, keep waiting for the real answer
+                if time.monotonic() >= deadline:
+                    raise
+                sock.settimeout(max(0.001, deadline - time.monotonic()))
+
+    if response['truncated']:
+        with socket.create_connection((host, port), timeout=timeout) as sock:
+            sock.sendall(struct.pack('!H', len(message)) + message)
+            data = b''
+            while len(data) < 2 or len(data) < 2 + struct.unpack('!H', data[:2])[0]:
+                chunk = sock.recv(65536)
+                if not chunk:
+                    raise DnsQueryError('Connection closed during a tcp answer')
+                data += chunk
+            response = parse_response(data[2:2 + struct.unpack('!H', data[:2])[0]], query_id)
+    return response
+
+
+def system_resolvers(path='/etc/resolv.conf'):
+    """Nameserver addresses of the system resolver configuration."""
+
+    resolvers = []
+    try:
+        with open(path, 'r') as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) >= 2 and fields[0] == 'nameserver':
+                    resolvers.append(fields[1])
+    except OSError:
+        pass
+    return resolvers
+
+
+class PropagationChecker(object):
+    """
+    Polls the authoritative nameservers of a zone until they all serve a TXT value.
+
+    The nameservers are found with an NS query through a recursive resolver (the system one by
+    default) unless they are given, as 'ip', 'ip:port' or (ip, port), which also allows a local
+    stub server in tests.  Every poll queries the servers still missing the value in parallel.
+    """
+
+    def __init__(self, nameservers=None, resolvers=None, timeout=DEFAULT_TIMEOUT, interval=DEFAULT_INTERVAL,
+                 query_timeout=DEFAULT_QUERY_TIMEOUT):
+
+        self.nameservers = list(nameservers) if nameservers else None
+        self.resolvers = list(resolvers) if resolvers else None
+        self.timeout = timeout
+        self.interval = interval
+        self.query_timeout = query_timeout
+
+    def authoritative(self, zone):
+        """Addresses of the nameservers of zone, the configured ones if any."""
+
+        if self.nameservers:
+            return self.nameservers
+
+        resolvers = self.resolvers or system_resolvers()
+        if not resolvers:
+            raise DnsQueryError('No resolver to look up the nameservers of ' + zone)
+
+        response = query(resolvers[0], zone, TYPE_NS, timeout=self.query_timeout, recursion=True)
+        hosts = [value for name, rtype, value in response['answers'] if rtype == TYPE_NS]
+        if not hosts:
+            raise DnsQueryError('No NS records found for ' + zone)
+
+        glue = {}
+        for name, rtype, value in response['additional']:
+            if rtype == TYPE_A:
+                glue.setdefault(name.lower(), value)
+
+        addresses = []
+        for host in hosts:
+            address = glue.get(host.lower())
+            if address is None:
+                answer = query(resolvers[0], host, TYPE_A, timeout=self.query_timeout, recursion=True)
+                address = next((value for name, rtype, value in answer['answers'] if rtype == TYPE_A), None)
+            if address is not None:
+                addresses.append(address)
+        if not addresses:
+            raise DnsQueryError('Could not resolve the nameservers of ' + zone)
+        return addresses
+
+    def _serves(self, server, name, value):
+
+        try:
+            response = query(server, name, TYPE_TXT, timeout=self.query_timeout)
+        except (OSError, DnsQueryError):
+            return False
+        return any(rtype == TYPE_TXT and text == value for _, rtype, text in response['answers'])
+
+    def wait(self, name, value, zone):
+        """
+        Block until every authoritative nameserver of zone answers value for the TXT record name.
+
+        :return: seconds waited
+        :raises PropagationTimeout: with the servers still missing the value after timeout seconds
+        """
+
+        start = time.monotonic()
+        pending = list(self.authoritative(zone))
+        with futures.ThreadPoolExecutor(max_workers=len(pending)) as executor:
+            while True:
+                served = list(executor.map(lambda server: self._serves(server, name, value), pending))
+                pending = [server for server, ok in zip(pending, served) if not ok]
+                if not pending:
+                    return time.monotonic() - start
+                if time.monotonic() - start + self.interval > self.timeout:
+                    raise PropagationTimeout('{0} TXT not served after {1:.0f}s by {2}'.format(
+                        name, self.timeout, ', '.join(str(x) for x in pending)), pending)
+                time.sleep(self.interval)
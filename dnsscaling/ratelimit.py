@@ -0,0 +1,164 @@
+"""
+Client side pacing of requests against the DNS made easy request quota
+"""
+
+import random
+import threading
+import time
+
+# DNS made easy allows 150 requests in a rolling five minute window per api key
+DEFAULT_REQUEST_LIMIT = 150
+DEFAULT_WINDOW = 300
+# longest seconds a client backs off after consecutive quota rejections
+DEFAULT_MAX_BACKOFF = 60.0
+
+LIMIT_HEADER = 'x-dnsme-requestLimit'
+REMAINING_HEADER = 'x-dnsme-requestsRemaining'
+
+
+class QuotaExhausted(Exception):
+    pass
+
+
+class RequestScheduler(object):
+    """
+    Token bucket that paces requests to the api quota.
+
+    The bucket holds up to limit tokens and refills at limit / window tokens a second, the rate
+    the rolling window frees up slots.  Every response updates the bucket from the quota headers,
+    so the server count is authoritative, including requests made by other clients sharing the
+    api key.  acquire() blocks until a token is available, which queues work instead of letting it
+    fail once the quota runs out.  One scheduler can be shared by several clients.
+
+    Every quota rejection in a row empties the bucket for a jittered, exponentially growing time
+    (full jitter between one refill interval and up to max_backoff seconds), so many processes
+    sharing the api key spread their retries out instead of all retrying each refill interval.
+    """
+
+    def __init__(self, limit=DEFAULT_REQUEST_LIMIT, window=DEFAULT_WINDOW, max_wait=None,
+                 max_backoff=DEFAULT_MAX_BACKOFF):
+
+        self.limit = limit
+        self.window = window
+        # longest acquire() waits before raising QuotaExhausted, None waits as long as needed
+        self.max_wait = max_wait
+        self.max_backoff = max_backoff
+        self.remaining = None
+        # quota rejections since the last accepted request
+        self.rejections = 0
+        self._tokens = float(limit)
+        self._stamp = time.monotonic()
+        self._cond = threading.Condition()
+
+    @property
+    def rate(self):
+        return float(self.limit) / self.window
+
+    def _refill(self):
+
+        now = time.monotonic()
+        self._tokens = min(float(self.limit), self._tokens + (now - self._stamp) * self.rate)
+        self._stamp = now
+
+    def acquire(self, timeout=None):
+        """
+        Take one token, waiting for the bucket to refill if it is empty.
+
+        :param timeout: seconds to wait at most, defaults to max_wait
+        :return: seconds spent waiting
+        """
+
+        if timeout is None:
+            timeout = self.max_wait
+        elif self.max_wait is not None:
+            timeout = min(timeout, self.max_wait)
+
+        start = time.monotonic()
+        with self._cond:
+            while True:
+                self._refill()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return time.monotonic() - start
+
+                wait = (1 - self._tokens) / self.rate
+                if timeout is not None:
+                    left = timeout - (time.monotonic() - start)
+                    if left <= 0 or left < wait:
+                        raise QuotaExhausted('Request quota exhausted, next request possible in '
+                                             '{0:.1f}s'.format(wait))
+                self._cond.wait(wait)
+
+    def try_acquire(self):
+        """Take one token if one is available right now, without waiting."""
+
+        with self._cond:
+            self._refill()
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            return False
+
+    def update(self, headers):
+        """Synchronize the bucket with the quota headers of a response."""
+
+        limit = _int_header(headers, LIMIT_HEADER)
+        remaining = _int_header(headers, REMAINING_HEADER)
+
+        with self._cond:
+            if limit:
+                self.limit = limit
+            if remaining is not None:
+                self.remaining = remaining
+                self._refill()
+                self._tokens = min(float(self.limit), float(remaining))
+            self._cond.notify_all()
+
+    def exhausted(self):
+        """
+        Record that the server rejected a request for exceeding the quota.
+
+        :return: seconds until the next token, the backoff of this rejection
+        """
+
+        with self._cond:
+            self.remaining = 0
+            self._refill()
+            interval = 1.0 / self.rate
+            ceiling = max(interval, min(self.max_backoff, interval * 2 ** self.rejections))
+            backoff = random.uniform(interval, ceiling)
+            self.rejections += 1
+            # a negative balance makes acquire() wait out the backoff, for every client sharing it
+            self._tokens = min(self._tokens, 1 - backoff * self.rate)
+            return backoff
+
+    def accepted(self):
+        """Record a request the server did not reject for the quota, ending the backoff."""
+
+        with self._cond:
+            self.rejections = 0
+
+    def budget(self):
+        """Current view of the quota: limit, remaining reported by the api, tokens and wait seconds."""
+
+        with self._cond:
+            self._refill()
+            tokens = self._tokens
+            return {
+                'limit': self.limit,
+                'window': self.window,
+                'remaining': self.remaining,
+                'tokens': int(tokens),
+                'wait': 0.0 if tokens >= 1 else (1 - tokens) / self.rate,
+            }
+
+
+def _int_header(headers, name):
+
+    value = headers.get(name)
+    if value is None:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        return None
@@ -0,0 +1,148 @@
+"""
+Reconcile the A records of a zone against a desired set of (name, ip) records
+"""
+
+import json
+
+
+def read_desired(f, site=''):
+    """
+    Read the desired records from an open file.
+
+    Accepts either a json list of {"name": .., "value": ..} objects or [name, ip] pairs, or plain
+    text with one "name ip" pair per line ('#' starts a comment).  Names may be given relative to
+    the zone or fully qualified within site, '@' stands for the zone apex.
+
+    :param f:
+    :param site: zone the names belong to, used to strip fully qualified names
+    :return: set of (name, ip) tuples
+    """
+
+    text = f.read()
+    if text.lstrip().startswith('['):
+        pairs = []
+        for x in json.loads(text):
+            if isinstance(x, dict):
+                pairs.append((x['name'], x['value']))
+            else:
+                pairs.append((x[0], x[1]))
+    else:
+        pairs = []
+        for line in text.splitlines():
+            line = line.split('#', 1)[0].strip()
+            if not line:
+                continue
+            fields = line.split()
+            if len(fields) != 2:
+                raise ValueError('Expected "name ip", got: ' + line)
+            pairs.append((fields[0], fields[1]))
+
+    return {(_relative_name(name, site), ip) for name, ip in pairs}
+
+
+def _relative_name(name, site):
+
+    name = name.rstrip('.')
+    if name == '@' or (site and name == site):
+        return ''
+    if site and name.endswith('.' + site):
+        return name[:-len(site) - 1]
+    return name
+
+
+def plan(api, site, desired, prune=False):
+    """
+    Compute the minimal changes that make the A records of site match desired.
+
+    The zone is downloaded once.  Only names appearing in desired are managed unless prune is
+    set, in which case A records of every other name are deleted too.  Duplicate records of a
+    desired (name, ip) are deleted down to one.
+
+    :param api: DnsMeApi
+    :param site:
+    :param desired: set of (name, ip)
+    :param prune:
+    :return: dict with site, site_id, create (list of record data), delete (list of records) and
+        unchanged (count of records kept)
+    """
+
+    site_id = api.get_site_id(site)
+    if not site_id:
+        raise Exception("No site id found for", site)
+
+    names = {name for name, ip in desired}
+    seen = set()
+    delete = []
+    unchanged = 0
+    for record in api.get_records(site_id, type='A', refresh=True):
+        key = (record['name'], record['value'])
+        if key in desired and key not in seen:
+            seen.add(key)
+            unchanged += 1
+        elif key in desired or prune or record['name'] in names:
+            delete.append(record)
+
+    create = [{'name': name, 'type': 'A', 'value': ip} for name, ip in sorted(desired - seen)]
+
+    return {'site': site, 'site_id': site_id, 'create': create, 'delete': delete, 'unchanged': unchanged}
+
+
+def apply(api, changes):
+    """
+    Apply a plan with bulk creates, then bulk deletes.
+
+    Creating first means a name moved to new ips always has A records.  The records of a name
+    whose create failed are not deleted, so a failure cannot leave the name without any.
+
+    :return: dict with the per record create and delete results of DnsMeApi.add_records and
+        DnsMeApi.delete_records, a record kept for a failed create has an unsuccessful result
+    """
+
+    results = {'create': [], 'delete': []}
+    if changes['create']:
+        results['create'] = api.add_records(changes['site'], changes['create'])
+    failed = {x['name'] for x, result in zip(changes['create'], results['create']) if not result['success']}
+
+    delete = [x for x in changes['delete'] if x['name'] not in failed]
+    kept = [{'id': x['id'], 'success': False, 'error': 'kept, creating a record of the name failed'}
+            for x in changes['delete'] if x['name'] in failed]
+    if delete:
+        results['delete'] = api.delete_records(changes['site'], [x['id'] for x in delete])
+    results['delete'] += kept
+    return results
+
+
+def reconcile(api, site, desired, dry_run=False, prune=False):
+    """Plan and, unless dry_run, apply the changes; returns (plan, results or None)."""
+
+    changes = plan(api, site, desired, prune=prune)
+    if dry_run:
+        return changes, None
+    return changes, apply(api, changes)
+
+
+def format_plan(changes, results=None):
+    """Render a plan, and the results of applying it, as one line per change."""
+
+    lines = []
+    status = {}
+    if results is not None:
+        status = {str(x['id']): x for x in results['delete']}
+
+    for record in changes['delete']:
+        line = '- {0} A {1} (id {2})'.format(record['name'] or '@', record['value'], record['id'])
+        result = status.get(str(record['id']))
+        if result is not None and not result['success']:
+            line += ' FAILED: ' + result['error']
+        lines.append(line)
+
+    create_results = results['create'] if results is not None else [None] * len(changes['create'])
+    for record, result in zip(changes['create'], create_results):
+        line = '+ {0} A {1}'.format(record['name'] or '@', record['value'])
+        if result is not None and not result['success']:
+            line += ' FAILED: ' + result['error']
+        lines.append(line)
+
+    lines.append('{0}: {1} to create, {2} to delete, {3} unchanged'.format(
+        changes['site'], len(changes['create']), len(changes['delete']), changes['unchanged']))
+    return '\n'.join(lines)
@@ -0,0 +1,451 @@
+"""
+In memory views of the records held in a dns made easy zone
+"""
+
+from array import array
+import bisect
+import socket
+import struct
+import sys
+import time
+
+
+class RecordIndex(object):
+    """
+    Hash indexes over the records of one zone.
+
+    Records are the dicts returned by the api.  Lookups by id, by (type, name) and by (type, value)
+    are dictionary hits instead of scans over the zone.  The index is loaded from a full record
+    download and then kept current with add() and remove() as the client changes records, until
+    it is older than ttl seconds and considered stale.
+    """
+
+    def __init__(self, records=(), ttl=60):
+
+        self.ttl = ttl
+        self.fetched = 0.0
+        self._by_id = {}
+        self._by_name = {}
+        self._by_value = {}
+        if records:
+            self.load(records)
+
+    def __len__(self):
+        return len(self._by_id)
+
+    @property
+    def stale(self):
+        return time.time() - self.fetched > self.ttl
+
+    def load(self, records):
+        """Replace the contents of the index with records and mark it fresh."""
+
+        self._by_id = {}
+        self._by_name = {}
+        self._by_value = {}
+        for record in records:
+            self.add(record)
+        self.fetched = time.time()
+
+    def add(self, record):
+
+        record_id = str(record['id'])
+        if record_id in self._by_id:
+            self.remove(record_id)
+
+        self._by_id[record_id] = record
+        self._by_name.setdefault((record['type'], record['name']), {})[record_id] = record
+        self._by_value.setdefault((record['type'], record['value']), {})[record_id] = record
+
+    def remove(self, record_id):
+        """Remove a record by id, returning it or None if it was not indexed."""
+
+        record = self._by_id.pop(str(record_id), None)
+        if record is None:
+            return None
+
+        for index, key in ((self._by_name, (record['type'], record['name'])),
+                           (self._by_value, (record['type'], record['value']))):
+            bucket = index.get(key)
+            if bucket is not None:
+                bucket.pop(str(record_id), None)
+                if not bucket:
+                    del index[key]
+        return record
+
+    def get(self, record_id):
+        return self._by_id.get(str(record_id))
+
+    def records(self):
+        return list(self._by_id.values())
+
+    def find(self, type='', name='', value=''):
+        """Return the records matching every non empty argument."""
+
+        if type and name:
+            candidates = self._by_name.get((type, name), {}).values()
+        elif type and value:
+            candidates = self._by_value.get((type, value), {}).values()
+        else:
+            candidates = self._by_id.values()
+
+        ret_list = []
+        for x in candidates:
+            if type and not type == x['type']:
+                continue
+            if name and not name == x['name']:
+                continue
+            if value and not value == x['value']:
+                continue
+            ret_list.append(x)
+        return ret_list
+
+
+def pack_ipv4(value):
+    """Dotted quad value as an unsigned 32 bit int, None if it is not a plain IPv4 address."""
+
+    try:
+        packed = socket.inet_aton(value)
+    except (OSError, TypeError):
+        return None
+    # inet_aton also accepts shortened forms like '10.1', those are kept as strings
+    if socket.inet_ntoa(packed) != value:
+        return None
+    return struct.unpack('!I', packed)[0]
+
+
+def unpack_ipv4(number):
+    return socket.inet_ntoa(struct.pack('!I', number))
+
+
+# fields besides name, type, value, ttl and gtdLocation that the api needs to create a record of a type
+TYPE_FIELDS = {
+    'MX': ('mxLevel',),
+    'SRV': ('priority', 'weight', 'port'),
+    'CAA': ('issuerCritical', 'caaType'),
+    'HTTPRED': ('redirectType', 'title', 'keywords', 'description', 'hardLink'),
+}
+
+
+def type_fields(record):
+    """The type specific fields of an api record dict, None if its type has none or they are missing."""
+    return {k: record[k] for k in TYPE_FIELDS.get(record['type'], ()) if k in record} or None
+
+
+class Record(object):
+    """
+    One dns record with just the fields the api needs to create it again.
+
+    type, name and gtdLocation are interned, so the many records sharing them hold one string.
+    fields holds the type specific fields (see TYPE_FIELDS) such as the mxLevel of an MX record,
+    None for the types without any.
+    """
+
+    __slots__ = ('id', 'type', 'name', 'value', 'ttl', 'gtdLocation', 'fields')
+
+    def __init__(self, id, type, name, value, ttl=1800, gtdLocation='DEFAULT', fields=None):
+
+        self.id = int(id)
+        self.type = sys.intern(type)
+        self.name = sys.intern(name)
+        self.value = value
+        self.ttl = int(ttl)
+        self.gtdLocation = sys.intern(gtdLocation)
+        self.fields = fields or None
+
+    @classmethod
+    def from_json(cls, record):
+        """Record from a record dict of the api."""
+        return cls(record['id'], record['type'], record['name'], record['value'], record.get('ttl', 1800),
+                   record.get('gtdLocation', 'DEFAULT'), type_fields(record))
+
+    def to_json(self):
+        record = {'id': self.id, 'type': self.type, 'name': self.name, 'value': self.value, 'ttl': self.ttl,
+                  'gtdLocation': self.gtdLocation}
+        if self.fields:
+            record.update(self.fields)
+        return record
+
+    def __eq__(self, other):
+        if not isinstance(other, Record):
+            return NotImplemented
+        return all(getattr(self, x) == getattr(other, x) for x in self.__slots__)
+
+    def __repr__(self):
+        return 'Record(%d, %r, %r, %r, ttl=%d)' % (self.id, self.type, self.name, self.value, self.ttl)
+
+
+class StringTable(object):
+    """
+    Strings stored once each, NUL separated in one bytearray, and referenced by number.
+
+    Lookups go through an open addressing hash table of codes in an array, kept at most two
+    thirds full, instead of a dict holding every string as an object, about 8 bytes per string.
+    Strings are never removed.
+    """
+
+    def __init__(self):
+        self._buffer = bytearray(b'\0')
+        self._offsets = array('I')
+        self._slots = array('i', [-1]) * 8
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def _bytes(self, code):
+        start = self._offsets[code]
+        return bytes(self._buffer[start:self._buffer.index(0, start)])
+
+    def __getitem__(self, code):
+        return self._bytes(code).decode('utf-8')
+
+    def _slot(self, encoded):
+        """Slot of encoded in _slots, either holding its code or empty."""
+
+        mask = len(self._slots) - 1
+        slot = hash(encoded) & mask
+        while True:
+            code = self._slots[slot]
+            if code < 0 or self._bytes(code) == encoded:
+                return slot
+            slot = (slot + 1) & mask
+
+    def lookup(self, string):
+        """Code of string, None if it is not in the table."""
+
+        code = self._slots[self._slot(string.encode('utf-8'))]
+        return None if code < 0 else code
+
+    def code(self, string):
+        """Code of string, added to the table if missing."""
+
+        encoded = string.encode('utf-8')
+        slot = self._slot(encoded)
+        code = self._slots[slot]
+        if code >= 0:
+            return code
+        code = self._slots[slot] = len(self._offsets)
+        self._offsets.append(len(self._buffer))
+        self._buffer += encoded + b'\0'
+        if 3 * len(self._offsets) > 2 * len(self._slots):
+            self._slots = array('i', [-1]) * (2 * len(self._slots))
+            for x in range(len(self._offsets)):
+                self._slots[self._slot(self._bytes(x))] = x
+        return code
+
+
+class _Index(object):
+    """Record ids by an integer key, in two arrays sorted by key and id, 16 bytes per record."""
+
+    def __init__(self):
+        self._keys = array('q')
+        self._ids = array('q')
+
+    def _position(self, key, record_id):
+        lo = bisect.bisect_left(self._keys, key)
+        hi = bisect.bisect_right(self._keys, key, lo)
+        return bisect.bisect_left(self._ids, record_id, lo, hi)
+
+    def add(self, key, record_id):
+        position = self._position(key, record_id)
+        self._keys.insert(position, key)
+        self._ids.insert(position, record_id)
+
+    def remove(self, key, record_id):
+        position = self._position(key, record_id)
+        del self._keys[position]
+        del self._ids[position]
+
+    def ids(self, key):
+        lo = bisect.bisect_left(self._keys, key)
+        return self._ids[lo:bisect.bisect_right(self._keys, key, lo)]
+
+
+class Zone(object):
+    """
+    The records of a zone stored by column in typed arrays, sorted by id.
+
+    Names and values that are not IPv4 addresses are kept once in a StringTable and referenced by
+    number, A record addresses are packed into 32 bits, and the few record types and gtd locations
+    share a symbol table.  The type specific fields of the few MX, SRV, CAA and HTTPRED records are
+    kept in a dict by id.  This takes an order of magnitude less memory than the api's record
+    dicts.  Lookups by id are a binary search, lookups by name or value a binary search of an
+    index from the name or value number to the record ids.  Records are returned as Record objects created on access.
+    """
+
+    # value kinds
+    STRING = 0
+    IPV4 = 1
+
+    def __init__(self, records=()):
+
+        self._ids = array('q')
+        self._types = array('H')
+        self._locations = array('H')
+        self._names = array('I')
+        self._values = array('I')
+        self._kinds = array('B')
+        self._ttls = array('i')
+        # record id -> type specific fields, only for records having any
+        self._fields = {}
+        # record ids by name code and by _value_key
+        self._by_name = _Index()
+        self._by_value = _Index()
+
+        self._symbols = []
+        self._symbol_codes = {}
+        self._strings = StringTable()
+
+        # records arriving in id order are appended as they come, so a stream of api pages is never
+        # held in full, the others are sorted and inserted afterwards
+        unordered = []
+        for record in records:
+            if isinstance(record, Record):
+                record = record.to_json()
+            if not self._ids or int(record['id']) > self._ids[-1]:
+                self._insert(len(self._ids), record)
+            else:
+                unordered.append(record)
+        for record in sorted(unordered, key=lambda x: int(x['id'])):
+            self.remove(record['id'])
+            self._insert(bisect.bisect_left(self._ids, int(record['id'])), record)
+
+    @classmethod
+    def from_json(cls, records):
+        return cls(records)
+
+    def to_json(self):
+        """List of record dicts in the api format."""
+        return [x.to_json() for x in self]
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __iter__(self):
+        for row in range(len(self._ids)):
+            yield self._record(row)
+
+    def __contains__(self, record_id):
+        return self._row(record_id) is not None
+
+    def _symbol(self, string):
+        code = self._symbol_codes.get(string)
+        if code is None:
+            code = self._symbol_codes[string] = len(self._symbols)
+            self._symbols.append(string)
+        return code
+
+    @staticmethod
+    def _value_key(value, kind):
+        """Key of a value in _by_value, string codes are negative so they never equal an address."""
+        return value if kind == Zone.IPV4 else -1 - value
+
+    def _insert(self, row, record):
+        """Insert an api record dict at row."""
+
+        ip = pack_ipv4(record['value']) if record['type'] == 'A' else None
+        if ip is None:
+            value, kind = self._strings.code(record['value']), self.STRING
+        else:
+            value, kind = ip, self.IPV4
+        record_id = int(record['id'])
+        name = self._strings.code(record['name'])
+
+        self._ids.insert(row, record_id)
+        self._types.insert(row, self._symbol(record['type']))
+        self._locations.insert(row, self._symbol(record.get('gtdLocation', 'DEFAULT')))
+        self._names.insert(row, name)
+        self._values.insert(row, value)
+        self._kinds.insert(row, kind)
+        self._ttls.insert(row, int(record.get('ttl', 1800)))
+        self._by_name.add(name, record_id)
+        self._by_value.add(self._value_key(value, kind), record_id)
+        fields = type_fields(record)
+        if fields:
+            self._fields[record_id] = fields
+
+    def _row(self, record_id):
+
+        record_id = int(record_id)
+        row = bisect.bisect_left(self._ids, record_id)
+        if row < len(self._ids) and self._ids[row] == record_id:
+            return row
+        return None
+
+    def _record(self, row):
+
+        if self._kinds[row] == self.IPV4:
+            value = unpack_ipv4(self._values[row])
+        else:
+            value = self._strings[self._values[row]]
+        return Record(self._ids[row], self._symbols[self._types[row]], self._strings[self._names[row]], value,
+                      self._ttls[row], self._symbols[self._locations[row]], self._fields.get(self._ids[row]))
+
+    def add(self, record):
+        """Add a Record or api record dict, replacing a record with the same id."""
+
+        if isinstance(record, Record):
+            record = record.to_json()
+        self.remove(record['id'])
+        self._insert(bisect.bisect_left(self._ids, int(record['id'])), record)
+
+    def remove(self, record_id):
+        """Remove a record by id, returning it or None if it is not in the zone."""
+
+        row = self._row(record_id)
+        if row is None:
+            return None
+        record = self._record(row)
+        self._by_name.remove(self._names[row], record.id)
+        self._by_value.remove(self._value_key(self._values[row], self._kinds[row]), record.id)
+        for column in (self._ids, self._types, self._locations, self._names, self._values, self._kinds,
+                       self._ttls):
+            del column[row]
+        self._fields.pop(record.id, None)
+        return record
+
+    def get(self, record_id):
+        row = self._row(record_id)
+        return None if row is None else self._record(row)
+
+    def _rows(self, ids):
+        """Rows of the record ids, in id order."""
+        return [self._row(x) for x in sorted(ids)]
+
+    def find(self, type='', name='', value=''):
+        """Return the records matching every non empty argument."""
+
+        type_code = self._symbol_codes.get(type) if type else None
+        if type and type_code is None:
+            return []
+
+        if name:
+            code = self._strings.lookup(name)
+            if code is None:
+                return []
+            rows = self._rows(self._by_name.ids(code))
+        elif value:
+            ip = pack_ipv4(value)
+            code = self._strings.lookup(value)
+            if ip is None and code is None:
+                return []
+            ids = list(self._by_value.ids(ip)) if ip is not None else []
+            if code is not None:
+                ids.extend(self._by_value.ids(self._value_key(code, self.STRING)))
+            rows = self._rows(ids)
+        elif type:
+            rows = (row for row in range(len(self._ids)) if self._types[row] == type_code)
+        else:
+            rows = range(len(self._ids))
+
+        ret_list = []
+        for row in rows:
+            if type and self._types[row] != type_code:
+                continue
+            record = self._record(row)
+            if name and not name == record.name:
+                continue
+            if value and not value == record.value:
+                continue
+            ret_list.append(record)
+        return ret_list
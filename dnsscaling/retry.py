@@ -0,0 +1,109 @@
+"""
+Error classification and retry policy for DNS made easy api requests
+"""
+
+from email.utils import parsedate_to_datetime
+import random
+import threading
+import time
+
+# statuses worth retrying, the request did not take effect and may succeed later
+RETRYABLE_STATUS = (408, 429, 500, 502, 503, 504)
+# statuses that guarantee the server did not act on the request, safe to retry for a POST
+UNPROCESSED_STATUS = (429, 503)
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS')
+
+
+class DnsMeError(Exception):
+    """An api request that failed, with its status code if a response was received."""
+
+    def __init__(self, message, status_code=None, retryable=False, response=None):
+        super(DnsMeError, self).__init__(message)
+        self.status_code = status_code
+        self.retryable = retryable
+        self.response = response
+
+
+class DeadlineExceeded(DnsMeError):
+    """The deadline of an operation passed before it could complete."""
+
+
+class RetryPolicy(object):
+    """
+    Exponential backoff with full jitter, bounded by a retry budget.
+
+    Attempt n waits a random time between 0 and min(max_delay, base_delay * 2 ** n), or the
+    server's Retry-After when that is longer.  The budget is a bucket of at most budget_max retries
+    that gains budget_ratio of a retry for every request and loses one per retry, so during an
+    outage retries add at most budget_ratio extra load instead of multiplying it.
+    """
+
+    def __init__(self, max_attempts=4, base_delay=0.25, max_delay=8.0, budget_ratio=0.2, budget_max=10):
+
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.budget_ratio = budget_ratio
+        self.budget_max = budget_max
+        self._budget = float(budget_max)
+        self._lock = threading.Lock()
+
+    def retryable_status(self, method, status_code):
+        if method.upper() in IDEMPOTENT_METHODS:
+            return status_code in RETRYABLE_STATUS
+        return status_code in UNPROCESSED_STATUS
+
+    def retryable_exception(self, method, exc):
+        """Connection failures are retryable, for non idempotent methods only if nothing was sent."""
+        import requests
+
+        if method.upper() in IDEMPOTENT_METHODS:
+            return isinstance(exc, (requests.exceptions.ConnectionError, requests.exceptions.Timeout))
+        return isinstance(exc, requests.exceptions.ConnectTimeout)
+
+    def record_request(self):
+        with self._lock:
+            self._budget = min(float(self.budget_max), self._budget + self.budget_ratio)
+
+    def allow_retry(self, attempt):
+        """True if attempt (0 based) may be followed by another one, taking a retry from the budget."""
+
+        if attempt + 1 >= self.max_attempts:
+            return False
+        return self.spend()
+
+    def spend(self):
+        """Take one retry from the budget if it has one, for retries without an attempt limit."""
+
+        with self._lock:
+            if self._budget < 1:
+                return False
+            self._budget -= 1
+        return True
+
+    def backoff(self, attempt):
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def delay(self, attempt, response=None):
+        """Seconds to wait before retrying after attempt, honoring Retry-After."""
+
+        delay = self.backoff(attempt)
+        if response is not None:
+            delay = max(delay, retry_after(response))
+        return delay
+
+
+def retry_after(response):
+    """Seconds requested by a Retry-After header, 0 if there is none."""
+
+    value = response.headers.get('Retry-After')
+    if not value:
+        return 0.0
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return 0.0
@@ -0,0 +1,247 @@
+"""
+Zone snapshots: export to a JSON lines file, load, diff and restore
+"""
+
+import json
+import mmap
+import os
+import tempfile
+import time
+
+from dnsscaling.records import Record, Zone, type_fields
+
+# version of the snapshot file layout
+SNAPSHOT_FORMAT = 1
+
+
+class Snapshot(object):
+    """
+    The records of one zone at one point in time.
+
+    On disk a snapshot is a JSON lines file whose first line is a header object
+
+        {"format": 1, "site": "simpa.io", "site_id": "7", "created": 1700000000.0}
+
+    followed by one compact [id, type, name, value, ttl, gtdLocation] list per record, with a dict of
+    the type specific fields (the mxLevel of MX records, ...) appended for the types having them, so
+    it can be written while the zone pages arrive and read back without holding the text in memory.
+    """
+
+    def __init__(self, site, site_id, zone, created=None):
+
+        self.site = site
+        self.site_id = str(site_id)
+        self.zone = zone
+        self.created = created if created is not None else time.time()
+
+    def __len__(self):
+        return len(self.zone)
+
+    @property
+    def header(self):
+        return {'format': SNAPSHOT_FORMAT, 'site': self.site, 'site_id': self.site_id, 'created': self.created}
+
+    def save(self, path):
+        return write_snapshot(path, self.header, iter(self.zone))
+
+
+def _line(record):
+
+    if isinstance(record, Record):
+        fields = [record.id, record.type, record.name, record.value, record.ttl, record.gtdLocation]
+        extra = record.fields
+    else:
+        fields = [record['id'], record['type'], record['name'], record['value'], record.get('ttl', 1800),
+                  record.get('gtdLocation', 'DEFAULT')]
+        extra = type_fields(record)
+    if extra:
+        fields.append(extra)
+    return json.dumps(fields, separators=(',', ':')) + '\n'
+
+
+def write_snapshot(path, header, records):
+    """
+    Write a header dict and an iterable of Records or api record dicts to path, replacing it atomically.
+
+    :return: number of records written
+    """
+
+    count = 0
+    dirname = os.path.dirname(os.path.abspath(path))
+    fd, tmp = tempfile.mkstemp(dir=dirname, prefix='.snapshot')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(json.dumps(header, sort_keys=True) + '\n')
+            for record in records:
+                f.write(_line(record))
+                count += 1
+        os.replace(tmp, path)
+    except BaseException:
+        os.remove(tmp)
+        raise
+    return count
+
+
+def export_zone(api, site, path, page_size=None):
+    """
+    Stream the records of site into a snapshot file at path.
+
+    :param api: DnsMeApi
+    :return: number of records written
+    """
+
+    site_id = api.get_site_id(site)
+    if not site_id:
+        raise Exception("No site id found for", site)
+
+    kwargs = {'page_size': page_size} if page_size else {}
+    header = {'format': SNAPSHOT_FORMAT, 'site': site, 'site_id': str(site_id), 'created': time.time()}
+    return write_snapshot(path, header, api.iter_records(site_id, **kwargs))
+
+
+def _records(mapped):
+
+    while True:
+        line = mapped.readline()
+        if not line:
+            return
+        if line.strip():
+            x = json.loads(line)
+            record = {'id': x[0], 'type': x[1], 'name': x[2], 'value': x[3], 'ttl': x[4], 'gtdLocation': x[5]}
+            if len(x) > 6:
+                record.update(x[6])
+            yield record
+
+
+def load_snapshot(path):
+    """Read a snapshot file through a memory map into a Snapshot holding a compact Zone."""
+
+    with open(path, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            header = json.loads(mapped.readline())
+            if header.get('format') != SNAPSHOT_FORMAT:
+                raise ValueError('Unsupported snapshot format: ' + str(header.get('format')))
+            zone = Zone(_records(mapped))
+
+    return Snapshot(header['site'], header['site_id'], zone, created=header['created'])
+
+
+def live_snapshot(api, site):
+    """Snapshot of the current records of site."""
+
+    site_id = api.get_site_id(site)
+    if not site_id:
+        raise Exception("No site id found for", site)
+    return Snapshot(site, site_id, api.get_zone(site_id))
+
+
+def diff(old, new):
+    """
+    Compare two snapshots (or Zones) by record content, ignoring record ids.
+
+    Records are matched on (type, name, value); a matched record whose ttl, gtdLocation or type
+    specific fields differ is changed.  Duplicates are matched one to one.
+
+    :return: dict with lists of Records added (only in new), removed (only in old) and changed
+        ((old, new) pairs), and the count of unchanged records
+    """
+
+    old_zone = old.zone if isinstance(old, Snapshot) else old
+    new_zone = new.zone if isinstance(new, Snapshot) else new
+
+    remaining = {}
+    for record in old_zone:
+        remaining.setdefault((record.type, record.name, record.value), []).append(record)
+
+    added = []
+    changed = []
+    unchanged = 0
+    for record in new_zone:
+        matches = remaining.get((record.type, record.name, record.value))
+        if not matches:
+            added.append(record)
+            continue
+        previous = matches.pop(0)
+        if _changed_fields(previous, record):
+            changed.append((previous, record))
+        else:
+            unchanged += 1
+
+    removed = [x for records in remaining.values() for x in records]
+    removed.sort(key=lambda x: x.id)
+    return {'added': added, 'removed': removed, 'changed': changed, 'unchanged': unchanged}
+
+
+def _changed_fields(old, new):
+    """List of (field, old value, new value) of the fields besides type, name and value that differ."""
+
+    changed = [(x, getattr(old, x), getattr(new, x)) for x in ('ttl', 'gtdLocation')
+               if getattr(old, x) != getattr(new, x)]
+    old_fields, new_fields = old.fields or {}, new.fields or {}
+    changed.extend((x, old_fields.get(x), new_fields.get(x)) for x in sorted(set(old_fields) | set(new_fields))
+                   if old_fields.get(x) != new_fields.get(x))
+    return changed
+
+
+def restore(api, snapshot, prune=False, dry_run=False):
+    """
+    Make the live zone hold the records of snapshot again.
+
+    Records missing from the zone are created in bulk first, changed records are updated in place
+    and only then, with prune, records that are not in the snapshot are deleted in bulk, except
+    those of a type and name whose create failed, so a failed restore never leaves a name without
+    records.
+
+    :param api: DnsMeApi
+    :param snapshot:
+    :param prune: delete the records that are not in the snapshot
+    :param dry_run: only compute the changes
+    :return: (changes, results or None) with changes the diff from the live zone to the snapshot
+        and results the per record results of the creates, updates and deletes
+    """
+
+    live = live_snapshot(api, snapshot.site)
+    changes = diff(live, snapshot)
+    if dry_run:
+        return changes, None
+
+    results = {'create': [], 'update': [], 'delete': []}
+    if changes['added']:
+        results['create'] = api.add_records(snapshot.site, [x.to_json() for x in changes['added']])
+    if changes['changed']:
+        results['update'] = api.update_records(snapshot.site, [(old.to_json(), new.to_json())
+                                                               for old, new in changes['changed']])
+
+    if prune and changes['removed']:
+        failed = {(x.type, x.name) for x, result in zip(changes['added'], results['create'])
+                  if not result['success']}
+        delete = [x.id for x in changes['removed'] if (x.type, x.name) not in failed]
+        if delete:
+            results['delete'] = api.delete_records(snapshot.site, delete)
+        results['delete'].extend({'id': str(x.id), 'success': False,
+                                  'error': 'kept, creating a record of the name failed'}
+                                 for x in changes['removed'] if (x.type, x.name) in failed)
+    return changes, results
+
+
+def format_diff(changes, prune=True):
+    """
+    Render a diff as one line per record.
+
+    :param prune: False if the removed records are kept, as by a restore without prune, they are
+        marked with = and counted as kept instead of removed
+    """
+
+    lines = []
+    for record in changes['removed']:
+        lines.append('{0} {1} {2} {3} (id {4}{5})'.format('-' if prune else '=', record.name or '@', record.type,
+                                                          record.value, record.id, '' if prune else ', kept'))
+    for record in changes['added']:
+        lines.append('+ {0} {1} {2}'.format(record.name or '@', record.type, record.value))
+    for old, new in changes['changed']:
+        lines.append('~ {0} {1} {2} {3}'.format(new.name or '@', new.type, new.value, ', '.join(
+            '{0} {1} -> {2}'.format(*x) for x in _changed_fields(old, new))))
+    lines.append('{0} added, {1} {2}, {3} changed, {4} unchanged'.format(
+        len(changes['added']), len(changes['removed']), 'removed' if prune else 'kept (not pruned)',
+        len(changes['changed']), changes['unchanged']))
+    return '\n'.join(lines)
@@ -9,17 +9,37 @@ import subprocess
 import sys
 import time
 
+from dnsscaling.certificates import (DEFAULT_INVENTORY_CACHE, DEFAULT_JITTER, DEFAULT_RENEW_BEFORE,
+                                     CertificateInventory, covers, due, renewal_time)
+from dnsscaling.keys import KEY_TYPES, certbot_key_args
+from dnsscaling.stats import Instrumentation, StatsCollector
+
 
 class SslCredentials(object):
 
     def __init__(self, url, email, efs_path='', lets_encrypt_path='', test_mode=False, debug_mode=False,
-                 run_certbot=True):
+                 run_certbot=True, instrumentation=None, key_type='', force_renew=False,
+                 renew_before=DEFAULT_RENEW_BEFORE, jitter=DEFAULT_JITTER, inventory=None):
+
+        # spans of the efs compare, copy and certbot phases are emitted to the instrumentation hooks
+        self.instrumentation = instrumentation if instrumentation is not None else Instrumentation()
+        # (name, start, process) of commands started, see wait_commands
+        self._processes = []
 
         self._debug = debug_mode
         self._run_certbot = run_certbot
         self.url = url
         self.email = email
         self.test_mode = test_mode
+        # certificate key type of new certificates, see dnsscaling.keys.KEY_TYPES, '' for certbot's default
+        self.key_type = key_type
+        # certbot renew only runs once the live certificate is due, see dnsscaling.certificates.due
+        self.force_renew = force_renew
+        self.renew_before = renew_before
+        self.jitter = jitter
+        if inventory is None:
+            inventory = CertificateInventory(paths=[], cache_path='' if test_mode else DEFAULT_INVENTORY_CACHE)
+        self.inventory = inventory
 
         # hardcoded defaults
         if not efs_path:
@@ -54,21 +74,22 @@ class SslCredentials(object):
                 self._write('path live')
 
                 # check if all files are the same
-                same = True
-                for i, pem in enumerate(self.pem_files):
+                with self.instrumentation.span('efs_compare'):
+                    same = True
+                    for i, pem in enumerate(self.pem_files):
 
-                    src = os.path.join(self.efs_cert_path, pem)
-                    live = os.path.join(self.live_cert_path, pem)
+                        src = os.path.join(self.efs_cert_path, pem)
+                        live = os.path.join(self.live_cert_path, pem)
 
-                    if not os.path.exists(src) or not os.path.exists(live):
-                        same = False
-                        break
+                        if not os.path.exists(src) or not os.path.exists(live):
+                            same = False
+                            break
 
-                    with open(src, 'rb') as f1:
-                        with open(live, 'rb') as f2:
-                            if f1.read() != f2.read():
-                                same = False
-                                break
+                        with open(src, 'rb') as f1:
+                            with open(live, 'rb') as f2:
+                                if f1.read() != f2.read():
+                                    same = False
+                                    break
 
                 self._write('pathlive same: {0}'.format(same))
 
@@ -107,11 +128,55 @@ class SslCredentials(object):
 
                 self.init_cert()
 
-        cmd = "/certbot-auto renew --standalone -n --agree-tos --debug --pre-hook {1} --post-hook {2}" \
-              "".format(self.url, self._stop_haproxy_str(), self._cat_copy_str())
+        cmd = self.renew_command()
+        if cmd is None:
+            return
+
         self._write(cmd)
         if self._run_certbot:
-            self._execute_cmd(cmd)
+            self._execute_cmd(cmd, span='certbot_renew')
+
+    def renewal_due(self):
+        """
+        True unless the live certificate covers the url and is not due for renewal yet.
+
+        A missing or unreadable certificate is due, so certbot decides as before.
+        """
+        return self._renew_options() is not None
+
+    def renew_command(self):
+        """The certbot renew command line, None if the live certificate is not due for renewal."""
+
+        options = self._renew_options()
+        if options is None:
+            return None
+        return "/certbot-auto renew --standalone -n --agree-tos --debug --pre-hook {0} --post-hook {1}{2}" \
+               "".format(self._stop_haproxy_str(), self._cat_copy_str(), options)
+
+    def _renew_options(self):
+        """
+        Extra certbot renew options, None if the renewal is skipped.
+
+        certbot itself only renews within 30 days of the expiry, the jitter spreads the renewals of
+        the fleet over the days before that, so a certificate due by our schedule is renewed with
+        --force-renewal.
+        """
+
+        with self.instrumentation.span('inventory'):
+            meta = self.inventory.certificate(os.path.join(self.live_cert_path, 'cert.pem'))
+            self.inventory.save()
+        if meta is None or not covers(meta, [self.url]):
+            return ''
+        if due(meta, renew_before=self.renew_before, jitter=self.jitter):
+            return ' --force-renewal'
+        if self.force_renew:
+            return ''
+
+        self._write('cert valid until {0}, renewal skipped until {1}'.format(
+            time.strftime('%Y-%m-%d', time.gmtime(meta['not_after'])),
+            time.strftime('%Y-%m-%d %H:%M', time.gmtime(renewal_time(meta, renew_before=self.renew_before,
+                                                                      jitter=self.jitter)))))
+        return None
 
     def _write(self, txt):
 
@@ -128,11 +193,12 @@ class SslCredentials(object):
         for i in range(tries):
 
             # need to run initial creation and copy of certification
-            cmd = "/certbot-auto certonly --standalone --agree-tos -d {0} -m {1} -n --debug && {2}" \
-                  "".format(self.url, self.email, self._cat_copy_str(parenth=False))
+            cmd = "/certbot-auto certonly --standalone --agree-tos -d {0} -m {1} -n --debug {3}&& {2}" \
+                  "".format(self.url, self.email, self._cat_copy_str(parenth=False),
+                            certbot_key_args(self.key_type) + ' ' if self.key_type else '')
             self._write(cmd)
             if self._run_certbot:
-                self._execute_cmd(cmd)
+                self._execute_cmd(cmd, span='certbot_certonly')
             else:
                 break
 
@@ -144,6 +210,11 @@ class SslCredentials(object):
 
     def copy_link_efs(self):
 
+        with self.instrumentation.span('copy'):
+            self._copy_link_efs()
+
+    def _copy_link_efs(self):
+
         self._write("copy_link")
 
         # copy and symlink all files in live directory
@@ -165,11 +236,27 @@ class SslCredentials(object):
         # stop haproxy
         self._execute_cmd(self._stop_haproxy_str(parenth=False))
 
-    def _execute_cmd(self, cmd):
+    def _execute_cmd(self, cmd, span='command'):
 
         self._write("Execute: {0}".format(cmd))
         if not self.test_mode:
             result = subprocess.Popen(cmd, shell=True)
+            self._processes.append((span, time.time(), result))
+
+    def wait_commands(self):
+        """
+        Wait for the commands started in the background and emit a span with the run time of each.
+
+        Commands are not waited for otherwise, call this to include certbot's run time in a timing
+        report.
+        """
+
+        for name, start, process in self._processes:
+            process.wait()
+            self.instrumentation.emit({'event': 'span', 'name': name, 'start': start,
+                                       'duration': time.time() - start, 'parent': '',
+                                       'error': '' if process.returncode == 0 else 'exit ' + str(process.returncode)})
+        self._processes = []
 
     def _stop_haproxy_str(self, parenth=True):
 
@@ -216,6 +303,14 @@ def run_sslcredentials():
                         help="[flag] debug flag")
     parser.add_argument('--nocert', action='store_false', default=True,
                         help="[flag] Turn off running certbot-auto")
+    parser.add_argument('--key_type', type=str, default='', choices=[''] + sorted(KEY_TYPES),
+                        help="Key type of a new certificate, ec256 and ec384 for ECDSA, certbot's default if "
+                             "not given. Renewals keep the key type of the certificate")
+    parser.add_argument('--force_renew', action='store_true', default=False,
+                        help="[flag] Run certbot renew even if the live certificate is not due for renewal")
+    parser.add_argument('--stats', type=str, nargs='?', const='-', default='',
+                        help="Write a json timing breakdown to the file, or stdout without a file. Waits for "
+                             "certbot to finish so its run time is included")
 
     args = parser.parse_args()
 
@@ -223,4 +318,19 @@ def run_sslcredentials():
         parser.print_help()
         sys.exit()
 
-    ssl = SslCredentials(args.url, args.email, debug_mode=args.debug, run_certbot=args.nocert)
+    instrumentation = Instrumentation()
+    collector = None
+    if args.stats:
+        collector = StatsCollector()
+        instrumentation.add_hook(collector)
+
+    try:
+        with instrumentation.span('sslcredentials'):
+            ssl = SslCredentials(args.url, args.email, debug_mode=args.debug, run_certbot=args.nocert,
+                                 instrumentation=instrumentation, key_type=args.key_type,
+                                 force_renew=args.force_renew)
+        if collector is not None:
+            ssl.wait_commands()
+    finally:
+        if collector is not None:
+            collector.write(args.stats)
@@ -0,0 +1,165 @@
+"""
+Instrumentation hooks, operation spans and timing reports
+"""
+
+import contextlib
+import functools
+import json
+import sys
+import threading
+import time
+from urllib.parse import urlsplit
+
+
+class Instrumentation(object):
+    """
+    Event surface shared by DnsMeApi and SslCredentials.
+
+    Hooks are callables taking one event dict.  Every http request emits
+
+        {'event': 'request', 'method', 'endpoint', 'status', 'bytes', 'latency', 'retries', 'span',
+         'error'}
+
+    and every span (a high level operation or a phase) emits when it ends
+
+        {'event': 'span', 'name', 'start', 'duration', 'parent', 'error'}
+
+    with start in seconds since the epoch.  Hooks must be cheap and must not raise, they run on the
+    thread making the request.
+    """
+
+    def __init__(self, hooks=()):
+        self.hooks = list(hooks)
+        self._local = threading.local()
+
+    def add_hook(self, hook):
+        self.hooks.append(hook)
+
+    def remove_hook(self, hook):
+        self.hooks.remove(hook)
+
+    def emit(self, event):
+        for hook in self.hooks:
+            hook(event)
+
+    def current_span(self):
+        stack = getattr(self._local, 'stack', None)
+        return stack[-1] if stack else ''
+
+    @contextlib.contextmanager
+    def span(self, name):
+        """Time the block as span name, nested inside the span currently open on this thread."""
+
+        if not self.hooks:
+            yield
+            return
+
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        parent = stack[-1] if stack else ''
+        stack.append(name)
+
+        start = time.time()
+        t0 = time.perf_counter()
+        error = ''
+        try:
+            yield
+        except BaseException as e:
+            error = type(e).__name__
+            raise
+        finally:
+            stack.pop()
+            self.emit({'event': 'span', 'name': name, 'start': start, 'duration': time.perf_counter() - t0,
+                       'parent': parent, 'error': error})
+
+
+def traced(fn):
+    """Run a method of an object with an instrumentation attribute inside a span of its name."""
+
+    @functools.wraps(fn)
+    def wrapper(self, *args, **kwargs):
+        with self.instrumentation.span(fn.__name__):
+            return fn(self, *args, **kwargs)
+
+    return wrapper
+
+
+def endpoint_class(method, url):
+    """Group a DNS made easy api url into the endpoint it calls, without ids."""
+
+    parts = [p for p in urlsplit(url).path.split('/') if p]
+    try:
+        parts = parts[parts.index('managed') + 1:]
+    except ValueError:
+        return 'other'
+
+    if not parts:
+        return 'domains'
+    if parts[1:2] != ['records']:
+        return 'domain'
+    if len(parts) == 2:
+        return 'records'
+    if parts[2] in ('createMulti', 'updateMulti'):
+        return 'records/' + parts[2]
+    return 'record'
+
+
+class StatsCollector(object):
+    """Hook that collects events and summarizes them in a json timing report."""
+
+    def __init__(self):
+        self.events = []
+        self.started = time.time()
+        self._lock = threading.Lock()
+
+    def __call__(self, event):
+        with self._lock:
+            self.events.append(event)
+
+    def report(self):
+
+        with self._lock:
+            events = list(self.events)
+
+        requests = [x for x in events if x['event'] == 'request']
+        endpoints = {}
+        for x in requests:
+            key = x['method'] + ' ' + x['endpoint']
+            summary = endpoints.setdefault(key, {'count': 0, 'bytes': 0, 'latency': 0.0, 'retries': 0, 'errors': 0})
+            summary['count'] += 1
+            summary['bytes'] += x['bytes']
+            summary['latency'] += x['latency']
+            summary['retries'] += 1 if x['retries'] else 0
+            summary['errors'] += 1 if x['error'] else 0
+
+        spans = {}
+        for x in events:
+            if x['event'] != 'span':
+                continue
+            summary = spans.setdefault(x['name'], {'count': 0, 'duration': 0.0, 'errors': 0})
+            summary['count'] += 1
+            summary['duration'] += x['duration']
+            summary['errors'] += 1 if x['error'] else 0
+
+        return {
+            'total_seconds': time.time() - self.started,
+            'requests': {
+                'count': len(requests),
+                'bytes': sum(x['bytes'] for x in requests),
+                'latency': sum(x['latency'] for x in requests),
+                'endpoints': endpoints,
+            },
+            'spans': spans,
+            'events': events,
+        }
+
+    def write(self, path):
+        """Write the report as json to path, '-' for stdout."""
+
+        content = json.dumps(self.report(), indent=2, sort_keys=True)
+        if path == '-':
+            sys.stdout.write(content + '\n')
+        else:
+            with open(path, 'w') as f:
+                f.write(content + '\n')
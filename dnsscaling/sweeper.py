@@ -0,0 +1,275 @@
+"""
+Sweep the A records of instances that are gone without deregistering
+"""
+
+import argparse
+from concurrent import futures
+import json
+import os
+import time
+
+# files named after the ip of every registered instance, listing the ids of its A records, written
+# by dnsscaling -a and touched every DEFAULT_HEARTBEAT seconds by its agent
+ALIVE_DIR = '/home/ec2-user/efs/dns_ip_addresses/alive/'
+DEFAULT_HEARTBEAT = 60.0
+# seconds after which the alive file of an instance running the agent is stale
+DEFAULT_MAX_AGE = 10 * DEFAULT_HEARTBEAT
+# largest fraction of the A records of a zone one sweep may delete
+DEFAULT_MAX_FRACTION = 0.25
+
+
+def touch_alive(ip, directory=ALIVE_DIR):
+    """
+    Create or touch the alive file of ip, returning False if it could not be written.
+
+    The directory is not created, without the EFS mount there is no one to read it.
+    """
+
+    path = os.path.join(directory, ip)
+    try:
+        with open(path, 'a'):
+            pass
+        os.utime(path)
+    except OSError:
+        return False
+    return True
+
+
+def write_alive(ip, record_ids, directory=ALIVE_DIR, agent=False):
+    """
+    Add record_ids to the alive file of ip, returning False if it could not be written.
+
+    The shutdown script copies the file to the removal directory, so the deregister worker deletes
+    these records only and not those of a later instance given the same ip.  agent marks the file
+    as touched by an agent, only those files can go stale for the FileChecker.
+    """
+
+    path = os.path.join(directory, ip)
+    ids = (read_alive(path) or {}).get('ids', [])
+    ids = ids + [str(x) for x in record_ids if str(x) not in ids]
+    try:
+        with open(path, 'w') as f:
+            f.write(json.dumps({'ids': ids, 'agent': agent}) + '\n')
+    except OSError:
+        return False
+    return True
+
+
+def read_alive(path):
+    """Content of an alive file or of a removal marker copied from one, None if it is empty or unreadable."""
+
+    try:
+        with open(path, 'r') as f:
+            content = json.loads(f.read())
+    except (OSError, ValueError):
+        return None
+    return content if isinstance(content, dict) else None
+
+
+def remove_alive(ip, directory=ALIVE_DIR):
+
+    try:
+        os.remove(os.path.join(directory, ip))
+    except OSError:
+        pass
+
+
+class FileChecker(object):
+    """
+    An ip is alive if its file in directory was written by an agent (dnsscaling -a --agent) and
+    modified within max_age seconds, and dead if it is older.
+
+    The checker has no answer for an ip without a file, not registered by dnsscaling -a, so
+    records of static hosts and external addresses are never swept, nor for an ip whose instance
+    runs no agent, as nothing refreshes its file.  Use the http or ec2 checker for those.
+    """
+
+    def __init__(self, directory=ALIVE_DIR, max_age=DEFAULT_MAX_AGE):
+        self.directory = directory
+        self.max_age = max_age
+
+    def check(self, ips):
+
+        now = time.time()
+        alive = {}
+        for ip in ips:
+            path = os.path.join(self.directory, ip)
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                alive[ip] = None
+                continue
+            if not (read_alive(path) or {}).get('agent'):
+                alive[ip] = None
+                continue
+            alive[ip] = now - st.st_mtime <= self.max_age
+        return alive
+
+
+class HttpChecker(object):
+    """
+    An ip is alive if it answers an http request on port and path with any status below 500.
+
+    The ips are checked concurrently, so a batch takes about one timeout at worst.
+    """
+
+    def __init__(self, port=80, path='/', timeout=2.0, concurrency=32, session=None):
+
+        self.port = port
+        self.path = path
+        self.timeout = timeout
+        self.concurrency = concurrency
+        self.session = session
+
+    def _check(self, ip):
+
+        try:
+            r = self.session.get('http://{0}:{1}{2}'.format(ip, self.port, self.path), timeout=self.timeout,
+                                 allow_redirects=False)
+        except Exception:
+            return False
+        return r.status_code < 500
+
+    def check(self, ips):
+
+        if self.session is None:
+            import requests
+            self.session = requests.Session()
+
+        ips = list(ips)
+        if not ips:
+            return {}
+        with futures.ThreadPoolExecutor(max_workers=min(self.concurrency, len(ips))) as executor:
+            return dict(zip(ips, executor.map(self._check, ips)))
+
+
+class Ec2Checker(object):
+    """
+    An ip is alive if it is the public ip of a pending or running EC2 instance.
+
+    Needs boto3, which is not a dependency of this package.  Instances are listed with one
+    describe_instances call per 200 ips.
+    """
+
+    def __init__(self, region=None, states=('pending', 'running'), client=None):
+
+        if client is None:
+            try:
+                import boto3
+            except ImportError:
+                raise ImportError('The ec2 checker needs boto3, install it with pip install boto3')
+            client = boto3.client('ec2', region_name=region)
+        self.client = client
+        self.states = list(states)
+
+    def check(self, ips):
+
+        ips = list(ips)
+        running = set()
+        paginator = self.client.get_paginator('describe_instances')
+        for i in range(0, len(ips), 200):
+            filters = [{'Name': 'ip-address', 'Values': ips[i:i + 200]},
+                       {'Name': 'instance-state-name', 'Values': self.states}]
+            for page in paginator.paginate(Filters=filters):
+                for reservation in page.get('Reservations', []):
+                    for instance in reservation.get('Instances', []):
+                        running.add(instance.get('PublicIpAddress'))
+        return {ip: ip in running for ip in ips}
+
+
+def sweep(api, site, checker, max_fraction=DEFAULT_MAX_FRACTION, dry_run=False, names=None):
+    """
+    Delete the A records whose ip the checker reports dead, in bulk.
+
+    The ips of the zone are checked in one batch.  If the dead records are more than max_fraction
+    of the A records nothing is deleted, a failing checker or health endpoint must not empty the
+    zone.
+
+    :param api: DnsMeApi
+    :param site:
+    :param checker: object with a check(ips) method returning a dict of ip -> alive, None or a
+        missing ip for no answer
+    :param max_fraction:
+    :param dry_run: only report what would be deleted
+    :param names: only sweep records of these names
+    :return: dict with site, records (A records before), dead (Records), deleted and failed (counts),
+        aborted (reason, '' if the sweep ran) and remaining (A records after)
+    """
+
+    site_id = api.get_site_id(site)
+    if not site_id:
+        raise Exception("No site id found for", site)
+
+    zone = api.get_zone(site_id, type='A')
+    candidates = [x for x in zone if names is None or x.name in names]
+    alive = checker.check(sorted({x.value for x in candidates}))
+    # ips the checker has no answer for are kept
+    dead = [x for x in candidates if alive.get(x.value, True) is False]
+
+    report = {'site': site, 'records': len(zone), 'dead': dead, 'deleted': 0, 'failed': 0, 'aborted': '',
+              'remaining': len(zone)}
+    if len(dead) > max_fraction * len(zone):
+        report['aborted'] = '{0} of {1} A records are dead, more than the {2:.0%} allowed'.format(
+            len(dead), len(zone), max_fraction)
+        return report
+    if dry_run or not dead:
+        return report
+
+    results = api.delete_records(site, [x.id for x in dead])
+    report['deleted'] = len([x for x in results if x['success']])
+    report['failed'] = len(results) - report['deleted']
+    report['remaining'] = len(zone) - report['deleted']
+    return report
+
+
+def format_report(report):
+
+    lines = ['- {0} A {1} (id {2})'.format(x.name or '@', x.value, x.id) for x in report['dead']]
+    if report['aborted']:
+        lines.append('{0}: aborted, {1}'.format(report['site'], report['aborted']))
+        return '\n'.join(lines)
+
+    shrunk = 1 - report['remaining'] / report['records'] if report['records'] else 0
+    lines.append('{0}: {1} dead, {2} deleted, {3} failed, {4} -> {5} A records ({6:.1%} smaller)'.format(
+        report['site'], len(report['dead']), report['deleted'], report['failed'], report['records'],
+        report['remaining'], shrunk))
+    return '\n'.join(lines)
+
+
+def run_sweeper():
+
+    from dnsscaling.dnsapi import DEFAULT_API_URL, DnsMeApi
+
+    parser = argparse.ArgumentParser(description="Delete the A records of instances that are no longer alive")
+    parser.add_argument('site', type=str, help="Domain to sweep")
+    parser.add_argument('--names', type=str, nargs='+', required=True,
+                        help="Names (subdomains, '' for the domain) the instances register their A records under, "
+                             "records of other names are never swept")
+    parser.add_argument('--checker', type=str, default='file', choices=['file', 'http', 'ec2'],
+                        help="How liveness is checked, the file checker skips ips not registered by dnsscaling -a")
+    parser.add_argument('--alive_dir', type=str, default=ALIVE_DIR, help="Directory of live ip files for the "
+                                                                         "file checker")
+    parser.add_argument('--max_age', type=float, default=DEFAULT_MAX_AGE,
+                        help="Seconds the live ip file of an instance running the agent stays valid, the agent "
+                             "touches it every {0:.0f} seconds".format(DEFAULT_HEARTBEAT))
+    parser.add_argument('--port', type=int, default=80, help="Port of the http checker")
+    parser.add_argument('--path', type=str, default='/', help="Path of the http checker")
+    parser.add_argument('--region', type=str, default=None, help="Region of the ec2 checker")
+    parser.add_argument('--max_fraction', type=float, default=DEFAULT_MAX_FRACTION,
+                        help="Largest fraction of the A records a sweep may delete")
+    parser.add_argument('--dry_run', action='store_true', default=False, help="[flag] Only print the dead records")
+    parser.add_argument('--credentials', type=str, default='', help="Json credentials file, defaults to the one "
+                                                                     "on EFS")
+    parser.add_argument('--api_url', type=str, default=DEFAULT_API_URL, help="Base url of the managed dns api")
+    args = parser.parse_args()
+
+    if args.checker == 'http':
+        checker = HttpChecker(port=args.port, path=args.path)
+    elif args.checker == 'ec2':
+        checker = Ec2Checker(region=args.region)
+    else:
+        checker = FileChecker(args.alive_dir, max_age=args.max_age)
+
+    with DnsMeApi(test_mode=True, credentials_json=args.credentials, url=args.api_url) as api:
+        print(format_report(sweep(api, args.site, checker, max_fraction=args.max_fraction, dry_run=args.dry_run,
+                                  names=set(args.names))))
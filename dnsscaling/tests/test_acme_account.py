@@ -0,0 +1,64 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from dnsscaling.acme_account import AcmeAccountStore
+
+STAGING = 'https://acme-staging-v02.api.letsencrypt.org/directory'
+PROD = 'https://acme-v02.api.letsencrypt.org/directory'
+
+
+class TestAcmeAccountStore(unittest.TestCase):
+
+    def setUp(self):
+        self.tdir = tempfile.mkdtemp(dir='/tmp')
+        self.path = os.path.join(self.tdir, 'acme')
+
+    def tearDown(self):
+        shutil.rmtree(self.tdir)
+
+    def test_account(self):
+
+        store = AcmeAccountStore(self.path)
+        self.assertIsNone(store.load_account(STAGING))
+
+        key = {'kty': 'RSA', 'n': 'abc', 'e': 'AQAB', 'd': 'secret'}
+        store.save_account(STAGING, key)
+        self.assertEqual({'key': key, 'regr': None}, store.load_account(STAGING))
+        self.assertIsNone(store.load_account(PROD))
+
+        regr = {'uri': 'https://acme.test/acct/1', 'body': {}}
+        AcmeAccountStore(self.path).save_account(STAGING, key, regr)
+        self.assertEqual(regr, AcmeAccountStore(self.path).load_account(STAGING)['regr'])
+
+        self.assertEqual(0o700, os.stat(self.path).st_mode & 0o777)
+        for name in os.listdir(self.path):
+            self.assertEqual(0o600, os.stat(os.path.join(self.path, name)).st_mode & 0o777)
+
+        store.remove_account(STAGING)
+        store.remove_account(STAGING)
+        self.assertIsNone(store.load_account(STAGING))
+
+    def test_directory(self):
+
+        directory = {'newNonce': 'https://acme.test/nonce', 'newOrder': 'https://acme.test/order'}
+        store = AcmeAccountStore(self.path, directory_ttl=0.2)
+        self.assertIsNone(store.load_directory(STAGING))
+        store.save_directory(STAGING, directory)
+        self.assertEqual(directory, store.load_directory(STAGING))
+        time.sleep(0.3)
+        self.assertIsNone(store.load_directory(STAGING))
+
+        store.save_directory(STAGING, directory)
+        store.invalidate_directory(STAGING)
+        self.assertIsNone(store.load_directory(STAGING))
+
+        store = AcmeAccountStore(self.path, directory_ttl=0)
+        store.save_directory(STAGING, directory)
+        self.assertIsNone(store.load_directory(STAGING))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from unittest.mock import mock_open, patch
+
+from dnsscaling import agent, write_init_script
+from dnsscaling.dnsapi import DnsMeApi
+from dnsscaling.mock_dnsme import API_PATH, MockDnsMe, serve
+
+
+class TestAgent(unittest.TestCase):
+
+    def setUp(self):
+        self.tdir = tempfile.mkdtemp(dir='/tmp')
+        self.socket_path = os.path.join(self.tdir, 'run', 'agent.sock')
+
+    def tearDown(self):
+        shutil.rmtree(self.tdir)
+
+    def test_commands(self):
+
+        mock = MockDnsMe()
+        mock.add_zone('simpa.io', site_id=7)
+        api = DnsMeApi(test_mode=True, credentials=mock.credentials)
+        mock.install(api)
+        record = api.add_a_record('simpa.io', 'www', '192.0.2.1')
+
+        alive = os.path.join(self.tdir, '192.0.2.1')
+        server = agent.Agent(api, socket_path=self.socket_path, alive_dir=self.tdir, heartbeat=0.05)
+        server.register('7', record)
+        server.bind()
+        self.assertEqual(0o600, os.stat(self.socket_path).st_mode & 0o777)
+        thread = threading.Thread(target=server.serve)
+        thread.start()
+
+        self.assertEqual('ok', agent.send('ping', self.socket_path))
+        # the alive file of the sweeper is touched every heartbeat
+        touched = os.stat(alive).st_mtime
+        time.sleep(0.2)
+        self.assertGreater(os.stat(alive).st_mtime, touched)
+        self.assertIn('"value": "192.0.2.1"', agent.send('status', self.socket_path))
+        self.assertTrue(agent.send('bogus', self.socket_path).startswith('error'))
+
+        # a single pre resolved delete, and the agent exits
+        mock.reset_stats()
+        self.assertEqual('ok 1', agent.send('remove', self.socket_path))
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual([('DELETE', API_PATH + '/7/records/' + str(record['id']))], mock.calls)
+        self.assertEqual([], mock.records(7))
+        self.assertFalse(os.path.exists(self.socket_path))
+        self.assertFalse(os.path.exists(alive))
+
+    def test_start_detached(self):
+
+        mock = MockDnsMe()
+        mock.add_zone('simpa.io', site_id=7)
+        http = serve(mock)
+        try:
+            api = DnsMeApi(test_mode=True, credentials=mock.credentials,
+                           url='http://127.0.0.1:%d%s' % (http.server_address[1], API_PATH))
+            record = api.add_a_record('simpa.io', 'www', '192.0.2.1')
+            agent.start(api, '7', record, socket_path=self.socket_path)
+            api.close()
+
+            start = time.monotonic()
+            self.assertEqual('ok 1', agent.send('remove', self.socket_path))
+            self.assertTrue(time.monotonic() - start < 1.0)
+            self.assertEqual([], mock.records(7))
+        finally:
+            http.shutdown()
+
+    def _init_scripts(self, **kwargs):
+
+        with patch('builtins.open', mock_open()) as opened:
+            write_init_script('www.simpa.io', '/etc/systemd/system/', **kwargs)
+        # each file is written with one call
+        writes = [x.args[0] for x in opened.return_value.write.call_args_list]
+        return dict(zip([x.args[0] for x in opened.call_args_list], writes))
+
+    def test_init_scripts(self):
+
+        # the agent is opt in
+        scripts = self._init_scripts()
+        self.assertIn('dnsscaling -a www.simpa.io\n', scripts['/etc/init.d/dnsscalingdelete'])
+        self.assertNotIn('nc -U', scripts['/tmp/ip_removal.sh'])
+        self.assertIn('dnsscaling -r --deadline 5', scripts['/tmp/ip_removal.sh'])
+
+        scripts = self._init_scripts(agent=True, agent_socket=self.socket_path)
+        self.assertIn('dnsscaling -a www.simpa.io --agent --agent_socket ' + self.socket_path + '\n',
+                      scripts['/etc/init.d/dnsscalingdelete'])
+        self.assertIn('nc -U ' + self.socket_path + ' |', scripts['/tmp/ip_removal.sh'])
+        self.assertIn('nc -U /run/dnsscaling/agent.sock |', self._init_scripts(agent=True)['/tmp/ip_removal.sh'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+import asyncio
+import time
+import unittest
+
+from dnsscaling.async_dnsapi import AsyncDnsMeApi
+from dnsscaling.mock_dnsme import API_PATH, MockDnsMe
+from dnsscaling.retry import DnsMeError, RetryPolicy
+from dnsscaling.stats import Instrumentation
+
+
+class TestAsyncDnsMeApi(unittest.TestCase):
+
+    def test_concurrent_zones(self):
+
+        mock = MockDnsMe(latency=0.01)
+        sites = ['site%d.io' % i for i in range(4)]
+        site_ids = [mock.add_zone(x) for x in sites]
+
+        async def run():
+            async with AsyncDnsMeApi(test_mode=True, credentials=mock.credentials, concurrency=5) as api:
+                mock.install(api.api)
+                await asyncio.gather(*[api.add_a_record(site, 'www', '10.0.0.%d' % n)
+                                       for site in sites for n in range(5)])
+                return await asyncio.gather(*[api.get_records(x, type='A') for x in site_ids])
+
+        records = asyncio.run(run())
+
+        self.assertEqual([5, 5, 5, 5], [len(x) for x in records])
+        self.assertEqual(1, mock.calls.count(('GET', API_PATH)))
+        self.assertTrue(1 < mock.max_in_flight <= 5)
+
+    def test_context(self):
+
+        mock = MockDnsMe()
+        site_id = mock.add_zone('simpa.io')
+        events = []
+        instrumentation = Instrumentation([events.append])
+
+        async def run():
+            async with AsyncDnsMeApi(test_mode=True, credentials=mock.credentials, instrumentation=instrumentation,
+                                     retry_policy=RetryPolicy(max_attempts=20, base_delay=0.05, max_delay=0.05)) as api:
+                mock.install(api.api)
+                # the span and the deadline of the caller reach the worker threads
+                with instrumentation.span('batch'):
+                    await api.get_records(site_id)
+                mock.errors = [503] * 20
+                start = time.monotonic()
+                with api.api.deadline(0.2):
+                    with self.assertRaises(DnsMeError):
+                        await api.get_records(site_id, refresh=True)
+                self.assertLess(time.monotonic() - start, 0.4)
+
+                # closing waits for the calls in flight without blocking the loop
+                mock.errors = []
+                mock.latencies = [0.2]
+                pending = asyncio.ensure_future(api.get_site_id('simpa.io', refresh=True))
+                await asyncio.sleep(0.05)
+                ticks = []
+
+                async def tick():
+                    while not pending.done():
+                        ticks.append(1)
+                        await asyncio.sleep(0.01)
+
+                await asyncio.gather(api.__aexit__(None, None, None), tick())
+                self.assertTrue(ticks)
+                return await pending
+
+        self.assertEqual(str(site_id), str(asyncio.run(run())))
+        spans = [x for x in events if x['event'] == 'span' and x['name'] == 'get_records']
+        self.assertEqual('batch', spans[0]['parent'])
+
+
+if __name__ == '__main__':
+    unittest.main()
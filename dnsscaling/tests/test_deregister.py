@@ -0,0 +1,126 @@
+import io
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from dnsscaling.deregister import DirectoryWatcher, drain, pending, run
+from dnsscaling.dnsapi import DnsMeApi
+from dnsscaling.mock_dnsme import MockDnsMe
+from dnsscaling.sweeper import write_alive
+
+
+class TestDeregister(unittest.TestCase):
+
+    def setUp(self):
+        self.tdir = tempfile.mkdtemp(dir='./')
+        self.alive_dir = tempfile.mkdtemp(dir='./')
+
+    def tearDown(self):
+        shutil.rmtree(self.tdir)
+        shutil.rmtree(self.alive_dir)
+
+    def _api(self):
+
+        mock = MockDnsMe()
+        mock.add_zone('simpa.io', records=20, site_id=7)
+        for name, value in [('www', '192.0.2.1'), ('api', '192.0.2.1'), ('www', '192.0.2.2'), ('www', '192.0.2.3')]:
+            mock.add_record(7, name, 'A', value)
+        api = DnsMeApi(test_mode=True, credentials=mock.credentials)
+        mock.install(api)
+        return api, mock
+
+    def _touch(self, *names):
+        for name in names:
+            open(os.path.join(self.tdir, name), 'w').close()
+
+    def test_drain(self):
+
+        api, mock = self._api()
+        self._touch('192.0.2.1', '192.0.2.2', '192.0.2.9', 'notes.txt')
+        self.assertEqual(['192.0.2.1', '192.0.2.2', '192.0.2.9'], pending(self.tdir))
+
+        summary = drain(api, 'simpa.io', self.tdir, alive_dir=self.alive_dir)
+        self.assertEqual({'192.0.2.1': 2, '192.0.2.2': 1, '192.0.2.9': 0},
+                         {k: v['deleted'] for k, v in summary.items()})
+        self.assertEqual(['notes.txt'], os.listdir(self.tdir))
+        self.assertEqual(['192.0.2.3'], [x['value'] for x in mock.records(7) if x['name'] == 'www'])
+        # one site id lookup, one zone listing and one bulk delete
+        self.assertEqual({'domains': 1, 'records': 1, 'records_delete_multi': 1}, mock.stats['endpoints'])
+
+    def test_reused_ip(self):
+
+        api, mock = self._api()
+        old, new = [x['id'] for x in mock.records(7) if x['value'] == '192.0.2.1']
+
+        # the terminated instance registered old, the instance now holding its ip registered new
+        self.assertTrue(write_alive('192.0.2.1', [old], self.tdir))
+        self.assertTrue(write_alive('192.0.2.2', [], self.tdir))
+        self.assertTrue(write_alive('192.0.2.2', [], self.alive_dir))
+        summary = drain(api, 'simpa.io', self.tdir, alive_dir=self.alive_dir)
+        self.assertEqual({'192.0.2.1': 1, '192.0.2.2': 0}, {k: v['deleted'] for k, v in summary.items()})
+        self.assertEqual([new], [x['id'] for x in mock.records(7) if x['value'] == '192.0.2.1'])
+        self.assertEqual([], pending(self.tdir))
+        # the alive file of the terminated instance goes with its marker
+        self.assertEqual([], os.listdir(self.alive_dir))
+
+        # an empty marker older than the alive file of its ip is from before the ip was reused
+        self._touch('192.0.2.1', '192.0.2.3')
+        os.utime(os.path.join(self.tdir, '192.0.2.1'), (time.time() - 60,) * 2)
+        self.assertTrue(write_alive('192.0.2.1', [new], self.alive_dir))
+        summary = drain(api, 'simpa.io', self.tdir, alive_dir=self.alive_dir)
+        self.assertEqual({'192.0.2.1': 0, '192.0.2.3': 1}, {k: v['deleted'] for k, v in summary.items()})
+        self.assertEqual([new], [x['id'] for x in mock.records(7) if x['value'] == '192.0.2.1'])
+        self.assertEqual(['192.0.2.1'], os.listdir(self.alive_dir))
+
+    def test_markers_kept_on_failure(self):
+
+        api, mock = self._api()
+        self._touch('192.0.2.1', '192.0.2.3')
+        api.get_site_id('simpa.io')
+        api.get_records('7')
+
+        # the bulk delete and the single delete of 192.0.2.3 fail
+        mock.fail_bulk = True
+        record_id = [x['id'] for x in mock.records(7) if x['value'] == '192.0.2.3'][0]
+        original = mock._handle
+
+        def handle(method, url, headers, body):
+            if method == 'DELETE' and url.endswith('/' + str(record_id)):
+                return 400, {}, {'error': ['Injected error']}
+            return original(method, url, headers, body)
+
+        mock._handle = handle
+        summary = drain(api, 'simpa.io', self.tdir, alive_dir=self.alive_dir)
+        self.assertTrue(summary['192.0.2.3']['error'])
+        self.assertEqual(['192.0.2.3'], pending(self.tdir))
+
+        # the next pass finishes the job
+        mock._handle = original
+        log = io.StringIO()
+        run(api, 'simpa.io', self.tdir, once=True, log=log, alive_dir=self.alive_dir)
+        self.assertEqual([], pending(self.tdir))
+        self.assertEqual('192.0.2.3: 1 deleted\n', log.getvalue())
+
+    def test_watcher(self):
+
+        for inotify in (True, False):
+            watcher = DirectoryWatcher(self.tdir, inotify=inotify)
+            try:
+                threading.Timer(0.05, self._touch, ['192.0.2.%d' % inotify]).start()
+                start = time.monotonic()
+                woken = watcher.wait(0.5)
+                if watcher.inotify:
+                    self.assertTrue(woken)
+                    self.assertTrue(time.monotonic() - start < 0.4)
+                else:
+                    self.assertFalse(woken)
+                self.assertIn('192.0.2.%d' % inotify, pending(self.tdir))
+            finally:
+                watcher.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+import unittest
+
+from dnsscaling import propagation
+from dnsscaling.dns01 import ChallengeRecords, challenge_record
+from dnsscaling.dnsapi import DnsMeApi
+from dnsscaling.mock_dnsme import MockDnsMe
+from dnsscaling.propagation import PropagationTimeout
+from dnsscaling.tests.test_propagation import StubDns
+
+
+class TestChallengeRecords(unittest.TestCase):
+
+    def setUp(self):
+
+        self.mock = MockDnsMe()
+        self.simpa = self.mock.add_zone('simpa.io', site_id=7)
+        self.other = self.mock.add_zone('other.io', site_id=8)
+        self.mock.add_record(self.simpa, 'www', 'A', '192.0.2.1')
+        self.mock.add_record(self.simpa, '_acme-challenge', 'TXT', 'left-over')
+        self.api = DnsMeApi(test_mode=True, credentials=self.mock.credentials)
+        self.mock.install(self.api)
+        self.stub = StubDns()
+
+    def tearDown(self):
+        self.stub.close()
+
+    def _txt(self, site_id):
+        return sorted((x['name'], x['value']) for x in self.mock.records(site_id) if x['type'] == 'TXT')
+
+    def _serve_zone(self, zone, site_id):
+        for name, value in self._txt(site_id):
+            key = ('{0}.{1}'.format(name, zone), propagation.TYPE_TXT)
+            self.stub.records.setdefault(key, []).append(value)
+
+    def test_challenge_record(self):
+
+        self.assertEqual(('simpa.io', '_acme-challenge'), challenge_record('simpa.io'))
+        self.assertEqual(('simpa.io', '_acme-challenge'), challenge_record('*.simpa.io'))
+        self.assertEqual(('simpa.io', '_acme-challenge.api.eu'), challenge_record('api.eu.simpa.io'))
+
+    def test_publish_wait_cleanup(self):
+
+        validations = [('*.simpa.io', 'v1'), ('simpa.io', 'v2'), ('www.simpa.io', 'v3'), ('other.io', 'v4'),
+                       ('simpa.io', 'v2')]
+        with ChallengeRecords(self.api, nameservers=[self.stub.address], timeout=0.5) as records:
+            self.mock.reset_stats()
+            self.assertEqual([], records.publish(validations))
+            # one listing, one delete and one create per zone at most
+            endpoints = self.mock.stats['endpoints']
+            self.assertEqual(2, endpoints['records_create_multi'])
+            self.assertEqual(1, endpoints['records_delete_multi'])
+
+            self.assertEqual([('_acme-challenge', 'v1'), ('_acme-challenge', 'v2'), ('_acme-challenge.www', 'v3')],
+                             self._txt(self.simpa))
+            self.assertEqual([('_acme-challenge', 'v4')], self._txt(self.other))
+
+            with self.assertRaises(PropagationTimeout):
+                records.wait()
+            self._serve_zone('simpa.io', self.simpa)
+            self._serve_zone('other.io', self.other)
+            self.assertLess(records.wait(), 0.5)
+
+        self.assertEqual([], self._txt(self.simpa))
+        self.assertEqual([], self._txt(self.other))
+        self.assertEqual(['www'], [x['name'] for x in self.mock.records(self.simpa)])
+        self.assertEqual([], records.cleanup())
+
+    def test_failed_zones(self):
+
+        validations = [('simpa.io', 'v1'), ('other.io', 'v2'), ('nozone.io', 'v3')]
+        with ChallengeRecords(self.api, nameservers=[self.stub.address], timeout=0.5) as records:
+            errors = records.publish(validations)
+            # the zone missing from the account does not stop the others
+            self.assertEqual(['nozone.io'], list(records.failed))
+            self.assertEqual(1, len(errors))
+            self.assertEqual([('_acme-challenge', 'v1')], self._txt(self.simpa))
+
+            self._serve_zone('simpa.io', self.simpa)
+            waited = records.wait_zones()
+            self.assertEqual(['other.io', 'simpa.io'], sorted(waited))
+            self.assertIsInstance(waited['other.io'], PropagationTimeout)
+            self.assertLess(waited['simpa.io'], 0.5)
+
+        self.assertEqual([], self._txt(self.simpa))
+        self.assertEqual([], self._txt(self.other))
+
+
+if __name__ == '__main__':
+    unittest.main()
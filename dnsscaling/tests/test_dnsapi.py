@@ -0,0 +1,416 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from unittest.mock import Mock, patch
+
+import requests
+
+from dnsscaling.aws import Imds, get_public_ip
+from dnsscaling.cache import load_credentials
+from dnsscaling.dnsapi import DnsMeApi
+from dnsscaling.mock_dnsme import API_PATH, MockDnsMe, MockDnsMeAdapter
+from dnsscaling.ratelimit import RequestScheduler
+from dnsscaling.retry import DeadlineExceeded, DnsMeError, RetryPolicy
+
+ZONE_PATH = API_PATH + '/7/records'
+
+
+class TestDnsMeApi(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tdir = tempfile.mkdtemp(dir='./')
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tdir)
+
+    def _api(self, values=()):
+
+        mock = MockDnsMe()
+        mock.add_zone('other.io', site_id=1)
+        mock.add_zone('simpa.io', site_id=7)
+        for value in values:
+            mock.add_record(7, 'www', 'A', value)
+
+        api = DnsMeApi(test_mode=True, credentials=mock.credentials)
+        mock.install(api)
+        return api, mock
+
+    def test_session_shared(self):
+
+        api, mock = self._api()
+        api.add_a_record('simpa.io', 'www', '1.2.3.4')
+        api.delete_a_record('simpa.io', 'www', '1.2.3.4')
+
+        methods = [c[0] for c in mock.calls]
+        self.assertIn('POST', methods)
+        self.assertIn('DELETE', methods)
+        self.assertEqual([], mock.records(7))
+
+    def test_credentials_file(self):
+
+        mock = MockDnsMe()
+        path = os.path.join(self.tdir, 'dme_credentials.json')
+        with open(path, 'w') as f:
+            f.write('{"apikey": "mock-apikey", "apisecret": "mock-apisecret"}\n')
+
+        api = DnsMeApi(test_mode=True, credentials_json=path)
+        mock.install(api)
+        self.assertEqual('', api.get_site_id('simpa.io'))
+        self.assertEqual(1, mock.stats['requests'])
+
+    def test_credentials_cache(self):
+
+        path = os.path.join(self.tdir, 'efs_credentials.json')
+        cache_path = os.path.join(self.tdir, 'local', 'dme_credentials.json')
+        with open(path, 'w') as f:
+            f.write('{"apikey": "key1", "apisecret": "secret1"}\n')
+
+        self.assertEqual('key1', load_credentials(path, cache_path)['apikey'])
+        self.assertEqual(0o600, os.stat(cache_path).st_mode & 0o777)
+
+        # a changed EFS file refreshes the copy, an unreachable one falls back to it
+        with open(path, 'w') as f:
+            f.write('{"apikey": "key22", "apisecret": "secret22"}\n')
+        self.assertEqual('key22', load_credentials(path, cache_path)['apikey'])
+        os.remove(path)
+        api = DnsMeApi(test_mode=True, credentials_json=path, credentials_cache=cache_path)
+        self.assertEqual('secret22', api.apisecret)
+
+        # a copy in a directory others can write to is neither trusted nor refreshed
+        os.chmod(os.path.dirname(cache_path), 0o777)
+        self.assertRaises(OSError, load_credentials, path, cache_path)
+        with open(path, 'w') as f:
+            f.write('{"apikey": "key3", "apisecret": "secret3"}\n')
+        self.assertEqual('key3', load_credentials(path, cache_path)['apikey'])
+        with open(cache_path) as f:
+            self.assertIn('key22', f.read())
+
+    def test_ip_lookup_lazy(self):
+
+        class Metadata(object):
+            def __init__(self):
+                self.calls = []
+
+            def put(self, url, headers, timeout):
+                self.calls.append(('PUT', url))
+                return Mock(status_code=200, text='token1')
+
+            def get(self, url, headers, timeout):
+                self.calls.append(('GET', url))
+                if headers.get('X-aws-ec2-metadata-token') != 'token1':
+                    return Mock(status_code=401, text='')
+                return Mock(status_code=200, text='203.0.113.9')
+
+        credentials = MockDnsMe().credentials
+        with patch('dnsscaling.dnsapi.get_aws_ip') as get_aws_ip:
+            api = DnsMeApi(credentials=credentials)
+            api2 = DnsMeApi(credentials=credentials, ipaddress='192.0.2.1')
+            get_aws_ip.return_value = '203.0.113.9'
+            self.assertFalse(get_aws_ip.called)
+            self.assertEqual('203.0.113.9', api.ipaddress)
+            self.assertEqual('192.0.2.1', api2.ipaddress)
+            self.assertEqual(1, get_aws_ip.call_count)
+
+        # the IMDSv2 token is cached on disk, a stale one is replaced once
+        session = Metadata()
+        token_cache = os.path.join(self.tdir, 'imds_token.json')
+        self.assertEqual('203.0.113.9', get_public_ip(session=session, token_cache=token_cache))
+        self.assertEqual('203.0.113.9', get_public_ip(session=session, token_cache=token_cache))
+        self.assertEqual(['PUT', 'GET', 'GET'], [x[0] for x in session.calls])
+
+        imds = Imds(session=session, token_cache=token_cache)
+        imds._token, imds._token_expires = 'revoked', time.time() + 600
+        self.assertEqual('203.0.113.9', imds.get('meta-data/public-ipv4'))
+        self.assertEqual(['GET', 'PUT', 'GET'], [x[0] for x in session.calls[3:]])
+
+    def test_context_manager_closes(self):
+
+        with DnsMeApi(test_mode=True, credentials=MockDnsMe().credentials) as api:
+            adapter = MockDnsMeAdapter(MockDnsMe())
+            api.session.mount('https://', adapter)
+        self.assertTrue(adapter.closed)
+
+    def test_external_session_not_closed(self):
+
+        session = requests.Session()
+        adapter = MockDnsMeAdapter(MockDnsMe())
+        session.mount('https://', adapter)
+        with DnsMeApi(test_mode=True, credentials=MockDnsMe().credentials, session=session):
+            pass
+        self.assertFalse(adapter.closed)
+
+    def test_bad_hmac(self):
+
+        api, mock = self._api()
+        api.apisecret = 'wrong'
+        with self.assertRaises(DnsMeError) as cm:
+            api.get_site_id('simpa.io')
+        self.assertEqual(403, cm.exception.status_code)
+
+    def test_site_id_cached(self):
+
+        api, mock = self._api()
+        self.assertEqual('7', api.get_site_id('simpa.io'))
+        self.assertEqual('1', api.get_site_id('other.io'))
+        self.assertEqual('', api.get_site_id('missing.io'))
+        self.assertEqual(2, mock.calls.count(('GET', API_PATH)))
+
+        api.invalidate_site_id('simpa.io')
+        self.assertEqual('7', api.get_site_id('simpa.io'))
+        self.assertEqual(3, mock.calls.count(('GET', API_PATH)))
+
+    def test_site_id_cache_file(self):
+
+        path = os.path.join(self.tdir, 'site_ids.json')
+        api, mock = self._api()
+        api.site_cache.path = path
+        self.assertEqual('7', api.get_site_id('simpa.io'))
+
+        api2, mock2 = self._api()
+        api2.site_cache.path = path
+        self.assertEqual('7', api2.get_site_id('simpa.io'))
+        self.assertEqual([], mock2.calls)
+
+        api2.invalidate_site_id()
+        api3, mock3 = self._api()
+        api3.site_cache.path = path
+        self.assertEqual('7', api3.get_site_id('simpa.io'))
+        self.assertEqual(1, len(mock3.calls))
+
+    def test_records_indexed(self):
+
+        api, mock = self._api(['10.0.0.%d' % i for i in range(1, 6)])
+
+        # listing the whole zone builds the index that answers the filtered lookups
+        self.assertEqual(5, len(api.get_records('7')))
+        self.assertEqual(5, len(api.get_records('7', type='A', name='www')))
+        self.assertEqual(['10.0.0.3'], [x['value'] for x in api.get_records('7', type='A', value='10.0.0.3')])
+
+        api.add_a_record('simpa.io', 'api', '10.0.1.1')
+        self.assertEqual(1, len(api.get_records('7', type='A', name='api')))
+
+        api.delete_a_ip('simpa.io', '10.0.0.3')
+        self.assertEqual([], api.get_records('7', type='A', value='10.0.0.3'))
+        self.assertEqual(1, mock.calls.count(('GET', ZONE_PATH)))
+
+        api.get_records('7', refresh=True)
+        self.assertEqual(2, mock.calls.count(('GET', ZONE_PATH)))
+        api.invalidate_records()
+        self.assertEqual(4, len(api.get_records('7', type='A', name='www')))
+        self.assertEqual(3, mock.calls.count(('GET', ZONE_PATH)))
+
+    def test_iter_records(self):
+
+        api, mock = self._api()
+        mock.add_zone('big.io', records=250, site_id=9)
+        mock.add_record(9, 'www', 'A', '192.0.2.1')
+        mock.add_record(9, 'www', 'TXT', 'text')
+
+        records = api.iter_records('9', page_size=100)
+        self.assertEqual('host0', next(records)['name'])
+        self.assertEqual(1, mock.stats['requests'])
+        self.assertEqual(251, len(list(records)))
+        self.assertEqual(3, mock.stats['requests'])
+
+        # a lookup without an index only transfers the matching records
+        mock.reset_stats()
+        self.assertEqual(['192.0.2.1'], [x['value'] for x in api.get_records('9', type='A', name='www')])
+        self.assertEqual(1, mock.stats['requests'])
+        self.assertTrue(mock.stats['response_bytes'] < 1000)
+        self.assertEqual(['host7'], [x['name'] for x in api.get_records('9', type='A', value='10.0.0.7')])
+
+        zone = api.get_zone('9', page_size=100)
+        self.assertEqual(252, len(zone))
+        self.assertEqual(['192.0.2.1'], [x.value for x in zone.find(type='A', name='www')])
+
+    def test_upsert(self):
+
+        api, mock = self._api(['10.0.0.1'])
+        api.get_site_id('simpa.io')
+
+        # a new record is one post, an existing one an "already exists" answer and a lookup
+        mock.reset_stats()
+        self.assertEqual('10.0.0.2', api.add_a_record('simpa.io', 'www', '10.0.0.2')['value'])
+        self.assertEqual(['POST'], [c[0] for c in mock.calls])
+        mock.reset_stats()
+        self.assertEqual('10.0.0.1', api.upsert_record('simpa.io', 'www', 'A', '10.0.0.1', ttl=1800)['value'])
+        self.assertEqual(['POST', 'GET'], [c[0] for c in mock.calls])
+        self.assertEqual(2, len(mock.records(7)))
+
+        # with a zone index the ttl and value changes are one put
+        api.get_records('7')
+        mock.reset_stats()
+        api.upsert_record('simpa.io', 'www', 'A', '10.0.0.2', ttl=120)
+        api.upsert_record('simpa.io', 'www', 'A', '10.0.0.2', ttl=120)
+        self.assertEqual(['PUT'], [c[0] for c in mock.calls])
+        self.assertEqual([1800, 120], [x['ttl'] for x in mock.records(7)])
+
+        # replacing looks the name up without an index
+        mock.add_record(7, 'api', 'TXT', 'old')
+        api.invalidate_records()
+        mock.reset_stats()
+        record = api.upsert_record('simpa.io', 'api', 'TXT', 'new', replace=True)
+        self.assertEqual(['GET', 'PUT'], [c[0] for c in mock.calls])
+        self.assertEqual([record], [x for x in mock.records(7) if x['type'] == 'TXT'])
+        self.assertEqual([record], api.get_records('7', type='TXT', name='api'))
+
+    def test_bulk(self):
+
+        api, mock = self._api()
+        records = [{'name': 'n%d' % i, 'type': 'A', 'value': '10.0.%d.1' % i} for i in range(25)]
+
+        results = api.add_records('simpa.io', records, chunk_size=10)
+        self.assertEqual(25, len(results))
+        self.assertTrue(all(x['success'] for x in results))
+        self.assertEqual(['n0', 'n24'], [results[0]['record']['name'], results[-1]['record']['name']])
+        self.assertEqual(3, mock.stats['endpoints']['records_create_multi'])
+
+        updates = [(x['record'], dict(x['record'], ttl=60)) for x in results]
+        results = api.update_records('simpa.io', updates, chunk_size=10)
+        self.assertTrue(all(x['success'] and x['record']['ttl'] == 60 for x in results))
+        self.assertEqual(3, mock.stats['endpoints']['records_update_multi'])
+        self.assertEqual({60}, {x['ttl'] for x in mock.records(7)})
+
+        ids = [x['record']['id'] for x in results]
+        results = api.delete_records('simpa.io', ids, chunk_size=10)
+        self.assertTrue(all(x['success'] for x in results))
+        self.assertEqual(3, mock.stats['endpoints']['records_delete_multi'])
+        self.assertEqual([], mock.records(7))
+
+    def test_bulk_fallback(self):
+
+        api, mock = self._api()
+        # a failing bulk request falls back to one request per record
+        mock.fail_bulk = True
+
+        records = [{'name': 'www', 'type': 'A', 'value': '10.0.0.%d' % i} for i in (1, 2, 1)]
+        results = api.add_records('simpa.io', records)
+        self.assertEqual([True, True, False], [x['success'] for x in results])
+        self.assertIn('already exists', results[2]['error'])
+
+        first, second = results[0]['record'], results[1]['record']
+        updates = [(first, dict(first, ttl=60)), (second, dict(second, value='10.0.0.1'))]
+        self.assertEqual([True, False], [x['success'] for x in api.update_records('simpa.io', updates)])
+
+        ids = [results[0]['record']['id'], 1, results[1]['record']['id']]
+        results = api.delete_records('simpa.io', ids)
+        self.assertEqual([str(x) for x in ids], [x['id'] for x in results])
+        self.assertEqual([True, False, True], [x['success'] for x in results])
+
+    def test_rate_limited(self):
+
+        api, mock = self._api()
+        api.scheduler = RequestScheduler(limit=2, window=0.2)
+        mock.quota = 2
+        mock.window = 0.2
+
+        # the third request is queued until the window frees a slot
+        api.add_a_record('simpa.io', 'www', '10.0.0.1', robust=False)
+        self.assertEqual(0, api.budget['remaining'])
+        self.assertEqual('www', api.get_records('7', type='A')[0]['name'])
+        self.assertEqual(3, mock.stats['requests'] - mock.stats['rate_limited'])
+
+    def test_rate_limited_bounded(self):
+
+        api, mock = self._api()
+        api.get_site_id('simpa.io')
+        api.scheduler = RequestScheduler(limit=100, window=1.0, max_backoff=0.02)
+        api.retry_policy = RetryPolicy(budget_max=3)
+
+        # persistent quota rejections spend the retry budget instead of looping forever
+        mock.errors = [429] * 50
+        mock.reset_stats()
+        with self.assertRaises(DnsMeError) as cm:
+            api.get_records('7', refresh=True)
+        self.assertEqual(429, cm.exception.status_code)
+        self.assertEqual(4, len(mock.calls))
+
+        # and waiting out a rejection past the deadline fails with DeadlineExceeded, in time
+        api.scheduler = RequestScheduler(limit=2, window=2.0)
+        api.retry_policy = RetryPolicy()
+        mock.errors = [429] * 50
+        start = time.monotonic()
+        with self.assertRaises(DeadlineExceeded):
+            with api.deadline(0.3):
+                api.get_records('7', refresh=True)
+        self.assertLess(time.monotonic() - start, 0.4)
+
+    def test_retry_transient(self):
+
+        api, mock = self._api()
+        api.retry_policy = RetryPolicy(base_delay=0.001)
+        mock.errors = [503, 502]
+
+        self.assertEqual('7', api.get_site_id('simpa.io'))
+        self.assertEqual(3, len(mock.calls))
+
+    def test_no_retry_client_error(self):
+
+        api, mock = self._api()
+        api.retry_policy = RetryPolicy(base_delay=0.001)
+        api.get_site_id('simpa.io')
+        mock.errors = [400]
+
+        with self.assertRaises(DnsMeError) as cm:
+            api.add_a_record('simpa.io', 'www', '10.0.0.1')
+        self.assertEqual(400, cm.exception.status_code)
+        # one rejected post, not followed by a lookup or a second post
+        self.assertEqual(['GET', 'POST'], [c[0] for c in mock.calls])
+
+    def test_retry_create(self):
+
+        api, mock = self._api()
+        api.retry_policy = RetryPolicy(base_delay=0.001)
+        api.get_site_id('simpa.io')
+
+        # a post answered with a 500 may have taken effect, only a robust add repeats it
+        mock.errors = [500]
+        with self.assertRaises(DnsMeError):
+            api.add_a_record('simpa.io', 'www', '10.0.0.1', robust=False)
+        mock.errors = [500, 502]
+        mock.reset_stats()
+        self.assertEqual('10.0.0.1', api.add_a_record('simpa.io', 'www', '10.0.0.1')['value'])
+        self.assertEqual(['POST', 'POST', 'POST'], [c[0] for c in mock.calls])
+        self.assertEqual(['10.0.0.1'], [x['value'] for x in mock.records(7)])
+
+    def test_deadline(self):
+
+        api, mock = self._api()
+        api.retry_policy = RetryPolicy(max_attempts=10, base_delay=0.05, max_delay=0.05)
+        api.get_site_id('simpa.io')
+        mock.errors = [503] * 10
+
+        start = time.monotonic()
+        with self.assertRaises(DnsMeError):
+            with api.deadline(0.2):
+                api.get_records('7')
+        self.assertTrue(time.monotonic() - start < 0.3)
+
+        # the read timeout is cut to the time left before the deadline
+        mock.errors = []
+        mock.latencies = [5.0]
+        start = time.monotonic()
+        with self.assertRaises(DeadlineExceeded):
+            with api.deadline(0.1):
+                api.get_records('7', refresh=True)
+        self.assertTrue(time.monotonic() - start < 0.3)
+
+    def test_hedged_get(self):
+
+        api, mock = self._api()
+        api.hedge_after = 0.05
+        mock.latencies = [1.0]
+
+        start = time.monotonic()
+        self.assertEqual('7', api.get_site_id('simpa.io'))
+        self.assertTrue(time.monotonic() - start < 0.5)
+        self.assertEqual(2, mock.max_in_flight)
+        api.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,119 @@
+import socket
+import struct
+import threading
+import time
+import unittest
+
+from dnsscaling import propagation
+from dnsscaling.propagation import PropagationChecker, PropagationTimeout
+
+
+class StubDns(object):
+    """UDP nameserver answering from a dict of (name, type) -> list of values, with no compression."""
+
+    def __init__(self):
+
+        self.records = {}
+        self.queries = 0
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(('127.0.0.1', 0))
+        self.address = '127.0.0.1:%d' % self.sock.getsockname()[1]
+        self.thread = threading.Thread(target=self._serve, daemon=True)
+        self.thread.start()
+
+    @staticmethod
+    def _rdata(rtype, value):
+
+        if rtype == propagation.TYPE_TXT:
+            value = value.encode('utf-8')
+            return struct.pack('!B', len(value)) + value
+        if rtype == propagation.TYPE_A:
+            return socket.inet_aton(value)
+        return propagation._encode_name(value)
+
+    def _rr(self, name, rtype, value):
+
+        rdata = self._rdata(rtype, value)
+        return propagation._encode_name(name) + struct.pack('!HHIH', rtype, 1, 30, len(rdata)) + rdata
+
+    def _serve(self):
+
+        while True:
+            try:
+                data, peer = self.sock.recvfrom(4096)
+            except OSError:
+                return
+            self.queries += 1
+            query_id = struct.unpack('!H', data[:2])[0]
+            name, offset = propagation._read_name(data, 12)
+            qtype = struct.unpack('!H', data[offset:offset + 2])[0]
+
+            answers = [self._rr(name, qtype, x) for x in self.records.get((name, qtype), [])]
+            additional = []
+            if qtype == propagation.TYPE_NS:
+                for host in self.records.get((name, qtype), []):
+                    additional += [self._rr(host, propagation.TYPE_A, x)
+                                   for x in self.records.get((host, propagation.TYPE_A), [])]
+            header = struct.pack('!HHHHHH', query_id, 0x8400, 1, len(answers), 0, len(additional))
+            self.sock.sendto(header + data[12:offset + 4] + b''.join(answers + additional), peer)
+
+    def close(self):
+        self.sock.close()
+
+
+class TestPropagation(unittest.TestCase):
+
+    def setUp(self):
+        self.servers = [StubDns(), StubDns()]
+
+    def tearDown(self):
+        for server in self.servers:
+            server.close()
+
+    def test_query(self):
+
+        server = self.servers[0]
+        server.records[('_acme-challenge.simpa.io', propagation.TYPE_TXT)] = ['abc', 'def']
+        response = propagation.query(server.address, '_acme-challenge.simpa.io', propagation.TYPE_TXT)
+        self.assertTrue(response['authoritative'])
+        self.assertEqual(['abc', 'def'], [x[2] for x in response['answers']])
+
+    def test_wait(self):
+
+        name = '_acme-challenge.simpa.io'
+        self.servers[0].records[(name, propagation.TYPE_TXT)] = ['abc']
+
+        def publish():
+            time.sleep(0.3)
+            self.servers[1].records[(name, propagation.TYPE_TXT)] = ['old', 'abc']
+
+        thread = threading.Thread(target=publish)
+        thread.start()
+        checker = PropagationChecker(nameservers=[x.address for x in self.servers], timeout=5, interval=0.05)
+        waited = checker.wait(name, 'abc', zone='simpa.io')
+        thread.join()
+        self.assertGreaterEqual(waited, 0.3)
+        self.assertLess(waited, 2)
+        # the server already serving the value is not polled again
+        self.assertEqual(1, self.servers[0].queries)
+
+    def test_timeout(self):
+
+        name = '_acme-challenge.simpa.io'
+        self.servers[0].records[(name, propagation.TYPE_TXT)] = ['abc']
+        checker = PropagationChecker(nameservers=[x.address for x in self.servers], timeout=0.3, interval=0.05)
+        with self.assertRaises(PropagationTimeout) as context:
+            checker.wait(name, 'abc', zone='simpa.io')
+        self.assertEqual([self.servers[1].address], context.exception.pending)
+
+    def test_authoritative(self):
+
+        resolver = self.servers[0]
+        resolver.records[('simpa.io', propagation.TYPE_NS)] = ['ns0.dnsmadeeasy.com', 'ns1.dnsmadeeasy.com']
+        resolver.records[('ns0.dnsmadeeasy.com', propagation.TYPE_A)] = ['192.0.2.10']
+        checker = PropagationChecker(resolvers=[resolver.address])
+        self.assertEqual(['192.0.2.10'], checker.authoritative('simpa.io'))
+
+
+if __name__ == '__main__':
+    unittest.main()
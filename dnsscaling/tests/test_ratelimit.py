@@ -0,0 +1,66 @@
+import time
+import unittest
+
+from dnsscaling.ratelimit import QuotaExhausted, RequestScheduler
+
+
+class TestRequestScheduler(unittest.TestCase):
+
+    def test_burst_then_pace(self):
+
+        scheduler = RequestScheduler(limit=5, window=0.5)
+        for i in range(5):
+            self.assertEqual(0, round(scheduler.acquire(), 2))
+
+        waited = scheduler.acquire()
+        self.assertTrue(0.05 < waited < 0.5)
+
+    def test_headers(self):
+
+        scheduler = RequestScheduler(limit=150, window=300)
+        scheduler.update({'x-dnsme-requestLimit': '200', 'x-dnsme-requestsRemaining': '3'})
+
+        budget = scheduler.budget()
+        self.assertEqual(200, budget['limit'])
+        self.assertEqual(3, budget['remaining'])
+        self.assertEqual(3, budget['tokens'])
+        self.assertEqual(0, budget['wait'])
+
+        scheduler.exhausted()
+        self.assertEqual(0, scheduler.budget()['tokens'])
+        self.assertTrue(scheduler.budget()['wait'] > 1)
+
+    def test_backoff(self):
+
+        scheduler = RequestScheduler(limit=10, window=10, max_backoff=8)
+        # each rejection in a row backs off longer, between one refill interval and the ceiling
+        waits = []
+        for i in range(5):
+            backoff = scheduler.exhausted()
+            self.assertTrue(1 <= backoff <= min(8, 2 ** i), backoff)
+            waits.append(scheduler.budget()['wait'])
+        self.assertEqual(5, scheduler.rejections)
+        self.assertTrue(waits[-1] >= 1)
+
+        scheduler.accepted()
+        self.assertEqual(0, scheduler.rejections)
+        self.assertTrue(1 <= scheduler.exhausted() <= 1.0001)
+
+        # jittered, so clients rejected together do not retry together
+        backoffs = set()
+        for _ in range(20):
+            scheduler.rejections = 3
+            backoffs.add(round(scheduler.exhausted(), 3))
+        self.assertGreater(len(backoffs), 10)
+
+    def test_max_wait(self):
+
+        scheduler = RequestScheduler(limit=1, window=60, max_wait=0.1)
+        scheduler.acquire()
+        start = time.monotonic()
+        self.assertRaises(QuotaExhausted, scheduler.acquire)
+        self.assertTrue(time.monotonic() - start < 0.1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+import io
+import json
+import unittest
+
+from dnsscaling.dnsapi import DnsMeApi
+from dnsscaling.mock_dnsme import MockDnsMe
+from dnsscaling import reconcile
+
+
+class TestReconcile(unittest.TestCase):
+
+    def _api(self):
+
+        mock = MockDnsMe()
+        mock.add_zone('simpa.io', site_id=7)
+        ids = [mock.add_record(7, name, type, value)['id'] for name, type, value in [
+            ('www', 'A', '10.0.0.1'), ('www', 'A', '10.0.0.2'), ('www', 'A', '10.0.0.2'), ('old', 'A', '10.0.0.9'),
+            ('www', 'TXT', 'token')]]
+        api = DnsMeApi(test_mode=True, credentials=mock.credentials)
+        mock.install(api)
+        return api, mock, ids
+
+    def test_read_desired(self):
+
+        text = '# fleet\nwww 10.0.0.1\nwww.simpa.io. 10.0.0.2\n@ 10.0.0.3\n'
+        self.assertEqual({('www', '10.0.0.1'), ('www', '10.0.0.2'), ('', '10.0.0.3')},
+                         reconcile.read_desired(io.StringIO(text), site='simpa.io'))
+
+        text = json.dumps([{'name': 'www', 'value': '10.0.0.1'}, ['api', '10.0.0.4']])
+        self.assertEqual({('www', '10.0.0.1'), ('api', '10.0.0.4')}, reconcile.read_desired(io.StringIO(text)))
+
+    def test_plan(self):
+
+        api, mock, ids = self._api()
+        desired = {('www', '10.0.0.2'), ('www', '10.0.0.3')}
+
+        changes, results = reconcile.reconcile(api, 'simpa.io', desired, dry_run=True)
+        self.assertIsNone(results)
+        self.assertEqual([ids[0], ids[2]], [x['id'] for x in changes['delete']])
+        self.assertEqual([('www', '10.0.0.3')], [(x['name'], x['value']) for x in changes['create']])
+        self.assertEqual(1, changes['unchanged'])
+        self.assertEqual(5, len(mock.records(7)))
+
+        changes = reconcile.plan(api, 'simpa.io', desired, prune=True)
+        self.assertEqual([ids[0], ids[2], ids[3]], [x['id'] for x in changes['delete']])
+
+    def test_apply(self):
+
+        api, mock, ids = self._api()
+        desired = {('www', '10.0.0.2'), ('www', '10.0.0.3')}
+
+        changes, results = reconcile.reconcile(api, 'simpa.io', desired)
+        self.assertTrue(all(x['success'] for x in results['create'] + results['delete']))
+        self.assertEqual({('www', '10.0.0.2'), ('www', '10.0.0.3'), ('old', '10.0.0.9')},
+                         {(x['name'], x['value']) for x in mock.records(7) if x['type'] == 'A'})
+        self.assertIn('1 to create, 2 to delete, 1 unchanged', reconcile.format_plan(changes, results))
+
+        # a second pass has nothing to do
+        changes, results = reconcile.reconcile(api, 'simpa.io', desired)
+        self.assertEqual(([], []), (changes['create'], changes['delete']))
+
+    def test_apply_create_first(self):
+
+        def record_calls(api, fail=''):
+            calls = []
+            add_records, delete_records = api.add_records, api.delete_records
+
+            def add(site, records):
+                calls.append('create')
+                if fail:
+                    return [{'record': x, 'success': x['name'] != fail, 'error': 'Code 500'} for x in records]
+                return add_records(site, records)
+
+            def delete(site, record_ids):
+                calls.append('delete')
+                return delete_records(site, record_ids)
+
+            api.add_records, api.delete_records = add, delete
+            return calls
+
+        api, mock, ids = self._api()
+        calls = record_calls(api)
+        reconcile.reconcile(api, 'simpa.io', {('www', '10.0.0.3')})
+        self.assertEqual(['create', 'delete'], calls)
+
+        # a failed create keeps the old records of the name
+        api, mock, ids = self._api()
+        record_calls(api, fail='www')
+        changes, results = reconcile.reconcile(api, 'simpa.io', {('www', '10.0.0.3'), ('old', '10.0.0.8')})
+        self.assertEqual([str(ids[3])], [x['id'] for x in results['delete'] if x['success']])
+        self.assertEqual(3, len([x for x in results['delete'] if not x['success']]))
+        self.assertEqual({('www', '10.0.0.1'), ('www', '10.0.0.2')},
+                         {(x['name'], x['value']) for x in mock.records(7) if x['type'] == 'A'})
+
+
+if __name__ == '__main__':
+    unittest.main()
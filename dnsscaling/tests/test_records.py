@@ -0,0 +1,118 @@
+import unittest
+
+from dnsscaling.records import Record, RecordIndex, StringTable, Zone, pack_ipv4, unpack_ipv4
+
+
+def _records():
+    return [
+        {'id': 1, 'type': 'A', 'name': 'www', 'value': '10.0.0.1'},
+        {'id': 2, 'type': 'A', 'name': 'www', 'value': '10.0.0.2'},
+        {'id': 3, 'type': 'A', 'name': 'api', 'value': '10.0.0.1'},
+        {'id': 4, 'type': 'TXT', 'name': 'www', 'value': 'token'},
+    ]
+
+
+class TestRecordIndex(unittest.TestCase):
+
+    def test_find(self):
+
+        index = RecordIndex(_records())
+        self.assertEqual([1, 2], [x['id'] for x in index.find(type='A', name='www')])
+        self.assertEqual([1, 3], [x['id'] for x in index.find(type='A', value='10.0.0.1')])
+        self.assertEqual([1], [x['id'] for x in index.find(type='A', name='www', value='10.0.0.1')])
+        self.assertEqual([1, 2, 4], [x['id'] for x in index.find(name='www')])
+        self.assertEqual([], index.find(type='CNAME', name='www'))
+
+    def test_add_remove(self):
+
+        index = RecordIndex(_records())
+        index.add({'id': 5, 'type': 'A', 'name': 'www', 'value': '10.0.0.5'})
+        self.assertEqual(3, len(index.find(type='A', name='www')))
+
+        self.assertEqual('10.0.0.1', index.remove(1)['value'])
+        self.assertIsNone(index.remove(1))
+        self.assertEqual([3], [x['id'] for x in index.find(type='A', value='10.0.0.1')])
+        self.assertEqual(4, len(index))
+
+        # re adding an id replaces the old entry
+        index.add({'id': 2, 'type': 'A', 'name': 'www', 'value': '10.0.0.9'})
+        self.assertEqual([], index.find(type='A', value='10.0.0.2'))
+        self.assertEqual('10.0.0.9', index.get('2')['value'])
+
+    def test_stale(self):
+
+        index = RecordIndex(_records(), ttl=60)
+        self.assertFalse(index.stale)
+        index.fetched -= 61
+        self.assertTrue(index.stale)
+
+
+class TestZone(unittest.TestCase):
+
+    def test_find(self):
+
+        zone = Zone(reversed(_records()))
+        self.assertEqual([1, 2], [x.id for x in zone.find(type='A', name='www')])
+        self.assertEqual([1, 3], [x.id for x in zone.find(type='A', value='10.0.0.1')])
+        self.assertEqual([1], [x.id for x in zone.find(type='A', name='www', value='10.0.0.1')])
+        self.assertEqual([1, 2, 4], [x.id for x in zone.find(name='www')])
+        self.assertEqual([4], [x.id for x in zone.find(value='token')])
+        self.assertEqual([], zone.find(type='CNAME', name='www'))
+        self.assertEqual('api', zone.get('3').name)
+        self.assertIsNone(zone.get(9))
+
+    def test_add_remove(self):
+
+        zone = Zone(_records())
+        zone.add({'id': 0, 'type': 'A', 'name': 'www', 'value': '10.0.0.5'})
+        zone.add(Record(2, 'A', 'www', '10.0.0.9'))
+        self.assertEqual([0, 1, 2, 3, 4], [x.id for x in zone])
+        self.assertEqual([], zone.find(type='A', value='10.0.0.2'))
+
+        self.assertEqual('10.0.0.1', zone.remove(1).value)
+        self.assertIsNone(zone.remove(1))
+        self.assertNotIn(1, zone)
+        self.assertEqual(4, len(zone))
+        # the name and value indexes follow adds and removes
+        self.assertEqual([0, 2, 4], [x.id for x in zone.find(name='www')])
+        self.assertEqual([2], [x.id for x in zone.find(value='10.0.0.9')])
+        self.assertEqual([3], [x.id for x in zone.find(value='10.0.0.1')])
+
+    def test_strings(self):
+
+        strings = StringTable()
+        codes = [strings.code('host%d' % x) for x in range(1000)]
+        self.assertEqual(list(range(1000)), codes)
+        self.assertEqual(500, strings.code('host500'))
+        self.assertEqual(999, strings.lookup('host999'))
+        self.assertIsNone(strings.lookup('host1000'))
+        self.assertEqual('host7', strings[7])
+        self.assertEqual(1000, len(strings))
+
+    def test_json(self):
+
+        records = [dict(x, ttl=60, gtdLocation='DEFAULT') for x in _records()]
+        records.append({'id': 5, 'type': 'A', 'name': 'odd', 'value': '10.1', 'ttl': 30, 'gtdLocation': 'DEFAULT'})
+        # the type specific fields are kept, other api fields are not
+        records.append({'id': 6, 'type': 'MX', 'name': '', 'value': 'mx.simpa.io.', 'ttl': 60, 'gtdLocation': 'EUROPE',
+                        'mxLevel': 10})
+        records.append({'id': 7, 'type': 'SRV', 'name': '_sip._tcp', 'value': 'sip.simpa.io.', 'ttl': 60,
+                        'gtdLocation': 'DEFAULT', 'priority': 1, 'weight': 5, 'port': 5060})
+        zone = Zone.from_json([dict(x, failover=False) for x in records])
+        self.assertEqual(records, zone.to_json())
+        self.assertEqual({'mxLevel': 10}, zone.get(6).fields)
+        self.assertEqual(Record.from_json(records[-1]), zone.remove(7))
+        self.assertNotIn(7, zone._fields)
+
+        self.assertEqual(0x0a000001, pack_ipv4('10.0.0.1'))
+        self.assertEqual('10.0.0.1', unpack_ipv4(0x0a000001))
+        self.assertIsNone(pack_ipv4('10.1'))
+        self.assertIsNone(pack_ipv4('token'))
+
+        # type and name strings are shared between records
+        a, b = Record.from_json(records[0]), Record.from_json(dict(records[1], name=''.join(['w', 'ww'])))
+        self.assertIs(a.name, b.name)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+import unittest
+
+import requests
+
+from dnsscaling.retry import RetryPolicy, retry_after
+
+
+class TestRetryPolicy(unittest.TestCase):
+
+    def test_classification(self):
+
+        policy = RetryPolicy()
+        self.assertTrue(policy.retryable_status('GET', 503))
+        self.assertTrue(policy.retryable_status('DELETE', 500))
+        self.assertFalse(policy.retryable_status('GET', 404))
+        self.assertFalse(policy.retryable_status('POST', 500))
+        self.assertTrue(policy.retryable_status('POST', 429))
+
+        self.assertTrue(policy.retryable_exception('GET', requests.exceptions.ReadTimeout()))
+        self.assertFalse(policy.retryable_exception('POST', requests.exceptions.ReadTimeout()))
+        self.assertTrue(policy.retryable_exception('POST', requests.exceptions.ConnectTimeout()))
+
+    def test_backoff(self):
+
+        policy = RetryPolicy(base_delay=1, max_delay=5)
+        for attempt in range(6):
+            delay = policy.backoff(attempt)
+            self.assertTrue(0 <= delay <= min(5, 2 ** attempt))
+
+        r = requests.Response()
+        r.headers['Retry-After'] = '30'
+        self.assertEqual(30, retry_after(r))
+        self.assertEqual(30, policy.delay(0, r))
+
+    def test_budget(self):
+
+        policy = RetryPolicy(max_attempts=3, budget_ratio=0.5, budget_max=2)
+        self.assertTrue(policy.allow_retry(0))
+        self.assertFalse(policy.allow_retry(2))
+        self.assertTrue(policy.allow_retry(1))
+        # budget spent, two more requests earn one retry
+        self.assertFalse(policy.allow_retry(0))
+        policy.record_request()
+        policy.record_request()
+        self.assertTrue(policy.allow_retry(0))
+        # retries without an attempt limit take from the same budget
+        policy.record_request()
+        policy.record_request()
+        self.assertTrue(policy.spend())
+        self.assertFalse(policy.spend())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from dnsscaling.dnsapi import DnsMeApi
+from dnsscaling.mock_dnsme import MockDnsMe
+from dnsscaling import snapshot
+
+
+class TestSnapshot(unittest.TestCase):
+
+    def setUp(self):
+        self.tdir = tempfile.mkdtemp(dir='./')
+
+    def tearDown(self):
+        shutil.rmtree(self.tdir)
+
+    def _api(self):
+
+        mock = MockDnsMe()
+        mock.add_zone('simpa.io', records=250, site_id=7)
+        mock.add_record(7, 'www', 'TXT', 'token "quoted"\nline', ttl=60)
+        api = DnsMeApi(test_mode=True, credentials=mock.credentials)
+        mock.install(api)
+        return api, mock
+
+    def test_export_load(self):
+
+        api, mock = self._api()
+        path = os.path.join(self.tdir, 'simpa.jsonl')
+        self.assertEqual(251, snapshot.export_zone(api, 'simpa.io', path, page_size=100))
+        self.assertEqual(3, mock.stats['endpoints']['records'])
+        with open(path) as f:
+            self.assertEqual(252, len(f.readlines()))
+
+        saved = snapshot.load_snapshot(path)
+        self.assertEqual(('simpa.io', '7', 251), (saved.site, saved.site_id, len(saved)))
+        self.assertEqual(mock.records(7)[-1]['value'], saved.zone.find(type='TXT')[0].value)
+
+        copy = os.path.join(self.tdir, 'copy.jsonl')
+        saved.save(copy)
+        self.assertEqual(saved.zone.to_json(), snapshot.load_snapshot(copy).zone.to_json())
+
+    def test_diff_restore(self):
+
+        api, mock = self._api()
+        path = os.path.join(self.tdir, 'simpa.jsonl')
+        snapshot.export_zone(api, 'simpa.io', path)
+        saved = snapshot.load_snapshot(path)
+
+        # a bad mass change: deleted records, an added one and a changed ttl
+        records = mock.records(7)
+        api.delete_records('simpa.io', [x['id'] for x in records[:50]])
+        api.add_a_record('simpa.io', 'bad', '192.0.2.1')
+        api.delete_txt_record('simpa.io', 'www')
+        api.add_txt_record('simpa.io', 'www', records[-1]['value'], ttl=300)
+
+        changes = snapshot.diff(saved, snapshot.live_snapshot(api, 'simpa.io'))
+        self.assertEqual(['bad'], [x.name for x in changes['added']])
+        self.assertEqual(50, len(changes['removed']))
+        self.assertEqual([(60, 300)], [(old.ttl, new.ttl) for old, new in changes['changed']])
+        self.assertEqual(200, changes['unchanged'])
+
+        mock.reset_stats()
+        changes, results = snapshot.restore(api, saved, prune=True)
+        self.assertTrue(all(x['success'] for x in results['create'] + results['update'] + results['delete']))
+        # the changed ttl is updated in place
+        self.assertEqual({'records': 1, 'records_create_multi': 1, 'records_update_multi': 1, 'records_delete_multi': 1},
+                         mock.stats['endpoints'])
+
+        after = snapshot.diff(saved, snapshot.live_snapshot(api, 'simpa.io'))
+        self.assertEqual(([], [], [], 251), (after['added'], after['removed'], after['changed'], after['unchanged']))
+
+    def test_restore_keeps(self):
+
+        api, mock = self._api()
+        mock.add_record(7, '', 'MX', 'mx.simpa.io.', ttl=60, mxLevel=10, gtdLocation='EUROPE')
+        mock.add_record(7, '_sip._tcp', 'SRV', 'sip.simpa.io.', priority=1, weight=5, port=5060)
+        path = os.path.join(self.tdir, 'simpa.jsonl')
+        snapshot.export_zone(api, 'simpa.io', path)
+        saved = snapshot.load_snapshot(path)
+        self.assertEqual({'mxLevel': 10}, saved.zone.find(type='MX')[0].fields)
+
+        # the type specific fields and gtd locations are restored, a changed mxLevel in place
+        mx, srv = [x for x in mock.records(7) if x['type'] in ('MX', 'SRV')]
+        api.delete_records('simpa.io', [srv['id']])
+        api.update_records('simpa.io', [(mx, dict(mx, mxLevel=20))])
+        api.add_a_record('simpa.io', 'new', '192.0.2.1')
+
+        changes, results = snapshot.restore(api, saved)
+        self.assertEqual([('mxLevel', 20, 10)], snapshot._changed_fields(*changes['changed'][0]))
+        lines = snapshot.format_diff(changes, prune=False).splitlines()
+        self.assertEqual(['= new A 192.0.2.1', '+ _sip._tcp SRV sip.simpa.io.', '~ @ MX mx.simpa.io. mxLevel 20 -> 10',
+                          '1 added, 1 kept (not pruned), 1 changed, 251 unchanged'],
+                         [x.split(' (id')[0] for x in lines])
+        self.assertEqual([], results['delete'])
+
+        live = {x['type']: x for x in mock.records(7)}
+        self.assertEqual((10, 'EUROPE'), (live['MX']['mxLevel'], live['MX']['gtdLocation']))
+        self.assertEqual((1, 5, 5060), (live['SRV']['priority'], live['SRV']['weight'], live['SRV']['port']))
+        # not pruned by default
+        after = snapshot.diff(saved, snapshot.live_snapshot(api, 'simpa.io'))
+        self.assertEqual((['new'], [], 0), ([x.name for x in after['added']], after['removed'], len(after['changed'])))
+
+
+if __name__ == '__main__':
+    unittest.main()
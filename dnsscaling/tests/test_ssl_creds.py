@@ -33,7 +33,7 @@ class TestSslCredentials(unittest.TestCase):
 
         for pem in PEMFILES:
             with open(os.path.join(dir, pem), 'wb') as f:
-                f.write(pem + value)
+                f.write((pem + value).encode('utf-8'))
 
     def test_empty_efs(self):
 
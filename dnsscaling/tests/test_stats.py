@@ -0,0 +1,72 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from dnsscaling.dnsapi import DnsMeApi
+from dnsscaling.mock_dnsme import MockDnsMe
+from dnsscaling.retry import RetryPolicy
+from dnsscaling.ssl_credentials import SslCredentials
+from dnsscaling.stats import Instrumentation, StatsCollector, endpoint_class
+
+
+class TestStats(unittest.TestCase):
+
+    def test_endpoint_class(self):
+
+        base = 'https://api.dnsmadeeasy.com/V2.0/dns/managed'
+        self.assertEqual('domains', endpoint_class('GET', base + '/'))
+        self.assertEqual('records', endpoint_class('GET', base + '/7/records?type=A'))
+        self.assertEqual('record', endpoint_class('DELETE', base + '/7/records/123'))
+        self.assertEqual('records/createMulti', endpoint_class('POST', base + '/7/records/createMulti'))
+
+    def test_request_events(self):
+
+        mock = MockDnsMe()
+        mock.add_zone('simpa.io')
+        mock.errors = [503]
+        collector = StatsCollector()
+        api = DnsMeApi(test_mode=True, credentials=mock.credentials, retry_policy=RetryPolicy(base_delay=0.001),
+                       instrumentation=Instrumentation([collector]))
+        mock.install(api)
+
+        api.add_a_record('simpa.io', 'www', '10.0.0.1')
+
+        requests = [x for x in collector.events if x['event'] == 'request']
+        self.assertEqual([503, 200, 201], [x['status'] for x in requests])
+        self.assertEqual([0, 1, 0], [x['retries'] for x in requests])
+        self.assertEqual(['get_site_id', 'get_site_id', 'upsert_record'], [x['span'] for x in requests])
+        self.assertTrue(all(x['bytes'] > 0 and x['latency'] >= 0 for x in requests))
+
+        report = collector.report()
+        self.assertEqual(3, report['requests']['count'])
+        self.assertEqual(2, report['requests']['endpoints']['GET domains']['count'])
+        self.assertEqual(1, report['spans']['add_a_record']['count'])
+        self.assertEqual(1, report['spans']['get_site_id']['count'])
+
+    def test_ssl_spans(self):
+
+        tdir = tempfile.mkdtemp(dir='./')
+        try:
+            efs = os.path.join(tdir, 'efs') + '/'
+            os.makedirs(efs + 'tmp.url.com')
+            for pem in ['fullchain.pem', 'privkey.pem', 'cert.pem', 'chain.pem']:
+                with open(os.path.join(efs + 'tmp.url.com', pem), 'w') as f:
+                    f.write(pem)
+
+            collector = StatsCollector()
+            SslCredentials('tmp.url.com', 'e@mail.com', efs_path=efs, lets_encrypt_path=os.path.join(tdir, 'le/'),
+                           test_mode=True, instrumentation=Instrumentation([collector]))
+            self.assertIn('copy', collector.report()['spans'])
+
+            path = os.path.join(tdir, 'stats.json')
+            collector.write(path)
+            with open(path) as f:
+                self.assertEqual(1, json.load(f)['spans']['copy']['count'])
+        finally:
+            shutil.rmtree(tdir)
+
+
+if __name__ == '__main__':
+    unittest.main()
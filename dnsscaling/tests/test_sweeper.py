@@ -0,0 +1,126 @@
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from dnsscaling.dnsapi import DnsMeApi
+from dnsscaling.mock_dnsme import MockDnsMe
+from dnsscaling.sweeper import Ec2Checker, FileChecker, HttpChecker, format_report, sweep, write_alive
+
+
+class _Health(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        self.send_response(200 if self.path == '/health' else 503)
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _Ec2(object):
+    """describe_instances paginator of a fake ec2 client."""
+
+    def __init__(self, running):
+        self.running = running
+        self.filters = []
+
+    def get_paginator(self, name):
+        return self
+
+    def paginate(self, Filters):
+        self.filters.append(Filters)
+        ips = [x for x in Filters[0]['Values'] if x in self.running]
+        return [{'Reservations': [{'Instances': [{'PublicIpAddress': ip} for ip in ips]}]}]
+
+
+class _Dead(object):
+
+    def check(self, ips):
+        return {ip: False for ip in ips}
+
+
+class TestSweeper(unittest.TestCase):
+
+    def setUp(self):
+        self.tdir = tempfile.mkdtemp(dir='./')
+
+    def tearDown(self):
+        shutil.rmtree(self.tdir)
+
+    def _api(self, alive, dead):
+
+        mock = MockDnsMe()
+        mock.add_zone('simpa.io', site_id=7)
+        for i in range(alive + dead):
+            mock.add_record(7, 'www', 'A', '192.0.2.%d' % i)
+        mock.add_record(7, 'www', 'TXT', 'token')
+        api = DnsMeApi(test_mode=True, credentials=mock.credentials)
+        mock.install(api)
+        for i in range(alive + dead):
+            self.assertTrue(write_alive('192.0.2.%d' % i, [], self.tdir, agent=True))
+        # the agents of the dead instances stopped touching their files an hour ago
+        for i in range(alive, alive + dead):
+            os.utime(os.path.join(self.tdir, '192.0.2.%d' % i), (time.time() - 3600,) * 2)
+        return api, mock
+
+    def test_sweep(self):
+
+        api, mock = self._api(alive=7, dead=2)
+        # a static host, never registered by dnsscaling -a, has no alive file, nothing refreshes the
+        # file of an instance without an agent
+        mock.add_record(7, 'mail', 'A', '198.51.100.1')
+        mock.add_record(7, 'www', 'A', '198.51.100.2')
+        self.assertTrue(write_alive('198.51.100.2', [], self.tdir))
+        os.utime(os.path.join(self.tdir, '198.51.100.2'), (time.time() - 3600,) * 2)
+        mock.reset_stats()
+        report = sweep(api, 'simpa.io', FileChecker(self.tdir))
+        self.assertEqual(['192.0.2.7', '192.0.2.8'], [x.value for x in report['dead']])
+        self.assertEqual((11, 2, 9), (report['records'], report['deleted'], report['remaining']))
+        self.assertEqual(9, len([x for x in mock.records(7) if x['type'] == 'A']))
+        self.assertEqual({'domains': 1, 'records': 1, 'records_delete_multi': 1}, mock.stats['endpoints'])
+        self.assertIn('11 -> 9 A records (18.2% smaller)', format_report(report))
+
+        # a checker answering for every ip still only sweeps the given names
+        report = sweep(api, 'simpa.io', _Dead(), names={'www'}, max_fraction=1.0, dry_run=True)
+        self.assertEqual(8, len(report['dead']))
+        report = sweep(api, 'simpa.io', _Dead(), names={'mail', 'api'}, max_fraction=1.0)
+        self.assertEqual(['198.51.100.1'], [x.value for x in report['dead']])
+
+    def test_safety_threshold(self):
+
+        api, mock = self._api(alive=2, dead=8)
+        report = sweep(api, 'simpa.io', FileChecker(self.tdir, max_age=60), max_fraction=0.5)
+        self.assertTrue(report['aborted'])
+        self.assertEqual(8, len(report['dead']))
+        self.assertEqual(11, len(mock.records(7)))
+
+        report = sweep(api, 'simpa.io', FileChecker(self.tdir, max_age=60), max_fraction=0.8, dry_run=True)
+        self.assertEqual(('', 0), (report['aborted'], report['deleted']))
+        self.assertEqual(11, len(mock.records(7)))
+
+    def test_checkers(self):
+
+        server = HTTPServer(('127.0.0.1', 0), _Health)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            port = server.server_address[1]
+            self.assertEqual({'127.0.0.1': True}, HttpChecker(port=port, path='/health').check(['127.0.0.1']))
+            self.assertEqual({'127.0.0.1': False}, HttpChecker(port=port, path='/down').check(['127.0.0.1']))
+        finally:
+            server.shutdown()
+            server.server_close()
+        self.assertEqual({'127.0.0.1': False}, HttpChecker(port=port, timeout=0.5).check(['127.0.0.1']))
+
+        client = _Ec2({'192.0.2.%d' % i for i in range(0, 256, 2)})
+        alive = Ec2Checker(client=client).check(['192.0.2.%d' % i for i in range(256)])
+        self.assertEqual(128, sum(alive.values()))
+        self.assertTrue(alive['192.0.2.2'])
+        self.assertEqual(2, len(client.filters))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -25,6 +25,10 @@ setup(
         'console_scripts': [
             'dnsscaling=dnsscaling.dnsapi:run_dnsscaling',
             'dnscertbot=dnsscaling.ssl_credentials:run_sslcredentials',
+            'dnsderegister=dnsscaling.deregister:run_deregister',
+            'dnssweep=dnsscaling.sweeper:run_sweeper',
+            'dnskeypool=dnsscaling.keys:run_keypool',
+            'dnscerts=dnsscaling.certificates:run_inventory',
         ],
     },
 )